@@ -0,0 +1,218 @@
+"""
+Concurrent clients for Sharrock.
+
+The async clients mirror HttpClient, ResourceClient and ModelResourceClient, but
+every call returns immediately with a pending result (an AsyncResult, with get(),
+ready() and wait() methods) while the request runs on a bounded pool of worker
+threads sharing the pooled transport.  Use gather() to wait on many pending
+results at once, or gather_calls() to fire a batch of calls with bounded
+concurrency.
+
+    c = AsyncHttpClient('http://example.com/api','myapp','1.0')
+    hello, goodbye = gather(c.hello(name='Loren'),c.goodbye(name='Loren'))
+
+The worker pool should be no larger than the transport's connection pool
+(pool_maxsize), or the extra connections will not be kept alive.
+"""
+from sharrock.client import HttpClient, ResourceClient, ModelResourceClient
+from multiprocessing.pool import ThreadPool
+import threading
+
+class CallPool(object):
+    """
+    A bounded pool of worker threads that runs client calls.
+    """
+    def __init__(self,concurrency=10):
+        self.concurrency = concurrency
+        self._pool = ThreadPool(concurrency)
+
+    def submit(self,func,*args,**kwargs):
+        """
+        Runs the function on the pool.  Returns an AsyncResult.
+        """
+        return self._pool.apply_async(func,args,kwargs)
+
+    def close(self):
+        """
+        Waits for pending calls and stops the worker threads.
+        """
+        self._pool.close()
+        self._pool.join()
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_call_pool():
+    """
+    Gets the pool shared by async clients that have not been given their own.
+    """
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = CallPool()
+    return _default_pool
+
+def set_default_call_pool(pool):
+    """
+    Replaces the shared call pool, for example to change its concurrency.
+    """
+    global _default_pool
+    with _default_pool_lock:
+        _default_pool = pool
+
+def gather(*results,**kwargs):
+    """
+    Waits for the pending results and returns their values, in order.  The first
+    failed call raises its exception, unless return_exceptions=True is passed, in
+    which case exceptions are returned in place of values.  An optional timeout (in
+    seconds) applies to each result.
+    """
+    return_exceptions = kwargs.get('return_exceptions',False)
+    timeout = kwargs.get('timeout',None)
+
+    values = []
+    for result in results:
+        try:
+            values.append(result.get(timeout))
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            values.append(e)
+    return values
+
+def gather_calls(calls,concurrency=None,pool=None,return_exceptions=False,timeout=None):
+    """
+    Runs the calls (callables taking no arguments, usually blocking client calls)
+    on the pool, with at most concurrency of them in flight at once, and returns
+    their values in order.  The caller waits for a slot before submitting each call,
+    rather than a pool thread, so calls that themselves submit to the pool cannot
+    deadlock it.
+    """
+    pool = pool or default_call_pool()
+    if concurrency:
+        limit = threading.BoundedSemaphore(concurrency)
+        def bounded(call):
+            try:
+                return call()
+            finally:
+                limit.release()
+        results = []
+        for call in calls:
+            limit.acquire()
+            try:
+                results.append(pool.submit(bounded,call))
+            except:
+                limit.release()
+                raise
+    else:
+        results = [pool.submit(call) for call in calls]
+    return gather(*results,return_exceptions=return_exceptions,timeout=timeout)
+
+class AsyncHttpClient(HttpClient):
+    """
+    Concurrent version of HttpClient.  call() and the named service methods return
+    pending results.
+    """
+    def __init__(self,service_url,app,version,pool=None,**kwargs):
+        super(AsyncHttpClient,self).__init__(service_url,app,version,**kwargs)
+        self._pool = pool or default_call_pool()
+
+    def call(self,service_name,data=None,params={},force_descriptor_update=False,local_param_check=True,method=None,stream=False):
+        """
+        Calls the specified service on the pool.  Returns an AsyncResult.  With a single
+        flight, identical calls share the AsyncResult of the call in flight.
+        """
+        call = lambda: self._call(service_name,data,params,force_descriptor_update,local_param_check,method,stream,False)
+        http_method = method or ('POST' if data else 'GET')
+        if stream or not self._coalesces(service_name,http_method):
+            return self._pool.submit(call)
+
+        def start(finished):
+            def coalesced():
+                try:
+                    return call()
+                finally:
+                    finished()
+            return self._pool.submit(coalesced)
+        return self._single_flight.submit(self._call_key(service_name,http_method,data,params),start)
+
+class AsyncResourceOperation(object):
+    """
+    Wraps a ResourceOperation to run it on the pool.
+    """
+    def __init__(self,operation,pool):
+        self.operation = operation
+        self.pool = pool
+
+    def __call__(self,data=None,params=None,local_params_check=True,stream=False):
+        return self.pool.submit(self.operation,data=data,params=params,local_params_check=local_params_check,stream=stream)
+
+class AsyncResourceClient(ResourceClient):
+    """
+    Concurrent version of ResourceClient.  The http method operations return pending
+    results.
+    """
+    def __init__(self,service_url,app,version,resource_slug,pool=None,**kwargs):
+        super(AsyncResourceClient,self).__init__(service_url,app,version,resource_slug,**kwargs)
+        self._pool = pool or default_call_pool()
+
+    def _operation(self,method_name):
+        operation = super(AsyncResourceClient,self)._operation(method_name)
+        if operation is None:
+            return None
+        return AsyncResourceOperation(operation,self._pool)
+
+class AsyncModelResourceClient(ModelResourceClient):
+    """
+    Concurrent version of ModelResourceClient.  list(), count(), aggregate(),
+    group_count(), get(), get_many(), changes(), sync(), create(), update() and delete()
+    return pending results.  Each
+    runs whole on the pool, so results are decoded as they are by ModelResourceClient.
+    Streamed lists are returned as iterators, as they already yield models as they
+    arrive.
+    """
+    def __init__(self,service_url,app,version,model_resource_slug,pool=None,**kwargs):
+        super(AsyncModelResourceClient,self).__init__(service_url,app,version,model_resource_slug,**kwargs)
+        self._pool = pool or default_call_pool()
+
+    def _submit(self,method_name,*args,**kwargs):
+        """
+        Runs the ModelResourceClient method on the pool.  Returns an AsyncResult.
+        """
+        return self._pool.submit(getattr(super(AsyncModelResourceClient,self),method_name),*args,**kwargs)
+
+    def list(self,stream=False,expand=None,order_by=None,**filters):
+        if stream:
+            return super(AsyncModelResourceClient,self).list(stream=True,expand=expand,order_by=order_by,**filters)
+        return self._submit('list',expand=expand,order_by=order_by,**filters)
+
+    def count(self,**filters):
+        return self._submit('count',**filters)
+
+    def aggregate(self,aggregates,**filters):
+        return self._submit('aggregate',aggregates,**filters)
+
+    def group_count(self,field,**filters):
+        return self._submit('group_count',field,**filters)
+
+    def get(self,pk,expand=None):
+        return self._submit('get',pk,expand=expand)
+
+    def get_many(self,pks,expand=None,batch_size=1000):
+        return self._submit('get_many',pks,expand=expand,batch_size=batch_size)
+
+    def changes(self,since=None,limit=None,expand=None):
+        return self._submit('changes',since=since,limit=limit,expand=expand)
+
+    def sync(self,models=None,cursor=None,limit=None,expand=None):
+        return self._submit('sync',models=models,cursor=cursor,limit=limit,expand=expand)
+
+    def create(self,**attrs):
+        return self._submit('create',**attrs)
+
+    def update(self,pk,**attrs):
+        return self._submit('update',pk,**attrs)
+
+    def delete(self,pk):
+        return self._submit('delete',pk)
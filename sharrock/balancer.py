@@ -0,0 +1,184 @@
+"""
+Client-side load balancing across several Sharrock servers.
+
+An EndpointPool holds the service urls of equivalent servers and picks one for
+each request, either the endpoint with the fewest outstanding requests or the
+better of two picked at random (power of two choices).  It keeps per-endpoint
+request, error and latency stats.  An endpoint that fails failure_threshold
+requests in a row is ejected by a circuit breaker; after reset_timeout seconds a
+single probe request is let through, and the endpoint is brought back if it
+succeeds.
+
+Clients accept a list of urls, or an EndpointPool, in place of the service url:
+
+    pool = EndpointPool(['http://api1.example.com/api','http://api2.example.com/api'])
+    c = HttpClient(pool,'myapp','1.0')
+    pool.stats()
+"""
+from requests.exceptions import ConnectionError, Timeout
+import random
+import threading
+import time
+import logging
+
+log = logging.getLogger('sharrock')
+
+LEAST_OUTSTANDING = 'least_outstanding'
+POWER_OF_TWO = 'power_of_two'
+
+# circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class Endpoint(object):
+    """
+    A server in the pool, with its stats and circuit breaker state.
+    """
+    def __init__(self,url):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.latency = None # exponentially weighted moving average, in seconds
+        self.state = CLOSED
+        self.opened = None
+        self.probing = False
+
+    def stats(self):
+        return {'url':self.url,
+                'state':self.state,
+                'outstanding':self.outstanding,
+                'requests':self.requests,
+                'errors':self.errors,
+                'latency':self.latency}
+
+class EndpointPool(object):
+    """
+    A pool of equivalent service urls.  Safe to share between threads and clients.
+    """
+    def __init__(self,urls,strategy=LEAST_OUTSTANDING,failure_threshold=5,reset_timeout=30.0,latency_weight=0.2):
+        if not urls:
+            raise ValueError('An endpoint pool needs at least one url.')
+        if not strategy in (LEAST_OUTSTANDING,POWER_OF_TWO):
+            raise ValueError('Unknown balancing strategy %s.' % strategy)
+        self.endpoints = [Endpoint(url.rstrip('/')) for url in urls]
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_weight = latency_weight
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        """
+        The url clients build request urls from.  Requests are redirected to the chosen
+        endpoint by the BalancingTransport.
+        """
+        return self.endpoints[0].url
+
+    def _available(self,now):
+        """
+        Endpoints that may take a request.  Must be called holding the lock.
+        """
+        available = []
+        for endpoint in self.endpoints:
+            if endpoint.state == OPEN and now - endpoint.opened >= self.reset_timeout:
+                endpoint.state = HALF_OPEN
+            if endpoint.state == CLOSED or (endpoint.state == HALF_OPEN and not endpoint.probing):
+                available.append(endpoint)
+        return available
+
+    def acquire(self):
+        """
+        Picks an endpoint for a request and counts the request as outstanding.  If every
+        endpoint has been ejected, the one ejected longest ago is used anyway.
+        """
+        with self._lock:
+            now = time.time()
+            available = self._available(now)
+            if not available:
+                endpoint = min(self.endpoints,key=lambda endpoint: endpoint.opened or 0)
+            elif len(available) == 1:
+                endpoint = available[0]
+            elif self.strategy == POWER_OF_TWO:
+                first, second = random.sample(available,2)
+                endpoint = min((first,second),key=lambda endpoint: (endpoint.outstanding,endpoint.latency or 0))
+            else:
+                fewest = min(endpoint.outstanding for endpoint in available)
+                endpoint = random.choice([endpoint for endpoint in available if endpoint.outstanding == fewest])
+
+            if endpoint.state == HALF_OPEN:
+                endpoint.probing = True
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self,endpoint,latency,failed):
+        """
+        Records the outcome of a request to the endpoint.
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.latency_weight * (latency - endpoint.latency)
+
+            if failed:
+                endpoint.errors += 1
+                endpoint.consecutive_errors += 1
+                if endpoint.state == HALF_OPEN or endpoint.consecutive_errors >= self.failure_threshold:
+                    if endpoint.state != OPEN:
+                        log.warning('Ejecting endpoint %s after %d errors.' % (endpoint.url,endpoint.consecutive_errors))
+                    endpoint.state = OPEN
+                    endpoint.opened = time.time()
+            else:
+                endpoint.consecutive_errors = 0
+                if endpoint.state != CLOSED:
+                    log.info('Endpoint %s is back.' % endpoint.url)
+                endpoint.state = CLOSED
+            endpoint.probing = False
+
+    def stats(self):
+        """
+        Stats for each endpoint.
+        """
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+class BalancingTransport(object):
+    """
+    Wraps a transport, sending requests for urls under the pool's url to the endpoint
+    chosen by the pool.  Connection errors, timeouts and 5xx responses count as
+    failures of the endpoint.
+    """
+    def __init__(self,transport,pool):
+        self.transport = transport
+        self.pool = pool
+
+    def request(self,method,url,**kwargs):
+        if not url.startswith(self.pool.url):
+            return self.transport.request(method,url,**kwargs)
+
+        endpoint = self.pool.acquire()
+        start = time.time()
+        try:
+            response = self.transport.request(method,endpoint.url + url[len(self.pool.url):],**kwargs)
+        except (ConnectionError,Timeout):
+            self.pool.release(endpoint,time.time() - start,True)
+            raise
+        self.pool.release(endpoint,time.time() - start,response.status_code >= 500)
+        return response
+
+def balance(service_url,transport,strategy=LEAST_OUTSTANDING):
+    """
+    Sets up balancing for a client.  service_url may be a url, a list of urls or an
+    EndpointPool.  Returns the url to build request urls from, and the transport to
+    send them through.
+    """
+    if isinstance(service_url,basestring):
+        return service_url, transport
+    pool = service_url if isinstance(service_url,EndpointPool) else EndpointPool(service_url,strategy=strategy)
+    return pool.url, BalancingTransport(transport,pool)
@@ -0,0 +1,165 @@
+"""
+Benchmarking tools for Sharrock.  Times callables, summarizes the timings as
+ops/sec and percentiles, and compares the results against stored baselines.
+"""
+import json
+import time
+import gc
+import sys
+
+class BenchmarkRegression(Exception):
+    """
+    Indicates one or more benchmarks have fallen behind their baseline by more than
+    the allowed threshold.
+    """
+    def __init__(self,regressions):
+        self.regressions = regressions
+
+    def __str__(self):
+        return '; '.join(['%s: %.1f ops/sec vs baseline %.1f ops/sec (%+.1f%%)' % (name,current,baseline,change * 100)
+                          for name, current, baseline, change in self.regressions])
+
+def percentile(sorted_samples,pct):
+    """
+    Gets the percentile (0-100) from a list of sorted samples, using the nearest rank.
+    """
+    if not sorted_samples:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[rank]
+
+class BenchmarkResult(object):
+    """
+    The summarized timings for a single benchmark.  Latencies are in milliseconds.
+    """
+    def __init__(self,name,samples):
+        self.name = name
+        self.samples = sorted(samples)
+
+    @property
+    def count(self):
+        return len(self.samples)
+
+    @property
+    def total(self):
+        return sum(self.samples)
+
+    @property
+    def ops_per_sec(self):
+        return self.count / self.total if self.total else 0.0
+
+    @property
+    def mean(self):
+        return self.total / self.count * 1000.0 if self.count else 0.0
+
+    def percentile(self,pct):
+        return percentile(self.samples,pct) * 1000.0
+
+    def to_dict(self):
+        """
+        Converts the result to a dictionary, for storage as a baseline.
+        """
+        return {'count':self.count,
+                'ops_per_sec':self.ops_per_sec,
+                'mean':self.mean,
+                'min':self.percentile(0),
+                'p50':self.percentile(50),
+                'p90':self.percentile(90),
+                'p99':self.percentile(99),
+                'max':self.percentile(100)}
+
+class Benchmark(object):
+    """
+    A named callable to be timed.  The callable is run for a number of warmup
+    iterations (untimed) and then for the specified number of timed iterations.
+    """
+    def __init__(self,name,func,iterations=1000,warmup=50):
+        self.name = name
+        self.func = func
+        self.iterations = iterations
+        self.warmup = warmup
+
+    def run(self):
+        """
+        Runs the benchmark, returning a BenchmarkResult.
+        """
+        for i in xrange(self.warmup):
+            self.func()
+
+        samples = []
+        gc_enabled = gc.isenabled()
+        gc.disable() # keep collector pauses out of the samples
+        try:
+            for i in xrange(self.iterations):
+                start = time.time()
+                self.func()
+                samples.append(time.time() - start)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        return BenchmarkResult(self.name,samples)
+
+def run_benchmarks(benchmarks,names=None):
+    """
+    Runs the benchmarks, optionally limited to the specified names.  Returns a list of results.
+    """
+    return [benchmark.run() for benchmark in benchmarks if not names or benchmark.name in names]
+
+def load_baseline(path):
+    """
+    Loads a stored baseline.  Returns a dictionary of benchmark name to result dictionary.
+    """
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+def save_baseline(path,results):
+    """
+    Stores the results as a JSON baseline.
+    """
+    with open(path,'w') as baseline_file:
+        json.dump(dict((result.name,result.to_dict()) for result in results),baseline_file,indent=2,sort_keys=True)
+
+def compare(results,baseline,threshold=0.1):
+    """
+    Compares the results against the baseline.  Returns a list of (name, current ops/sec,
+    baseline ops/sec, relative change) tuples for each benchmark that is slower than
+    its baseline by more than the threshold.  Benchmarks missing from the baseline are skipped.
+    """
+    regressions = []
+    for result in results:
+        if not result.name in baseline:
+            continue
+        baseline_ops = baseline[result.name]['ops_per_sec']
+        if not baseline_ops:
+            continue
+        change = (result.ops_per_sec - baseline_ops) / baseline_ops
+        if change < -threshold:
+            regressions.append((result.name,result.ops_per_sec,baseline_ops,change))
+    return regressions
+
+def check(results,baseline,threshold=0.1):
+    """
+    Raises BenchmarkRegression if any of the results have regressed past the threshold.
+    """
+    regressions = compare(results,baseline,threshold=threshold)
+    if regressions:
+        raise BenchmarkRegression(regressions)
+
+def report(results,baseline=None,stream=sys.stdout):
+    """
+    Writes a table of the results to the stream, with the change against the baseline if supplied.
+    """
+    stream.write('%-40s %12s %9s %9s %9s %9s %9s\n' % ('benchmark','ops/sec','mean ms','p50 ms','p90 ms','p99 ms','change'))
+    for result in results:
+        change = ''
+        if baseline and result.name in baseline and baseline[result.name]['ops_per_sec']:
+            baseline_ops = baseline[result.name]['ops_per_sec']
+            change = '%+.1f%%' % ((result.ops_per_sec - baseline_ops) / baseline_ops * 100)
+        stream.write('%-40s %12.1f %9.3f %9.3f %9.3f %9.3f %9s\n' % (result.name,
+                                                                     result.ops_per_sec,
+                                                                     result.mean,
+                                                                     result.percentile(50),
+                                                                     result.percentile(90),
+                                                                     result.percentile(99),
+                                                                     change))
@@ -4,8 +4,20 @@ Automatic client for Sharrock.
 import json
 import urllib
 import base64
-import requests
+import threading
+import itertools
+import zlib
+import os
 from sys import flags
+from sharrock.transport import default_transport, auth_headers
+from sharrock.replicas import PinningTransport
+from sharrock.descriptorcache import default_descriptor_cache
+from sharrock.responsecache import CachingTransport
+from sharrock.streaming import iter_response, StreamError, NDJSON_CONTENT_TYPE
+from sharrock.files import MultipartBody, is_upload
+from sharrock import columnar
+from sharrock.retry import send, RetryingTransport
+from sharrock.balancer import balance, BalancingTransport, LEAST_OUTSTANDING
 import logging
 
 log = logging.getLogger('sharrock')
@@ -66,6 +78,8 @@ class ParamValidator(object):
             self.checker = self.boolean_check
         elif self.param_type == 'Wildcard':
             self.checker = self.wildcard_check
+        elif self.param_type in ('File','Stream'):
+            self.checker = self.file_check
     
     def unicode_check(self,value):
         unicode(value)
@@ -93,6 +107,10 @@ class ParamValidator(object):
     def wildcard_check(self,value):
         pass
     
+    def file_check(self,value):
+        if not value is None and not is_upload(value):
+            raise ValueError
+    
     def check(self,params):
         """
         Checks if the param is present (if required) and is of the correct data type.
@@ -123,13 +141,70 @@ class ServiceException(Exception):
     def __str__(self):
         return '%d: %s' % (self.status_code,self.content)
 
+def stream_response(response):
+    """
+    Processes a streamed response from the server, returning an iterator over the
+    values in the result.  An error sent by the server part way through the result
+    is raised as a ServiceException when it is reached.
+    """
+    if response.status_code >= 400:
+        # error
+        raise ServiceException(response.status_code,response.text)
+    return iter_stream(iter_response(response))
+
+def iter_stream(values):
+    """
+    Iterates streamed values, raising error trailers as ServiceExceptions.
+    """
+    try:
+        for value in values:
+            yield value
+    except StreamError as e:
+        raise ServiceException(e.status_code,e.content)
+
+def stream_headers(headers):
+    """
+    Adds an Accept header preferring streamed results as NDJSON, which is cheaper to
+    decode than a JSON array.
+    """
+    headers = dict(headers)
+    headers['Accept'] = '%s, application/json' % NDJSON_CONTENT_TYPE
+    return headers
+
+def columnar_headers(headers):
+    """
+    Adds an Accept header asking for list results in columnar form.
+    """
+    headers = dict(headers)
+    headers['Accept'] = '%s, application/json' % columnar.COLUMNAR_CONTENT_TYPE
+    return headers
+
+def has_uploads(values):
+    """
+    Checks if call params or data hold files to upload.
+    """
+    return isinstance(values,dict) and any(is_upload(value) for value in values.values())
+
+def descriptor_transport(transport,retry,supplied):
+    """
+    The transport a client fetches descriptors with.  None, for the descriptor cache's
+    own, unless the client was given a transport (supplied is True), or balances or
+    retries its requests.
+    """
+    if retry is not None:
+        return RetryingTransport(transport,retry)
+    if supplied or isinstance(transport,BalancingTransport):
+        return transport
+    return None
+
 class HttpService(object):
     """
     Represents a described service.
     """
-    def __init__(self,service_url,app,version,descriptor,auth_user='',auth_password=''):
+    def __init__(self,service_url,app,version,descriptor,auth_user='',auth_password='',transport=None,retry=None,hedge=None,columnar=False):
         self.service_url = '%s/%s/%s' % (service_url,app,version)
         self.descriptor = descriptor
+        self.idempotent = descriptor.get('idempotent') == 'True'
         self.params = {}
         for param in self.descriptor['params']:
             required = True if param['required'] == 'True' else False
@@ -137,6 +212,12 @@ class HttpService(object):
         
         self.user = auth_user
         self.password = auth_password
+        self.headers = auth_headers(auth_user,auth_password)
+        self.columnar_headers = columnar_headers(self.headers) if columnar else self.headers
+        self.stream_headers = stream_headers(self.headers)
+        self.transport = transport or default_transport()
+        self.retry = retry
+        self.hedge = hedge
     
     def check_params(self,params):
         """
@@ -154,23 +235,32 @@ class HttpService(object):
         else:
             log.debug('Processing response text: %s' % response.text)
             try:
+                if columnar.is_columnar(response):
+                    return columnar.decode(response.json(strict=False))
                 return response.json(strict=False)
             except ValueError:
                 # this is JSON decode error
                 log.warning('Cannot JSON decode response: %s' % response.text)
                 return [] # return empty list
     
-    def do_get(self,params):
+    def do_get(self,params,stream=False):
         """
         Makes a get request.
         """
-        response = requests.get('%s/%s.json' % (self.service_url,self.descriptor['slug']),
-                                params=params,
-                                auth=(self.user,self.password))
+        response = send(self.transport,
+                        'GET',
+                        '%s/%s.json' % (self.service_url,self.descriptor['slug']),
+                        retry=self.retry,
+                        hedge=self.hedge,
+                        params=params,
+                        headers=self.stream_headers if stream else self.columnar_headers,
+                        stream=stream)
         
+        if stream:
+            return stream_response(response)
         return self.process_response(response)
     
-    def do_post(self,data=None,params={}):
+    def do_post(self,data=None,params={},stream=False):
         """
         Makes a post request.  If data is present it will be presented as the body,
         otherwise params will be presented.  If both are defined an exception will
@@ -181,52 +271,188 @@ class HttpService(object):
         
         post_data = json.dumps(data) if data else params
         
-        response = requests.post('%s/%s.json' % (self.service_url,self.descriptor['slug']),
-                                 data=post_data,
-                                 auth=(self.user,self.password))
+        response = send(self.transport,
+                        'POST',
+                        '%s/%s.json' % (self.service_url,self.descriptor['slug']),
+                        retry=self.retry,
+                        hedge=self.hedge,
+                        idempotent=self.idempotent,
+                        data=post_data,
+                        headers=self.stream_headers if stream else self.columnar_headers,
+                        stream=stream)
+        
+        if stream:
+            return stream_response(response)
+        return self.process_response(response)
+    
+    def do_upload(self,values,stream=False):
+        """
+        Posts the values as a multipart body, reading the files among them as it is sent.
+        Uploads are not retried, as their files cannot be read again.
+        """
+        body = MultipartBody.from_values(values)
+        headers = dict(self.stream_headers if stream else self.columnar_headers)
+        headers['Content-Type'] = body.content_type
+        
+        response = send(self.transport,
+                        'POST',
+                        '%s/%s.json' % (self.service_url,self.descriptor['slug']),
+                        data=body,
+                        headers=headers,
+                        stream=stream)
         
+        if stream:
+            return stream_response(response)
         return self.process_response(response)
     
-    def call(self,data=None,params={},method='GET'):
+    def call(self,data=None,params={},method='GET',stream=False):
         """
-        Calls the service.
+        Calls the service.  If stream is True, returns an iterator that decodes the
+        result incrementally as it arrives.  Params (or data) holding file objects are
+        posted as a multipart body, which streams the files.
         """
+        if has_uploads(data or params):
+            return self.do_upload(data or params,stream=stream)
+        if method == 'GET':
+            return self.do_get(params,stream=stream)
+        else:
+            return self.do_post(data=data,params=params,stream=stream)
+    
+    def download(self,destination,data=None,params={},method='GET',resume=False,chunk_size=64 * 1024):
+        """
+        Calls a service returning a file and writes the response to destination, a path or
+        a file object, as it arrives.  If resume is True and destination is a path to a
+        partial download, only the rest of the file is requested.  Returns the number of
+        bytes written.
+        """
+        headers = dict(self.headers)
+        offset = 0
+        if resume and isinstance(destination,basestring) and os.path.exists(destination):
+            offset = os.path.getsize(destination)
+            if offset:
+                headers['Range'] = 'bytes=%d-' % offset
+        
+        url = '%s/%s.json' % (self.service_url,self.descriptor['slug'])
         if method == 'GET':
-            return self.do_get(params)
+            response = send(self.transport,'GET',url,retry=self.retry,hedge=self.hedge,
+                            params=params,headers=headers,stream=True)
         else:
-            return self.do_post(data=data,params=params)
+            if data and params:
+                raise ValueError('Either data or params can be submitted to be the POST body, but not both.')
+            response = send(self.transport,'POST',url,retry=self.retry,hedge=self.hedge,idempotent=self.idempotent,
+                            data=json.dumps(data) if data else params,headers=headers,stream=True)
+        
+        try:
+            if response.status_code == 416 and offset:
+                return 0 # already complete
+            if response.status_code >= 400:
+                raise ServiceException(response.status_code,response.text)
+            
+            opened = isinstance(destination,basestring)
+            out = open(destination,'ab' if response.status_code == 206 else 'wb') if opened else destination
+            written = 0
+            try:
+                for chunk in response.iter_content(chunk_size):
+                    out.write(chunk)
+                    written += len(chunk)
+            finally:
+                if opened:
+                    out.close()
+            return written
+        finally:
+            response.close()
 
 class HttpClient(object):
     """
     Client for Sharrock.
     """
-    def __init__(self,service_url,app,version,auth_user='',auth_password=''):
-        """
-        Constructor.
-        """
-        self._service_url = service_url
+    def __init__(self,service_url,app,version,auth_user='',auth_password='',transport=None,descriptor_cache=None,prefetch=False,response_cache=None,retry=None,hedge=None,balance_strategy=LEAST_OUTSTANDING,single_flight=None,columnar=False):
+        """
+        Constructor.  Clients share a pooled transport and a descriptor cache unless they
+        are specified.  If prefetch is True, all of the descriptors for the app and version
+        are fetched up front in a single request.  If a response_cache is given, GET
+        responses are cached in it.  GETs and idempotent calls are retried according to
+        the retry policy and hedged by the hedger, if they are given.  service_url may be
+        a list of urls, or an EndpointPool, to balance requests across several servers.
+        If a SingleFlight is given, identical GETs and idempotent calls made while one is
+        in flight share its result.  If columnar is True, list results are fetched in
+        columnar form and returned as ColumnarRows.
+        """
+        self._service_url, self._transport = balance(service_url,transport or default_transport(),balance_strategy)
+        self._descriptor_transport = descriptor_transport(self._transport,retry,transport is not None)
+        self._transport = PinningTransport(self._transport) # the client's own read-your-writes pin
         self._app = app
         self._version = version
         self._services = {}
+        self._services_lock = threading.Lock()
+        if response_cache is not None:
+            self._transport = CachingTransport(self._transport,response_cache)
+        self._descriptor_cache = descriptor_cache or default_descriptor_cache()
+        self._retry = retry
+        self._hedge = hedge
+        self._single_flight = single_flight
+        self._columnar = columnar
         self.user = auth_user
         self.password = auth_password
+        if prefetch:
+            self._descriptor_cache.prefetch(self._service_url,self._app,self._version,transport=self._descriptor_transport)
     
     def _cache_descriptor(self,descriptor_name,force=False):
         """
         Caches the specified descriptor locally.
         """
         if not descriptor_name in self._services or force:
-            response = requests.get('%s/describe/%s/%s/%s.json' % (self._service_url,self._app,self._version,descriptor_name))
-            self._services[descriptor_name] = HttpService(self._service_url,
-                                                          self._app,
-                                                          self._version,
-                                                          response.json(strict=False),
-                                                          auth_user=self.user,
-                                                          auth_password=self.password)
+            service = HttpService(self._service_url,
+                                  self._app,
+                                  self._version,
+                                  self._descriptor_cache.get(self._service_url,self._app,self._version,descriptor_name,force=force,transport=self._descriptor_transport),
+                                  auth_user=self.user,
+                                  auth_password=self.password,
+                                  transport=self._transport,
+                                  retry=self._retry,
+                                  hedge=self._hedge,
+                                  columnar=self._columnar)
+            with self._services_lock:
+                if not descriptor_name in self._services or force:
+                    self._services[descriptor_name] = service
     
-    def call(self,service_name,data=None,params={},force_descriptor_update=False,local_param_check=True,method=None):
+    def _call_key(self,service_name,method,data,params):
+        """
+        Identifies a call, for single-flight coalescing.
+        """
+        return (self._service_url,self._app,self._version,service_name,method,self.user,self.password,self._columnar,
+                json.dumps(params,sort_keys=True),json.dumps(data,sort_keys=True))
+    
+    def _coalesces(self,service_name,method):
+        """
+        Checks if calls to the service with the method are coalesced.
+        """
+        if self._single_flight is None:
+            return False
+        service = self._services.get(service_name)
+        return method == 'GET' or (service is not None and service.idempotent)
+    
+    def call(self,service_name,data=None,params={},force_descriptor_update=False,local_param_check=True,method=None,stream=False):
         """
         Calls the specified service.  Will build the service locally if it has not been cached.
+        If stream is True, returns an iterator over the elements of the result (a JSON
+        array or NDJSON), decoded as they arrive.
+        """
+        return self._call(service_name,data,params,force_descriptor_update,local_param_check,method,stream,True)
+    
+    def download(self,service_name,destination,data=None,params={},force_descriptor_update=False,local_param_check=True,method=None,resume=False):
+        """
+        Calls a service returning a file, streaming the response to destination, a path or
+        a file object, rather than holding it in memory.  If resume is True, a partial
+        download at the destination path is continued with a range request.  Returns the
+        number of bytes written.
+        """
+        service, method = self._prepare(service_name,data,params,force_descriptor_update,local_param_check,method)
+        return service.download(destination,data=data,params=params,method=method,resume=resume)
+    
+    def _prepare(self,service_name,data,params,force_descriptor_update,local_param_check,method):
+        """
+        Gets the service for a call, checking the params, and the method to call it with.
         """
         self._cache_descriptor(service_name,force=force_descriptor_update)
         service = self._services[service_name]
@@ -241,8 +467,17 @@ class HttpClient(object):
                 method = 'POST'
             else:
                 method = 'GET'
-
-        return service.call(data=data,params=params,method=method)
+        return service, method
+    
+    def _call(self,service_name,data,params,force_descriptor_update,local_param_check,method,stream,coalesce):
+        """
+        Implements call().  Calls are only coalesced if coalesce is True.
+        """
+        service, method = self._prepare(service_name,data,params,force_descriptor_update,local_param_check,method)
+        if coalesce and not stream and not has_uploads(data or params) and self._coalesces(service_name,method):
+            return self._single_flight.do(self._call_key(service_name,method,data,params),
+                                          lambda: service.call(data=data,params=params,method=method))
+        return service.call(data=data,params=params,method=method,stream=stream)
     
     def __getattr__(self,name):
         """
@@ -272,13 +507,14 @@ class ResourceOperation(object):
     """
     Represents a method call (GET, POST, PUT or DELETE) on a resource.
     """
-    def __init__(self,service_url,app,version,resource_slug,descriptor,http_method,auth_user='',auth_password=''):
+    def __init__(self,service_url,app,version,resource_slug,descriptor,http_method,auth_user='',auth_password='',transport=None,retry=None,hedge=None):
         self.service_url = service_url
         self.app = app
         self.version = version
         self.resource_slug = resource_slug
         self.descriptor = descriptor
         self.http_method = http_method
+        self.idempotent = descriptor.get('idempotent') == 'True'
         self.params = {}
         for param in self.descriptor['params']:
             required = True if param['required'] == 'True' else False
@@ -286,6 +522,10 @@ class ResourceOperation(object):
         
         self.user = auth_user
         self.password = auth_password
+        self.headers = auth_headers(auth_user,auth_password)
+        self.transport = transport or default_transport()
+        self.retry = retry
+        self.hedge = hedge
     
     def check_params(self,params):
         """
@@ -309,9 +549,10 @@ class ResourceOperation(object):
         """
         return '%s/%s/%s/%s.json' % (self.service_url,self.app,self.version,self.resource_slug)
     
-    def __call__(self,data=None,params=None,local_params_check=True):
+    def __call__(self,data=None,params=None,local_params_check=True,stream=False):
         """
-        Calls the http method.
+        Calls the http method.  If stream is True, returns an iterator over the elements
+        of the result, decoded as they arrive.
         """
         # sanity check
         if data and params:
@@ -324,71 +565,105 @@ class ResourceOperation(object):
                 self.check_params(params)
         
         response = None
-        
-        if self.http_method == 'GET':
-            response = requests.get(self._url(),params=params,auth=(self.user,self.password))
-        elif self.http_method == 'DELETE':
-            response = requests.delete(self._url(),params=params,auth=(self.user,self.password))
-        elif self.http_method == 'POST':
-            if data:
-                response = requests.post(self._url(),data=json.dumps(data),auth=(self.user,self.password))
-            else:
-                response = requests.post(self._url(),params=params,auth=(self.user,self.password))
+        headers = stream_headers(self.headers) if stream else self.headers
+        if self.http_method in ('GET','DELETE') or not data:
+            response = send(self.transport,self.http_method,self._url(),retry=self.retry,hedge=self.hedge,idempotent=self.idempotent,params=params,headers=headers,stream=stream)
         else:
-            if data:
-                response = requests.put(self._url(),data=json.dumps(data),auth=(self.user,self.password))
-            else:
-                response = requests.put(self._url(),params=params,auth=(self.user,self.password))
+            response = send(self.transport,self.http_method,self._url(),retry=self.retry,hedge=self.hedge,idempotent=self.idempotent,data=json.dumps(data),headers=headers,stream=stream)
         
+        if stream:
+            return stream_response(response)
         return self.process_response(response)
 
 class ResourceClient(object):
     """
     A client for the Sharrock REST api.  An instance of the RestfulClient
-    represents a single resource.
+    represents a single resource.  The resource descriptor is fetched when one
+    of the http methods is first accessed.
     """
-    def __init__(self,service_url,app,version,resource_slug,auth_user='',auth_password=''):
-        self._service_url = service_url
+    def __init__(self,service_url,app,version,resource_slug,auth_user='',auth_password='',transport=None,descriptor_cache=None,response_cache=None,retry=None,hedge=None,balance_strategy=LEAST_OUTSTANDING):
+        self._service_url, self._transport = balance(service_url,transport or default_transport(),balance_strategy)
+        self._descriptor_transport = descriptor_transport(self._transport,retry,transport is not None)
+        self._transport = PinningTransport(self._transport) # the client's own read-your-writes pin
         self._app = app
         self._version = version
         self._resource_slug = resource_slug
         self._descriptor = None
-        self.get = None
-        self.post = None
-        self.put = None
-        self.delete = None
+        self._operations = {}
         self.user = auth_user
         self.password = auth_password
-        self._cache_descriptor()
+        if response_cache is not None:
+            self._transport = CachingTransport(self._transport,response_cache)
+        self._descriptor_cache = descriptor_cache or default_descriptor_cache()
+        self._retry = retry
+        self._hedge = hedge
     
     def _cache_descriptor(self,force=False):
         """
         Locally caches the resource descriptor.
         """
         if not self._descriptor or force:
-            response = requests.get('%s/describe/%s/%s/%s.json' % (self._service_url,self._app,self._version,self._resource_slug))
-            self._descriptor = response.json(strict=False)
+            descriptor = self._descriptor_cache.get(self._service_url,self._app,self._version,self._resource_slug,force=force,transport=self._descriptor_transport)
 
-            if 'get' in self._descriptor:
-                self.get = ResourceOperation(self._service_url,self._app,self._version,self._resource_slug,self._descriptor['get'],'GET',auth_user=self.user,auth_password=self.password)
-            if 'post' in self._descriptor:
-                self.post = ResourceOperation(self._service_url,self._app,self._version,self._resource_slug,self._descriptor['post'],'POST',auth_user=self.user,auth_password=self.password)
-            if 'put' in self._descriptor:
-                self.put = ResourceOperation(self._service_url,self._app,self._version,self._resource_slug,self._descriptor['put'],'PUT',auth_user=self.user,auth_password=self.password)
-            if 'delete' in self._descriptor:
-                self.delete = ResourceOperation(self._service_url,self._app,self._version,self._resource_slug,self._descriptor['delete'],'DELETE',auth_user=self.user,auth_password=self.password)
+            operations = {}
+            for method_name in ('get','post','put','delete'):
+                if method_name in descriptor:
+                    operations[method_name] = ResourceOperation(self._service_url,
+                                                                self._app,
+                                                                self._version,
+                                                                self._resource_slug,
+                                                                descriptor[method_name],
+                                                                method_name.upper(),
+                                                                auth_user=self.user,
+                                                                auth_password=self.password,
+                                                                transport=self._transport,
+                                                                retry=self._retry,
+                                                                hedge=self._hedge)
+            self._operations = operations
+            self._descriptor = descriptor
+    
+    def _operation(self,method_name):
+        """
+        Gets the operation for the http method, or None if the resource does not implement it.
+        """
+        self._cache_descriptor()
+        return self._operations.get(method_name)
+    
+    @property
+    def get(self):
+        return self._operation('get')
+    
+    @property
+    def post(self):
+        return self._operation('post')
+    
+    @property
+    def put(self):
+        return self._operation('put')
+    
+    @property
+    def delete(self):
+        return self._operation('delete')
 
 class ModelResourceClient(object):
     """
-    A client for a model resource.
+    A client for a model resource.  If columnar is True, lists are fetched in columnar
+    form and returned as ColumnarRows.
     """
-    def __init__(self,service_url,app,version,model_resource_slug,auth_user='',auth_password=''):
-        self._service_url = service_url
+    def __init__(self,service_url,app,version,model_resource_slug,auth_user='',auth_password='',transport=None,response_cache=None,retry=None,hedge=None,balance_strategy=LEAST_OUTSTANDING,columnar=False):
+        self._service_url, self._transport = balance(service_url,transport or default_transport(),balance_strategy)
+        self._transport = PinningTransport(self._transport) # the client's own read-your-writes pin
         self._app = app
         self._version = version
         self._model_resource_slug = model_resource_slug
         self.user = auth_user
         self.password = auth_password
+        self._headers = auth_headers(auth_user,auth_password)
+        self._columnar_headers = columnar_headers(self._headers) if columnar else self._headers
+        if response_cache is not None:
+            self._transport = CachingTransport(self._transport,response_cache)
+        self._retry = retry
+        self._hedge = hedge
     
     def _process_response(self,response):
         """
@@ -396,55 +671,193 @@ class ModelResourceClient(object):
         """
         if response.status_code >= 400:
             # error
-            raise ServiceException(response.status,response.text)
+            raise ServiceException(response.status_code,response.text)
+        elif columnar.is_columnar(response):
+            return columnar.decode(response.json(strict=False))
         else:
             return response.json(strict=False)
     
-    def _service(self,method,context,**attrs):
+    def _service(self,method,context,attrs=None,params=None):
         """
-        Http service implementation
+        Http service implementation.  Params are sent in the query string.
         """
         response = None
         url = '%s/%s/%s/%s/%s.json' % (self._service_url,self._app,self._version,self._model_resource_slug,context)
         
-        if method == 'GET':
-            response = requests.get(url,auth=(self.user,self.password))
-        elif method == 'DELETE':
-            response = requests.delete(url,auth=(self.user,self.password))
-        elif method == 'POST':
-            response = requests.post(url,data=attrs,auth=(self.user,self.password))
+        if method in ('GET','DELETE'):
+            response = send(self._transport,method,url,retry=self._retry,hedge=self._hedge,params=params,headers=self._columnar_headers)
         else:
-            response = requests.put(url,data=attrs,auth=(self.user,self.password))
+            response = self._transport.request(method,url,data=json.dumps(attrs),params=params,headers=self._headers)
         
         return self._process_response(response)
     
-    def list(self):
+    def _stream(self,context,params=None):
+        """
+        Streaming GET of the context.  Returns an iterator over the result.
+        """
+        url = '%s/%s/%s/%s/%s.json' % (self._service_url,self._app,self._version,self._model_resource_slug,context)
+        return stream_response(send(self._transport,'GET',url,retry=self._retry,hedge=self._hedge,params=params,headers=stream_headers(self._headers),stream=True))
+    
+    def _expand_params(self,expand):
+        """
+        Params asking for the relations to be expanded.
+        """
+        return {'expand':','.join(expand)} if expand else None
+    
+    def _list_params(self,expand,order_by,filters):
+        """
+        Params for the expansions, ordering and filters of a list.  Lists of values (for
+        in and range filters) are sent comma separated.
+        """
+        params = self._expand_params(expand) or {}
+        if order_by:
+            params['order_by'] = ','.join(order_by)
+        for name, value in filters.items():
+            params[name] = ','.join(unicode(v) for v in value) if isinstance(value,(list,tuple)) else value
+        return params
+    
+    def list(self,stream=False,expand=None,order_by=None,**filters):
         """
-        Lists the model resources.
+        Lists the model resources.  If stream is True, returns an iterator that yields
+        the models as they arrive, instead of a list.  expand lists relations to nest in
+        the models, and order_by the fields to order them by.  Keyword arguments filter
+        the models, for example username__prefix='to' or id__in=[1,2,3].
         """
-        return self._service('GET','list')
+        params = self._list_params(expand,order_by,filters)
+        if stream:
+            return self._stream('list',params=params)
+        return self._service('GET','list',params=params)
     
-    def get(self,pk):
+    def count(self,**filters):
         """
-        Gets the model specified by the id.
+        Counts the models matching the filters.
         """
-        return self._service('GET',pk)
+        return self._service('GET','count',params=self._list_params(None,None,filters))['count']
+    
+    def aggregate(self,aggregates,**filters):
+        """
+        Aggregates fields of the models matching the filters.  aggregates is a list of
+        function:field strings, for example ['sum:price','max:price'].  Returns a
+        dictionary keyed field__function, for example {'price__sum':...,'price__max':...}.
+        """
+        params = self._list_params(None,None,filters)
+        params['aggregate'] = ','.join(aggregates)
+        return self._service('GET','aggregate',params=params)
+    
+    def group_count(self,field,**filters):
+        """
+        Counts the models matching the filters for each value of the field.  Returns a
+        list of dictionaries holding the value and the count.
+        """
+        params = self._list_params(None,None,filters)
+        params['group_by'] = field
+        return self._service('GET','group',params=params)
+    
+    def get(self,pk,expand=None):
+        """
+        Gets the model specified by the id.  expand lists relations to nest in the model.
+        """
+        return self._service('GET',pk,params=self._expand_params(expand))
+    
+    def get_many(self,pks,expand=None,batch_size=1000):
+        """
+        Gets the models specified by the ids, batch_size ids per request.  Returns a
+        dictionary of the models keyed by id (as a string), and a list of the ids that
+        do not exist: (models, missing).
+        """
+        models = {}
+        missing = []
+        pks = list(pks)
+        for start in range(0,len(pks),batch_size):
+            params = self._expand_params(expand) or {}
+            params['ids'] = ','.join(unicode(pk) for pk in pks[start:start + batch_size])
+            result = self._service('GET','many',params=params)
+            models.update(result['models'])
+            missing.extend(result['missing'])
+        return models, missing
+    
+    def changes(self,since=None,limit=None,expand=None):
+        """
+        Gets a page of the change feed: the models changed, keyed by id, and the ids of
+        the models deleted since the cursor.  Returns a dictionary with 'changed', 'deleted', the
+        'cursor' to continue from and 'more', True if there are further changes.
+        """
+        return self._changes(since,limit,expand)
+    
+    def _changes(self,since,limit,expand):
+        params = self._expand_params(expand) or {}
+        if since:
+            params['since'] = since
+        if limit:
+            params['limit'] = limit
+        return self._service('GET','changes',params=params)
+    
+    def sync(self,models=None,cursor=None,limit=None,expand=None):
+        """
+        Brings a local copy of the models up to date, getting only what changed since the
+        cursor.  models is a dictionary of the models keyed by id (as a string), which is
+        updated in place; pass None, and no cursor, to start a copy.  Returns the models
+        and the cursor to pass to the next sync: (models, cursor).
+        """
+        if models is None:
+            models = {}
+        while True:
+            page = self._changes(cursor,limit,expand)
+            for pk in page['deleted']:
+                models.pop(unicode(pk),None)
+            models.update(page['changed'])
+            cursor = page['cursor']
+            if not page['more']:
+                return models, cursor
     
     def create(self,**attrs):
         """
         Creates a new model with the specified data.
         """
-        return self._service('POST','create',**attrs)
+        return self._service('POST','create',attrs=attrs)
     
     def update(self,pk,**attrs):
         """
         Updates an existing model.
         """
-        return self._service('PUT',pk,**attrs)
+        return self._service('PUT',pk,attrs=attrs)
     
     def delete(self,pk):
         """
         Deletes an existing model.
         """
         return self._service('DELETE',pk)
+    
+    def import_rows(self,rows,rows_per_request=10000,compress=True):
+        """
+        Creates models in bulk from an iterable of dictionaries, which may be a generator.
+        The rows are sent as newline delimited JSON, gzipped if compress is True, in
+        requests of rows_per_request rows, so only that many rows are held in memory at
+        once.  Returns a dictionary with the number of models 'created', the number of
+        rows that 'failed', and 'errors' holding the index of a failed row in rows and
+        its error.
+        """
+        url = '%s/%s/%s/%s/import.json' % (self._service_url,self._app,self._version,self._model_resource_slug)
+        headers = dict(self._headers)
+        headers['Content-Type'] = NDJSON_CONTENT_TYPE
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+        
+        report = {'created':0,'failed':0,'errors':[]}
+        rows = iter(rows)
+        offset = 0
+        while True:
+            batch = list(itertools.islice(rows,rows_per_request))
+            if not batch:
+                return report
+            body = ''.join('%s\n' % json.dumps(row) for row in batch)
+            if compress:
+                compressor = zlib.compressobj(6,zlib.DEFLATED,16 + zlib.MAX_WBITS) # gzip format
+                body = compressor.compress(body) + compressor.flush()
+            result = self._process_response(self._transport.request('POST',url,data=body,headers=headers))
+            report['created'] += result['created']
+            report['failed'] += result['failed']
+            for error in result['errors']:
+                report['errors'].append({'row':offset + error['line'] - 1,'error':error['error']})
+            offset += len(batch)
 
@@ -0,0 +1,207 @@
+"""
+Columnar encoding of list results.
+
+Lists of dictionaries with the same keys, such as model resource lists, repeat
+every key in every row.  A client that sends
+
+    Accept: application/vnd.sharrock.columnar+json
+
+gets such lists in columnar form instead: the keys once, then the values of each
+column in an array.  String columns with few distinct values are dictionary
+encoded, as the distinct values and an index into them for each row:
+
+    {"columnar": 1,
+     "count": 3,
+     "columns": ["id", "username", "is_staff"],
+     "values": [[1, 2, 3], ["tom", "dick", "harry"], [false, false, true]],
+     "dictionaries": {}}
+
+Other results, and lists that are not uniform, are sent as usual.  The response
+has the columnar content type when the list was encoded.
+
+Clients decode columnar responses into a ColumnarRows sequence, whose rows are
+built as they are accessed and hold only a reference to their table and index.
+"""
+import json
+
+COLUMNAR_CONTENT_TYPE = 'application/vnd.sharrock.columnar+json'
+
+# string columns are dictionary encoded if they have no more distinct values than this fraction of the rows
+DICTIONARY_RATIO = 0.5
+
+# lists shorter than this are not dictionary encoded
+DICTIONARY_MIN_ROWS = 8
+
+class ColumnarJSON(str):
+    """
+    A serialized columnar result.
+    """
+    pass
+
+def accepts_columnar(request):
+    """
+    Checks if the client accepts columnar results.
+    """
+    return COLUMNAR_CONTENT_TYPE in request.META.get('HTTP_ACCEPT','')
+
+def encode(rows,dictionary_ratio=DICTIONARY_RATIO):
+    """
+    Encodes a list of dictionaries with the same keys in columnar form.  Returns None if
+    rows is not such a list.
+    """
+    if not isinstance(rows,list) or not rows or not all(isinstance(row,dict) for row in rows):
+        return None
+    columns = rows[0].keys()
+    if any(len(row) != len(columns) for row in rows):
+        return None
+    try:
+        values = [[row[column] for row in rows] for column in columns]
+    except KeyError:
+        return None # rows have different keys
+
+    dictionaries = {}
+    if len(rows) >= DICTIONARY_MIN_ROWS:
+        for i, column in enumerate(columns):
+            column_values = values[i]
+            if not all(isinstance(value,basestring) for value in column_values):
+                continue
+            distinct = {}
+            for value in column_values:
+                if not value in distinct:
+                    distinct[value] = len(distinct)
+                    if len(distinct) > len(rows) * dictionary_ratio:
+                        break
+            else:
+                dictionaries[column] = sorted(distinct,key=distinct.get)
+                values[i] = [distinct[value] for value in column_values]
+
+    return {'columnar':1,'count':len(rows),'columns':columns,'values':values,'dictionaries':dictionaries}
+
+def serialize(rows):
+    """
+    Serializes a list of dictionaries to columnar JSON, or returns None if it cannot be
+    encoded.
+    """
+    encoded = encode(rows)
+    if encoded is None:
+        return None
+    return ColumnarJSON(json.dumps(encoded,separators=(',',':')))
+
+def is_columnar(response):
+    """
+    Checks if a requests response holds a columnar result.
+    """
+    return response.headers.get('Content-Type','').startswith(COLUMNAR_CONTENT_TYPE)
+
+################
+### Decoding ###
+################
+
+class Row(object):
+    """
+    A row of a columnar result.  Reads like a dictionary; values are looked up, and
+    dictionary decoded, when they are accessed.
+    """
+    __slots__ = ('_rows','_index')
+
+    def __init__(self,rows,index):
+        self._rows = rows
+        self._index = index
+
+    def __getitem__(self,key):
+        return self._rows._value(self._rows._positions[key],self._index)
+
+    def get(self,key,default=None):
+        position = self._rows._positions.get(key)
+        if position is None:
+            return default
+        return self._rows._value(position,self._index)
+
+    def __contains__(self,key):
+        return key in self._rows._positions
+
+    def __iter__(self):
+        return iter(self._rows.columns)
+
+    def __len__(self):
+        return len(self._rows.columns)
+
+    def keys(self):
+        return list(self._rows.columns)
+
+    def values(self):
+        return [self[key] for key in self._rows.columns]
+
+    def items(self):
+        return [(key,self[key]) for key in self._rows.columns]
+
+    def as_dict(self):
+        """
+        The row as a dictionary.
+        """
+        return dict(self.items())
+
+    def __eq__(self,other):
+        if isinstance(other,Row):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self,other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Row(%r)' % self.as_dict()
+
+class ColumnarRows(object):
+    """
+    A decoded columnar result: a sequence of Rows.
+    """
+    def __init__(self,encoded):
+        self.columns = encoded['columns']
+        self._values = encoded['values']
+        self._count = encoded['count']
+        self._positions = dict((column,i) for i, column in enumerate(self.columns))
+        dictionaries = encoded.get('dictionaries') or {}
+        self._dictionaries = [dictionaries.get(column) for column in self.columns]
+
+    def _value(self,position,index):
+        value = self._values[position][index]
+        dictionary = self._dictionaries[position]
+        return dictionary[value] if dictionary is not None else value
+
+    def column(self,name):
+        """
+        The decoded values of a column.
+        """
+        position = self._positions[name]
+        dictionary = self._dictionaries[position]
+        if dictionary is None:
+            return list(self._values[position])
+        return [dictionary[value] for value in self._values[position]]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self,index):
+        if isinstance(index,slice):
+            return [Row(self,i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('row index out of range')
+        return Row(self,index)
+
+    def __iter__(self):
+        for index in xrange(self._count):
+            yield Row(self,index)
+
+    def __repr__(self):
+        return 'ColumnarRows(%d rows of %s)' % (self._count,', '.join(self.columns))
+
+def decode(encoded):
+    """
+    Decodes a columnar result.  Results that are not columnar are returned as they are.
+    """
+    if isinstance(encoded,dict) and encoded.get('columnar') == 1:
+        return ColumnarRows(encoded)
+    return encoded
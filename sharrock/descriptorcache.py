@@ -0,0 +1,212 @@
+"""
+Client-side cache of service descriptors.
+
+Descriptors are held in memory and shared by every client in the process that
+uses the same cache.  When a cache directory is configured, descriptors are also
+persisted to disk with their ETags, so that short-lived processes can revalidate
+them with a conditional request instead of downloading them again.  All of the
+descriptors for an app and version can be fetched in one request with prefetch().
+"""
+from sharrock.transport import default_transport
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+
+log = logging.getLogger('sharrock')
+
+class DescriptorNotFound(Exception):
+    """
+    Indicates the server could not supply the descriptor.
+    """
+    def __init__(self,url,status_code):
+        self.url = url
+        self.status_code = status_code
+
+    def __str__(self):
+        return '%d: %s' % (self.status_code,self.url)
+
+def describe_url(service_url,app,version,slug):
+    """
+    Url of a single descriptor.
+    """
+    return '%s/describe/%s/%s/%s.json' % (service_url,app,version,slug)
+
+def directory_url(service_url,app,version):
+    """
+    Url of the directory of descriptors for an app and version.
+    """
+    return '%s/dir/%s/%s.json' % (service_url,app,version)
+
+class DescriptorCache(object):
+    """
+    A cache of descriptors keyed by their describe url.  Entries loaded from disk are
+    revalidated with the server once per process, or once every max_age seconds if
+    max_age is set.  Safe to share between threads.
+    """
+    def __init__(self,cache_dir=None,transport=None,max_age=None):
+        self.cache_dir = cache_dir
+        self.transport = transport or default_transport()
+        self.max_age = max_age
+        self._descriptors = {}
+        self._validated = {}
+        self._lock = threading.Lock()
+        if self.cache_dir and not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    ####################
+    ### Disk storage ###
+    ####################
+    def _path(self,url):
+        return os.path.join(self.cache_dir,'%s.json' % hashlib.md5(url.encode('utf-8')).hexdigest())
+
+    def _load(self,url):
+        """
+        Loads a stored entry from disk.  Returns None if there is none.
+        """
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(url)) as entry_file:
+                return json.load(entry_file)
+        except (IOError,ValueError):
+            return None
+
+    def _store(self,url,entry):
+        """
+        Stores an entry on disk.  The entry is written to a temporary file and renamed into
+        place, so other processes never read a partial entry.
+        """
+        if not self.cache_dir:
+            return
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd,'w') as entry_file:
+                json.dump(entry,entry_file)
+            os.rename(temp_path,self._path(url))
+        except (IOError,OSError):
+            log.exception('Failed to store descriptor %s in %s.' % (url,self.cache_dir))
+
+    ###############
+    ### Fetches ###
+    ###############
+    def _is_fresh(self,url,entry):
+        """
+        Checks if the entry can be used without revalidating it.
+        """
+        if self.max_age is None:
+            return url in self._validated # validated earlier in this process
+        return time.time() - entry.get('validated',0) < self.max_age
+
+    def _fetch(self,url,entry=None,transport=None):
+        """
+        Fetches the url, revalidating the entry if there is one.  Returns the new or
+        revalidated entry.
+        """
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        response = (transport or self.transport).request('GET',url,headers=headers)
+
+        if response.status_code == 304 and entry:
+            entry['validated'] = time.time()
+        elif response.status_code >= 400:
+            raise DescriptorNotFound(url,response.status_code)
+        else:
+            entry = {'etag':response.headers.get('ETag'),
+                     'validated':time.time(),
+                     'content':response.json(strict=False)}
+        self._store(url,entry)
+        with self._lock:
+            self._validated[url] = entry['validated']
+        return entry
+
+    def _entry(self,url,force=False,transport=None):
+        """
+        Gets the entry for the url, from memory, disk or the server.
+        """
+        if not force and url in self._descriptors and self._is_fresh(url,self._descriptors[url]):
+            return self._descriptors[url]
+
+        entry = self._descriptors.get(url) or self._load(url)
+        if force or not entry or not self._is_fresh(url,entry):
+            entry = self._fetch(url,entry,transport)
+        with self._lock:
+            self._descriptors[url] = entry
+        return entry
+
+    def get(self,service_url,app,version,slug,force=False,transport=None):
+        """
+        Gets a descriptor.  If force is True the descriptor is revalidated with the server
+        even if it is fresh.  A transport may be given to fetch it with instead of the
+        cache's own.
+        """
+        return self._entry(describe_url(service_url,app,version,slug),force=force,transport=transport)['content']
+
+    def prefetch(self,service_url,app,version,resource_url=None,force=False,transport=None):
+        """
+        Fetches all of the descriptors for the app and version in one request to the
+        directory at service_url.  Function descriptors are cached under service_url,
+        resource descriptors under resource_url when it is given.  Returns the number of
+        descriptors cached.
+        """
+        url = directory_url(service_url,app,version)
+        directory = self._entry(url,force=force,transport=transport)
+        validated = directory['validated']
+
+        count = 0
+        with self._lock:
+            for apps in directory['content']:
+                services = apps.get(app,{}).get(version)
+                if not services:
+                    continue
+                for descriptor in services.get('functions',[]):
+                    self._add(describe_url(service_url,app,version,descriptor['slug']),descriptor,validated)
+                    count += 1
+                if resource_url:
+                    for resource in services.get('resources',[]):
+                        self._add(describe_url(resource_url,app,version,resource['slug']),resource,validated)
+                        count += 1
+        return count
+
+    def _add(self,url,descriptor,validated):
+        """
+        Adds a descriptor taken from a directory.  Must be called holding the lock.
+        """
+        self._descriptors[url] = {'etag':None,'validated':validated,'content':descriptor}
+        self._validated[url] = validated
+
+    def clear(self):
+        """
+        Clears the in-memory cache.  Entries on disk are kept.
+        """
+        with self._lock:
+            self._descriptors.clear()
+            self._validated.clear()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def default_descriptor_cache():
+    """
+    Gets the descriptor cache shared by clients that have not been given their own.  If
+    the SHARROCK_DESCRIPTOR_CACHE environment variable is set, descriptors are persisted
+    in that directory.
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = DescriptorCache(cache_dir=os.environ.get('SHARROCK_DESCRIPTOR_CACHE'))
+    return _default_cache
+
+def set_default_descriptor_cache(cache):
+    """
+    Replaces the shared descriptor cache.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
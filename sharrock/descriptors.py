@@ -2,14 +2,47 @@
 Descriptors are definitions for functions.
 """
 import markdown
+from django.conf import settings
 from django.template.defaultfilters import slugify
 from urlparse import parse_qs
 from django.http import QueryDict
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.uploadedfile import UploadedFile
+from sharrock.singleflight import SingleFlight, cache_flight
+from sharrock.replicas import read_alias, reading_from
+from sharrock.streaming import StreamedResult, is_stream, iter_chunks, NDJSON_CONTENT_TYPE
+from sharrock.files import is_file_result, as_file_result
+from sharrock import columnar
+import hashlib
+import tempfile
 import logging
 
 log = logging.getLogger('sharrock')
 
+# identical executions of single flight descriptors in flight in this process
+execution_flight = SingleFlight()
+
+def get_django_cache(alias):
+    """
+    Gets the Django cache with the alias.
+    """
+    try:
+        from django.core.cache import caches
+        return caches[alias]
+    except ImportError:
+        from django.core.cache import get_cache # Django < 1.7
+        return get_cache(alias)
+
+def flight_cache():
+    """
+    The Django cache used to coalesce executions across processes, named by the
+    SHARROCK_SINGLE_FLIGHT_CACHE setting.  None if the setting is not set.
+    """
+    alias = getattr(settings,'SHARROCK_SINGLE_FLIGHT_CACHE',None)
+    if not alias:
+        return None
+    return get_django_cache(alias)
+
 class MalformedDescriptor(Exception):
     """
     A programming error indicating a function descriptor that has been improperly
@@ -174,6 +207,80 @@ class DictParam(Param):
     def type(self):
         return 'Dictionary'
 
+def is_multipart(request):
+    """
+    Checks if the request body is multipart form data.
+    """
+    return request.META.get('CONTENT_TYPE','').startswith('multipart/')
+
+def upload_name(request):
+    """
+    The file name of a raw request body, from its Content-Disposition header.
+    """
+    m = re.search(r'filename="?([^";]+)"?',request.META.get('HTTP_CONTENT_DISPOSITION',''))
+    return m.group(1) if m else None
+
+class FileParam(Param):
+    """
+    A file uploaded with the request: the part of a multipart body with the param's
+    name, or else the raw request body (gzipped if its Content-Encoding is gzip).  The
+    value is an UploadedFile, which Django spools to disk as the multipart body is
+    parsed; raw bodies are spooled to a temporary file in the same way, kept in memory
+    up to FILE_UPLOAD_MAX_MEMORY_SIZE bytes.  Descriptors with file params read their
+    body themselves, so it is never loaded whole or deserialized.
+    """
+    def get_from_request(self,request,read_body=True):
+        """
+        Gets the upload from the request.  The raw body is only read if read_body is True,
+        as it can be read once.  If the upload is missing and required, raises
+        ParamRequired, otherwise returns None.
+        """
+        upload = None
+        if is_multipart(request):
+            upload = request.FILES.get(self.name)
+            if upload is not None:
+                upload = self.from_upload(upload)
+        elif read_body and int(request.META.get('CONTENT_LENGTH') or 0) > 0:
+            upload = self.from_body(request,request.META.get('HTTP_CONTENT_ENCODING','').lower() == 'gzip')
+        if upload is None and self.required:
+            raise ParamRequired(self.name)
+        return upload
+    
+    def from_upload(self,upload):
+        return upload
+    
+    def from_body(self,request,gzipped):
+        spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        size = 0
+        for chunk in iter_chunks(request.read,gzipped=gzipped):
+            spooled.write(chunk)
+            size += len(chunk)
+        spooled.seek(0)
+        return UploadedFile(spooled,name=upload_name(request),content_type=request.META.get('CONTENT_TYPE'),size=size)
+    
+    def process(self,raw):
+        return raw
+    
+    @property
+    def type(self):
+        return 'File'
+
+class StreamParam(FileParam):
+    """
+    An upload read as it is processed: the value is an iterator over the chunks of the
+    multipart part or raw body, which holds no more than a chunk in memory.  A raw body
+    must be consumed before execute returns.
+    """
+    def from_upload(self,upload):
+        return upload.chunks()
+    
+    def from_body(self,request,gzipped):
+        return iter_chunks(request.read,gzipped=gzipped)
+    
+    @property
+    def type(self):
+        return 'Stream'
+
 ###################
 ### Serializers ###
 ###################
@@ -213,6 +320,12 @@ class JSONSerializer(Serializer):
         else:
             return python_object
     
+    def serialize_element(self,python_object):
+        """
+        Serializes a value of a streamed result.
+        """
+        return json.dumps(python_object)
+    
     def deserialize(self,serialized_object):
         log.debug('JSON Serializer loading serialized objects:%s' % serialized_object)
         if serialized_object:
@@ -307,6 +420,23 @@ class DescriptorMetaclass(type):
             if not 'deprecated' in attrs:
                 new_attrs['deprecated'] = None
             
+            # Cache-Control header for GET responses
+            if not 'cache_control' in attrs:
+                new_attrs['cache_control'] = None
+            
+            # Idempotent descriptors may be retried and hedged by clients
+            if not 'idempotent' in attrs:
+                new_attrs['idempotent'] = False
+            
+            # Concurrent identical executions share one execution: the same params, body and
+            # requesting user (or credentials).  Results must depend on nothing else.
+            if not 'single_flight' in attrs:
+                new_attrs['single_flight'] = False
+            
+            # GET executions read from the read database
+            if not 'read_replica' in attrs:
+                new_attrs['read_replica'] = False
+            
             attrs.update(new_attrs)
         
         return type.__new__(cls,name,bases,attrs)
@@ -366,11 +496,25 @@ class Descriptor(object):
         """
         raise NotImplemented # Subclasses implement
     
+    def streams_body(self,request):
+        """
+        Checks if execute reads the request body itself, as a stream, in which case it is
+        not read and deserialized beforehand.  True for descriptors with file params.
+        """
+        return any(isinstance(param,FileParam) for param in self.params)
+    
     def extract_kwargs(self,request):
         """
         Attempts to extract keyword args from the raw data.  Returns None
         if no kwargs are to be had.
         """
+        if self.streams_body(request) and self.params:
+            # the body holds uploads, so other params are in the query string or form fields
+            kwargs = request.GET.copy()
+            if is_multipart(request):
+                kwargs.update(request.POST)
+            return kwargs
+        
         if self.data_parsing or not self.params: # data parsing descriptors ignore keyword args
             return {} # no params means no keyword args
         
@@ -398,7 +542,10 @@ class Descriptor(object):
 
         # 2. Deserialize incoming data
         data = None
-        if hasattr(request,'body'):
+        streaming = self.streams_body(request)
+        if streaming:
+            pass # execute reads the body itself
+        elif hasattr(request,'body'):
             data = self.deserialize(request.body,format)
         elif hasattr(request,'raw_post_data'):
             data = self.deserialize(request.raw_post_data,format)
@@ -409,17 +556,88 @@ class Descriptor(object):
 
         # 4. Process params
         param_data = {}
+        read_body = True
         for param in self.params:
-            if self.data_parsing:
+            if isinstance(param,FileParam):
+                param_data[param.name] = param.get_from_request(request,read_body=read_body)
+                read_body = read_body and param_data[param.name] is None # a raw body goes to the first file param
+            elif self.data_parsing and not streaming:
                 param_data[param.name] = param.get_from_dict(data) # extract params from data
             else:
                 param_data[param.name] = param.get_from_dict(kwargs) # extract params from kwargs
 
-        # 5. Execute service
-        result = self.execute(request,data,param_data)
-
-        # 6. Serialize result
-        return self.serialize(result,format)
+        # 5. Execute service and 6. serialize result
+        alias = read_alias(request) if self.read_replica else None
+        def run():
+            with reading_from(alias):
+                result = self.execute(request,data,param_data)
+                if is_file_result(result):
+                    # served as it is; checked first, as files are iterators too
+                    result = as_file_result(result)
+                    return result.shareable() if self.single_flight else result
+                if is_stream(result):
+                    if format == 'json' and not self.single_flight:
+                        return self.stream(request,result,alias)
+                    result = list(result) # shared or not JSON, so not streamed
+                return self.serialize_for(request,result,format)
+        if not self.single_flight or streaming:
+            return run() # uploads are not shared
+
+        # identical requests in flight share the serialized result of one execution
+        key = self.flight_key(request,param_data,format) + (alias or '') # pinned clients must not share a replica read
+        if format == 'json' and columnar.accepts_columnar(request):
+            key += '-columnar'
+        cache = flight_cache()
+        if cache is not None:
+            timeout = getattr(settings,'SHARROCK_SINGLE_FLIGHT_TIMEOUT',30)
+            return execution_flight.do(key,lambda: cache_flight(cache,key,run,timeout=timeout))
+        return execution_flight.do(key,run)
+    
+    def serialize_for(self,request,python_object,format):
+        """
+        Serializes the result for the request, in columnar form if it is a list the client
+        accepts that way.
+        """
+        if isinstance(python_object,columnar.ColumnarJSON):
+            return python_object
+        if format == 'json' and columnar.accepts_columnar(request):
+            serialized = columnar.serialize(python_object)
+            if serialized is not None:
+                return serialized
+        return self.serialize(python_object,format)
+    
+    def stream(self,request,values,alias=None):
+        """
+        Wraps an iterator returned by execute for streaming, as NDJSON if the client
+        accepts it and otherwise as a JSON array.  The values are produced reading from
+        the database alias.
+        """
+        serializer = self.serializer_dict.get('json')
+        return StreamedResult(values,
+                              encode=getattr(serializer,'serialize_element',json.dumps),
+                              ndjson=NDJSON_CONTENT_TYPE in request.META.get('HTTP_ACCEPT',''),
+                              context=(lambda: reading_from(alias)) if alias else None,
+                              chunk_size=getattr(settings,'SHARROCK_STREAM_CHUNK_SIZE',64 * 1024),
+                              flush_interval=getattr(settings,'SHARROCK_STREAM_FLUSH_INTERVAL',1.0))
+    
+    def flight_key(self,request,param_data,format):
+        """
+        Identifies an execution of the descriptor, for single flight: by the processed
+        params, a digest of the body (execute is given all of the data, not only params)
+        and the requesting user, or the credentials of requests without one.
+        """
+        user = getattr(request,'user',None)
+        if user is not None and user.is_authenticated():
+            identity = 'user:%s' % user.pk
+        else:
+            identity = hashlib.md5(request.META.get('HTTP_AUTHORIZATION','')).hexdigest()
+        body = getattr(request,'body','') if hasattr(request,'body') else getattr(request,'raw_post_data','')
+        return hashlib.md5(repr((self.__class__.__module__,
+                                 self.__class__.__name__,
+                                 format,
+                                 sorted(param_data.items()),
+                                 hashlib.md5(body).hexdigest(),
+                                 identity))).hexdigest()
 
     
     @property
@@ -518,6 +736,11 @@ class Resource(object):
         """
         Generates a list of appropriate response headers for the http response.
         """
+        action_method = getattr(self,request.method.lower(),None)
+        if request.method == 'GET' and getattr(action_method,'cache_control',None):
+            headers = Resource.headers[format].copy()
+            headers['Cache-Control'] = action_method.cache_control
+            return headers
         return Resource.headers[format]
     
     def status_code(self,request):
@@ -536,6 +759,12 @@ class Conflict(Exception):
     Should contain enough information so that the user can resolve the problem.
     """
 
+class BadRequest(Exception):
+    """
+    An exception indicating the request is malformed, for instance asking for a field that
+    is not available.  Results in a 400 response.
+    """
+
 # ========================
 # = Not Found Descriptor =
 # ========================
@@ -0,0 +1,327 @@
+"""
+File and binary results for Sharrock descriptors.
+
+A descriptor's execute may return a file object or a buffer (a bytearray, buffer
+or memoryview), or either of them or a file path wrapped in a FileResult, which
+sets the content type and file name.  These are served as they are, without being
+serialized:
+
+    def execute(self,request,data,params):
+        return FileResult('/var/exports/report.csv',content_type='text/csv',filename='report.csv')
+
+Single byte ranges are supported (Range: bytes=start-end), so downloads can be
+resumed.  Full files are served with Django's FileResponse where it exists, so the
+server can use sendfile.  Otherwise, or if the SHARROCK_SENDFILE_HEADER setting
+names a header such as X-Sendfile or X-Accel-Redirect, files on disk are handed to
+the front end server in that header, mapping path prefixes with the
+SHARROCK_SENDFILE_MAP setting ({'/var/exports/':'/protected/exports/'}).
+
+Clients upload files in a MultipartBody, which reads them as it is sent.
+"""
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+import mimetypes
+import os
+import re
+import tempfile
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+range_pattern = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+class FileResult(object):
+    """
+    A file object, file path or buffer returned by a descriptor, with the content type
+    and file name to send it with.  A string is a path; wrap bytes in a buffer to send
+    them.  The content type is guessed from the file name (or path) if it is not given.
+    """
+    def __init__(self,source,content_type=None,filename=None):
+        self.source = source
+        self.filename = filename
+        self.path = source if isinstance(source,basestring) else None
+        name = filename or self.path or getattr(source,'name',None)
+        if content_type is None and isinstance(name,basestring):
+            content_type = mimetypes.guess_type(name)[0]
+        self.content_type = content_type or 'application/octet-stream'
+
+    def shareable(self):
+        """
+        The result in a form that can be copied for several requests, as single flight
+        does.  Paths are shared as they are; file objects and views are read into a
+        bytearray.
+        """
+        if self.path is not None or isinstance(self.source,bytearray):
+            return self
+        source, size = self.open()
+        if hasattr(source,'read'):
+            try:
+                content = bytearray(source.read())
+            finally:
+                FileChunks(source).close()
+        else:
+            content = bytearray(source)
+        return FileResult(content,self.content_type,self.filename)
+
+    def open(self):
+        """
+        Opens the result.  Returns a file object, or a buffer, and its size (None if it is
+        not known).
+        """
+        source = self.source
+        if self.path is not None:
+            source = open(self.path,'rb')
+        if isinstance(source,(bytearray,buffer,memoryview)):
+            return source, len(source)
+        return source, file_size(source)
+
+def file_size(f):
+    """
+    The number of bytes left to read in a file object, or None if it is not known.
+    """
+    try:
+        return os.fstat(f.fileno()).st_size - f.tell()
+    except (AttributeError,IOError,OSError,ValueError):
+        pass
+    try:
+        position = f.tell()
+        f.seek(0,os.SEEK_END)
+        size = f.tell() - position
+        f.seek(position)
+        return size
+    except (AttributeError,IOError,OSError,ValueError):
+        return None
+
+def is_file_result(value):
+    """
+    Checks if a result is to be served as a file.
+    """
+    return isinstance(value,(FileResult,file,bytearray,buffer,memoryview))
+
+def as_file_result(value):
+    """
+    Wraps a result in a FileResult, if it is not one.
+    """
+    return value if isinstance(value,FileResult) else FileResult(value)
+
+class FileChunks(object):
+    """
+    Iterates chunks of a file object or buffer, from offset for length bytes (to the end
+    if length is None).  Buffers are sliced without copying them whole.  Closes the file
+    when the response is closed.
+    """
+    def __init__(self,source,offset=0,length=None,chunk_size=CHUNK_SIZE):
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        remaining = self.length
+        if hasattr(self.source,'read'):
+            if self.offset:
+                self.source.seek(self.offset,os.SEEK_CUR)
+            while remaining is None or remaining > 0:
+                chunk = self.source.read(self.chunk_size if remaining is None else min(self.chunk_size,remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        else:
+            view = memoryview(self.source) if not isinstance(self.source,buffer) else self.source
+            end = len(self.source) if remaining is None else self.offset + remaining
+            for start in xrange(self.offset,end,self.chunk_size):
+                chunk = view[start:min(start + self.chunk_size,end)]
+                yield chunk.tobytes() if isinstance(chunk,memoryview) else chunk
+
+    def close(self):
+        if hasattr(self.source,'close'):
+            self.source.close()
+
+def parse_range(header,size):
+    """
+    Parses a single byte range against the size of the content.  Returns (start, end),
+    inclusive, None if the header is missing or not understood (multiple ranges are
+    served whole), or False if the range cannot be satisfied.
+    """
+    m = range_pattern.match(header.strip()) if header else None
+    if not m or size is None or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        # the last n bytes
+        suffix = int(m.group(2))
+        if not suffix:
+            return False
+        return max(0,size - suffix), size - 1
+    start = int(m.group(1))
+    end = min(int(m.group(2)),size - 1) if m.group(2) else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+def sendfile_response(result):
+    """
+    A response handing the file to the front end server in SHARROCK_SENDFILE_HEADER,
+    or None if it is not configured or the result is not a file on disk.
+    """
+    header = getattr(settings,'SHARROCK_SENDFILE_HEADER',None)
+    if not header or result.path is None:
+        return None
+    path = os.path.abspath(result.path)
+    for prefix, replacement in getattr(settings,'SHARROCK_SENDFILE_MAP',{}).items():
+        if path.startswith(prefix):
+            path = replacement + path[len(prefix):]
+            break
+    response = HttpResponse(content_type=result.content_type)
+    response[header] = path
+    return response
+
+def file_response(request,result,status=200):
+    """
+    Serves a file result, honouring a single byte range.
+    """
+    response = sendfile_response(result)
+    if response is None:
+        source, size = result.open()
+        byte_range = parse_range(request.META.get('HTTP_RANGE'),size) if request.method == 'GET' else None
+        if byte_range is False:
+            FileChunks(source).close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(FileChunks(source,start,end - start + 1),content_type=result.content_type,status=206)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start,end,size)
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = full_response(source,size,result.content_type,status)
+    if size_known(response):
+        response['Accept-Ranges'] = 'bytes'
+    if result.filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % result.filename.replace('"','')
+    return response
+
+def full_response(source,size,content_type,status):
+    """
+    A response with the whole file, through FileResponse (Django >= 1.8) for real
+    files, so that the server may use sendfile.
+    """
+    try:
+        from django.http import FileResponse
+    except ImportError:
+        FileResponse = None
+    if FileResponse is not None and hasattr(source,'fileno'):
+        response = FileResponse(source,content_type=content_type,status=status)
+    else:
+        response = StreamingHttpResponse(FileChunks(source),content_type=content_type,status=status)
+    if size is not None:
+        response['Content-Length'] = str(size)
+    return response
+
+def size_known(response):
+    return response.has_header('Content-Length') or response.has_header('Content-Range') or not getattr(response,'streaming',False)
+
+###############
+### Uploads ###
+###############
+
+def is_upload(value):
+    """
+    Checks if a param value is a file to upload.
+    """
+    return hasattr(value,'read') and not isinstance(value,MultipartBody)
+
+class MultipartBody(object):
+    """
+    A multipart/form-data request body with the fields, (name, value) pairs, and the
+    files, (name, file object) pairs, which are read as the body is sent rather than
+    encoded in memory.  Its length is known up front, so it is sent with a
+    Content-Length (Django before 1.7 cannot read chunked request bodies).  Files whose
+    size cannot be found are spooled to a temporary file first.
+    """
+    def __init__(self,fields=(),files=(),chunk_size=CHUNK_SIZE):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.parts = []
+        for name, value in fields:
+            if isinstance(value,unicode):
+                value = value.encode('utf-8')
+            self.parts.append('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (self.boundary,name,value))
+        for name, f in files:
+            filename = getattr(f,'name',None)
+            filename = os.path.basename(filename) if isinstance(filename,basestring) and filename else name
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            self.parts.append('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\nContent-Type: %s\r\n\r\n' %
+                              (self.boundary,name,filename.replace('"',''),content_type))
+            size = file_size(f)
+            if size is None:
+                spooled = tempfile.TemporaryFile()
+                for chunk in iter(lambda: f.read(chunk_size),''):
+                    spooled.write(chunk)
+                size = spooled.tell()
+                spooled.seek(0)
+                f = spooled
+            self.parts.append((f,size))
+            self.parts.append('\r\n')
+        self.parts.append('--%s--\r\n' % self.boundary)
+        self.length = sum(part[1] if isinstance(part,tuple) else len(part) for part in self.parts)
+        self._chunks = self._iter_chunks()
+        self._pending = ''
+
+    @classmethod
+    def from_values(cls,values):
+        """
+        A body for call params or data: file objects become files, lists repeated fields,
+        and other values fields.  None values are left out.
+        """
+        fields = []
+        files = []
+        for name, value in values.items():
+            if is_upload(value):
+                files.append((name,value))
+            elif isinstance(value,(list,tuple)):
+                fields.extend((name,item) for item in value)
+            elif not value is None:
+                fields.append((name,value))
+        return cls(fields,files)
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return self.length
+
+    def _iter_chunks(self):
+        for part in self.parts:
+            if not isinstance(part,tuple):
+                yield part
+                continue
+            f, remaining = part
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size,remaining))
+                if not chunk:
+                    raise IOError('Upload %s ended early.' % getattr(f,'name',''))
+                remaining -= len(chunk)
+                yield chunk
+
+    def __iter__(self):
+        return self._chunks
+
+    def read(self,size=-1):
+        """
+        Reads up to size bytes of the body, or the rest of it.
+        """
+        data = self._pending
+        while size < 0 or len(data) < size:
+            chunk = next(self._chunks,None)
+            if chunk is None:
+                break
+            data += chunk
+        if size < 0:
+            self._pending = ''
+            return data
+        self._pending = data[size:]
+        return data[:size]
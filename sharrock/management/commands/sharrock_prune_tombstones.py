@@ -0,0 +1,27 @@
+"""
+Prunes the tombstones of model resource change feeds.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from sharrock.modelresource import prune_tombstones, tombstone_retention
+
+class Command(BaseCommand):
+    help = 'Deletes the tombstones older than SHARROCK_TOMBSTONE_RETENTION seconds.  Change feed cursors that have not seen them must start their copy again.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--retention',dest='retention',type='int',default=None,help='Keep tombstones for this many seconds, at least SHARROCK_TOMBSTONE_RETENTION.'),
+        make_option('--database',dest='database',default=None,help='The database to prune.'),
+    )
+
+    def handle(self,*args,**options):
+        # cursors only expire after SHARROCK_TOMBSTONE_RETENTION, so pruning sooner would
+        # lose deletions for clients still allowed to sync
+        if tombstone_retention() is None:
+            raise CommandError('Set SHARROCK_TOMBSTONE_RETENTION to prune tombstones.')
+        retention = options['retention']
+        if retention is None:
+            retention = tombstone_retention()
+        elif retention < tombstone_retention():
+            raise CommandError('--retention may not be shorter than SHARROCK_TOMBSTONE_RETENTION.')
+        count = prune_tombstones(retention,using=options['database'])
+        self.stdout.write('Pruned %d tombstones.\n' % count)
@@ -0,0 +1,36 @@
+"""
+Replays a Sharrock traffic log.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from sharrock import traffic
+import os
+
+class Command(BaseCommand):
+    args = '<traffic log>'
+    help = 'Replays a traffic log recorded through SHARROCK_TRAFFIC_LOG, in-process or against a server, and compares latencies and responses.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--url',dest='url',default=None,help='Replay against the server at this url instead of in-process.'),
+        make_option('--speed',dest='speed',type='float',default=1.0,help='Replay speed relative to the recording.  0 replays as fast as possible.'),
+        make_option('--limit',dest='limit',type='int',default=None,help='Replay at most this many records.'),
+        make_option('--auth-user',dest='auth_user',default='',help='Basic auth user for server replay.'),
+        make_option('--auth-password',dest='auth_password',default='',help='Basic auth password for server replay.'),
+    )
+
+    def handle(self,*args,**options):
+        if len(args) != 1:
+            raise CommandError('Specify the traffic log to replay.')
+        path = args[0]
+        if not os.path.exists(path):
+            raise CommandError('Traffic log %s does not exist.' % path)
+
+        if options['url']:
+            target = traffic.HttpTarget(options['url'],auth_user=options['auth_user'],auth_password=options['auth_password'])
+        else:
+            from sharrock import registry
+            registry.ensure_registry()
+            target = traffic.InProcessTarget()
+
+        report = traffic.replay(traffic.read_traffic(path,limit=options['limit']),target,speed=options['speed'])
+        report.write(self.stdout)
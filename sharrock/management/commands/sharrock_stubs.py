@@ -0,0 +1,36 @@
+"""
+Generates static client stubs for a Sharrock app and version.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+from sharrock import stubs
+
+class Command(BaseCommand):
+    args = '<app> <version>'
+    help = 'Generates a client stub module for the descriptors of an app and version, from the local registry or a server directory.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--service-url',dest='service_url',default=None,help='Service url baked into the stubs.  Required.'),
+        make_option('--resource-url',dest='resource_url',default=None,help='Resource url baked into the stubs.  Resource stubs are only generated if this is set.'),
+        make_option('--from-server',dest='from_server',action='store_true',default=False,help='Read the descriptors from the directory at the service url instead of the local registry.'),
+        make_option('--output',dest='output',default=None,help='Write the module to this file instead of stdout.'),
+    )
+
+    def handle(self,*args,**options):
+        if len(args) != 2:
+            raise CommandError('Specify the app and version.')
+        app, version = args
+        if not options['service_url']:
+            raise CommandError('Specify the service url with --service-url.')
+
+        if options['from_server']:
+            descriptors = stubs.descriptors_from_server(options['service_url'],app,version)
+        else:
+            descriptors = stubs.descriptors_from_registry(app,version)
+
+        source = stubs.generate_stubs(descriptors,options['service_url'],app,version,resource_url=options['resource_url'])
+        if options['output']:
+            with open(options['output'],'w') as output:
+                output.write(source)
+        else:
+            self.stdout.write(source)
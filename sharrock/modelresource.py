@@ -2,11 +2,37 @@
 This module provides a shortcut to creating resources that are wrapped around
 CRUD functionality for a Django model.
 """
-from sharrock.descriptors import Resource, Descriptor
+from sharrock.descriptors import Resource, Descriptor, BadRequest, FailedToLocate, get_django_cache
+from sharrock.replicas import read_alias, read_your_writes_window
+from sharrock.streaming import iter_lines
+from sharrock import columnar
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Min, Max, Sum, Avg, Q
+from django.db import transaction, router, DatabaseError
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+import base64
+import hashlib
+import json
+import zlib
+import time
 import re
 import traceback
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+import logging
+
+log = logging.getLogger('sharrock')
+
+# filter lookups clients may use, and the ORM lookups they translate to
+filter_lookups = {'exact':'exact','in':'in','range':'range','prefix':'startswith'}
+
+# aggregate functions clients may use
+aggregate_functions = {'min':Min,'max':Max,'sum':Sum,'avg':Avg}
+
+# params with a meaning of their own, not filters
+reserved_params = ('expand','order_by','aggregate','group_by','ids','since','limit')
 
 model_resource_urls = {
                         'list':r'(?P<slug>[\w-]+)/list\.(?P<format>\w+)$',
@@ -14,6 +40,12 @@ model_resource_urls = {
                         'update':r'(?P<slug>[\w-]+)/(?P<model_id>\d+)\.(?P<format>\w+)$',
                         'delete':r'(?P<slug>[\w-]+)/(?P<model_id>\d+)\.(?P<format>\w+)$',
                         'create':r'(?P<slug>[\w-]+)/create\.(?P<format>\w+)$',
+                        'count':r'(?P<slug>[\w-]+)/count\.(?P<format>\w+)$',
+                        'aggregate':r'(?P<slug>[\w-]+)/aggregate\.(?P<format>\w+)$',
+                        'group':r'(?P<slug>[\w-]+)/group\.(?P<format>\w+)$',
+                        'many':r'(?P<slug>[\w-]+)/many\.(?P<format>\w+)$',
+                        'changes':r'(?P<slug>[\w-]+)/changes\.(?P<format>\w+)$',
+                        'import':r'(?P<slug>[\w-]+)/import\.(?P<format>\w+)$',
 }
 
 if hasattr(settings,'SHARROCK_MODELRESOURCE_URLS'):
@@ -21,34 +53,253 @@ if hasattr(settings,'SHARROCK_MODELRESOURCE_URLS'):
 
 model_patterns = dict((key,re.compile(value)) for key,value in model_resource_urls.items())
 
+def model_label(model):
+    """
+    The app label and name of a model, for example 'auth.User'.
+    """
+    return '%s.%s' % (model._meta.app_label,model._meta.object_name)
+
+def record_tombstone(sender,instance,**kwargs):
+    """
+    post_delete hook recording the deletion for change feeds.
+    """
+    from sharrock.models import Tombstone
+    Tombstone.objects.create(model=model_label(sender),object_id=unicode(instance.pk))
+
+def tombstone_retention():
+    """
+    Seconds for which tombstones are kept, from the SHARROCK_TOMBSTONE_RETENTION setting,
+    or None to keep them for good.
+    """
+    return getattr(settings,'SHARROCK_TOMBSTONE_RETENTION',None)
+
+def prune_tombstones(retention=None,using=None):
+    """
+    Deletes the tombstones older than retention seconds (by default the configured
+    retention).  Returns the number deleted.
+    """
+    from sharrock.models import Tombstone
+    retention = tombstone_retention() if retention is None else retention
+    if retention is None:
+        return 0
+    tombstones = Tombstone.objects.using(using) if using else Tombstone.objects.all()
+    expired = tombstones.filter(deleted__lt=timezone.now() - timedelta(seconds=retention))
+    count = expired.count()
+    expired.delete()
+    return count
+
+class Serialized(str):
+    """
+    A result that has already been serialized, for instance by the read cache.
+    """
+    pass
+
 class ModelResourceAction(Descriptor):
     """
     Special descriptor subclass that wraps the model manipulation methods.
     """
-    def __init__(self,action_label,manipulator,*args,**kwargs):
+    def __init__(self,action_label,manipulator,body_streamer=None,*args,**kwargs):
         super(ModelResourceAction,self).__init__(*args,**kwargs)
         self.manipulator = manipulator
+        self.body_streamer = body_streamer
         self.__doc__ = '%s the model.' % action_label
 
     def execute(self,request,data,params):
         return self.manipulator(request,data,params)
 
+    def streams_body(self,request):
+        return self.body_streamer is not None and self.body_streamer(request)
+    
+    def serialize(self,python_object,format):
+        if isinstance(python_object,Serialized):
+            return str(python_object)
+        return super(ModelResourceAction,self).serialize(python_object,format)
+
 
 class ModelResource(Resource):
     """
     A resource tied to a Django model.
+
+    Relations named in expandable may be requested with the expand param (for example
+    ?expand=author,tags), and are returned nested in the serialized models.  Foreign
+    keys are fetched with select_related and other relations with prefetch_related, so
+    the number of queries does not grow with the number of models.
+
+    Lists can be filtered on the fields in filterable, a dictionary of field names to
+    the lookups allowed on them (exact, in, range and prefix), and ordered by the fields
+    in orderable.  For example ?username__prefix=to&order_by=-date_joined.
+
+    The count route counts the (filtered) models.  The aggregate route computes the
+    min, max, sum or avg of the fields in aggregatable, for example
+    aggregate.json?aggregate=sum:price,max:price, and the group route counts the models
+    for each value of one of the fields in groupable, for example group.json?group_by=genre.
+    Each runs a single aggregate query.
+
+    Updates are written with a single UPDATE of the fields sent, without reading the
+    model first.  Set save_on_update to True if the model's save() or save signals must
+    run on updates; the model is then read and saved with update_fields.
+
+    The many route gets several models by id, for example many.json?ids=1,2,3,
+    querying them in chunks of multi_get_chunk_size ids to stay under the database's
+    limit on query parameters.
+
+    If cache_reads is True, serialized gets and lists (without expansions) are kept in
+    the Django cache named by cache_alias for cache_timeout seconds.  Saves and deletes
+    of the model invalidate them: gets through a version counter per model instance,
+    and lists through a generation counter for the model.
+
+    Reads (gets, lists, counts and aggregates) use the database named by read_database,
+    or by the SHARROCK_READ_DATABASE setting, unless the client wrote within the
+    read-your-writes window.  Writes always use the default routing.  Cached reads from
+    the read database are kept for no longer than the read-your-writes window.
+
+    If change_field names a field that increases whenever a model is saved, such as an
+    auto_now updated time or a version column set from a global sequence, the changes
+    route returns the models changed since a cursor, for example changes.json?since=...,
+    along with the ids of the models deleted since (recorded as Tombstones by a
+    post_delete hook), and the cursor to pass next time.  Without a cursor, all the
+    models are returned, and no deletions.  At most changes_page_size
+    changes are returned at once.
+
+    The import route creates models in bulk from a POSTed body of newline delimited
+    JSON objects, gzipped if the Content-Encoding is gzip.  The body is parsed as it is
+    read, and the rows are validated against the model's fields and written with
+    bulk_create, import_batch_size at a time, each batch in its own transaction.  The
+    number of models created and the errors of the rows that were not are returned.
     """
+    expandable = ()
+    filterable = {}
+    orderable = ()
+    aggregatable = ()
+    groupable = ()
+    save_on_update = False
+    multi_get_chunk_size = 500
+    cache_reads = False
+    cache_alias = 'default'
+    cache_timeout = 300
+    read_database = None
+    change_field = None
+    changes_page_size = 1000
+    import_batch_size = 1000
+    import_max_errors = 100
+
     def __init__(self,is_deprecated=None):
         self.get = ModelResourceAction('Retrieves or lists',self.do_get)
-        self.post = ModelResourceAction('Creates',self.do_post)
+        self.post = ModelResourceAction('Creates',self.do_post,body_streamer=lambda request: self._is_request('import',request))
         self.put = ModelResourceAction('Updates',self.do_put)
         self.delete = ModelResourceAction('Deletes',self.do_delete)
         super(ModelResource,self).__init__(is_deprecated=is_deprecated)
+        if hasattr(self,'model'):
+            self._check_indexes()
+            self._updatable_fields = self._get_updatable_fields()
+            self._auto_now_fields = [field for field in self.model._meta.fields if getattr(field,'auto_now',False)]
+            if self.cache_reads:
+                uid = 'sharrock-read-cache-%s.%s' % (self.__class__.__module__,self.__class__.__name__)
+                post_save.connect(self._model_changed,sender=self.model,weak=False,dispatch_uid=uid)
+                post_delete.connect(self._model_changed,sender=self.model,weak=False,dispatch_uid=uid)
+            if self.change_field:
+                # one tombstone per deletion, however many resources serve the model
+                uid = 'sharrock-tombstone-%s' % model_label(self.model)
+                post_delete.connect(record_tombstone,sender=self.model,weak=False,dispatch_uid=uid)
+    
+    ##################
+    ### Read cache ###
+    ##################
+    def _counter_key(self,name):
+        return 'sharrock-%s.%s-%s' % (self.model._meta.app_label,self.model._meta.object_name,name)
+    
+    def _counter(self,cache,name):
+        """
+        Reads a counter, starting it if it is not in the cache.  Counters start at the
+        current time in milliseconds, so that a counter evicted from the cache never
+        restarts at a value that old entries were stored under.
+        """
+        value = cache.get(self._counter_key(name))
+        if value is None:
+            value = int(time.time() * 1000)
+            if not cache.add(self._counter_key(name),value,None):
+                value = cache.get(self._counter_key(name),value)
+        return value
+    
+    def _bump(self,cache,name):
+        try:
+            cache.incr(self._counter_key(name))
+        except ValueError: # not in the cache
+            cache.set(self._counter_key(name),int(time.time() * 1000),None)
+    
+    def invalidate(self,pk=None):
+        """
+        Invalidates the cached lists, and the cached gets of the model with the pk.
+        """
+        cache = get_django_cache(self.cache_alias)
+        self._bump(cache,'generation')
+        if pk is not None:
+            self._bump(cache,'pk-%s' % pk)
+    
+    def _model_changed(self,sender,instance,**kwargs):
+        self.invalidate(instance.pk)
+    
+    def _cached(self,op,request,counter,compute):
+        """
+        Answers a read from the cache, or computes the result and caches its serialized
+        form.  The cache is bypassed for reads that expand relations.
+        """
+        if not self.cache_reads or request.GET.get('expand'):
+            return compute()
+        cache = get_django_cache(self.cache_alias)
+        format = model_patterns[op].search(request.path).groupdict()['format']
+        alias = read_alias(request,self.read_database)
+        key = 'sharrock-read-%s' % hashlib.md5(repr((self.__class__.__module__,self.name,op,format,request.path,sorted(request.GET.items()),
+                                                    alias,columnar.accepts_columnar(request),self._counter(cache,counter)))).hexdigest()
+        cached = cache.get(key)
+        if cached is not None:
+            is_columnar, serialized = cached
+            return columnar.ColumnarJSON(serialized) if is_columnar else Serialized(serialized)
+        serialized = self.get.serialize_for(request,compute(),format)
+        if isinstance(serialized,columnar.ColumnarJSON):
+            cache.set(key,(True,str(serialized)),self._read_cache_timeout(alias))
+            return serialized
+        if isinstance(serialized,str):
+            cache.set(key,(False,serialized),self._read_cache_timeout(alias))
+        return Serialized(serialized) if isinstance(serialized,str) else serialized
+    
+    def _read_cache_timeout(self,alias):
+        """
+        Seconds to cache a read from the database alias for.
+        """
+        if alias:
+            # a lagging replica may be read after an invalidation, so keep replica reads
+            # no longer than the read-your-writes window
+            return min(self.cache_timeout,read_your_writes_window())
+        return self.cache_timeout
+    
+    def _get_updatable_fields(self):
+        """
+        Maps the names (and attnames) of the fields that can be updated to the fields.
+        """
+        fields = {}
+        for field in self.model._meta.fields:
+            if not field.primary_key:
+                fields[field.name] = field
+                fields[field.attname] = field
+        return fields
+    
+    def _check_indexes(self):
+        """
+        Warns of filterable, orderable and change fields the database has no index for.
+        """
+        indexed = set(field.name for field in self.model._meta.fields if field.db_index or field.unique or field.primary_key)
+        for fields in list(self.model._meta.index_together) + list(self.model._meta.unique_together):
+            if fields:
+                indexed.add(fields[0]) # leading field of a composite index
+        for field_name in set(self.filterable.keys()) | set(self.orderable) | set([self.change_field] if self.change_field else []):
+            if not field_name in indexed:
+                log.warning('%s filters or orders on %s.%s, which has no index.' % (self.name,self.model.__name__,field_name))
 
     ##################################
     ### Model manipulation methods ###
     ##################################
-    def _serialize_model(self,model):
+    def _serialize_model(self,model,expansions=()):
         """
         Transforms the model to dictionary format in preparation for serialization.
         """
@@ -59,8 +310,85 @@ class ModelResource(Resource):
             if isinstance(value,datetime):
                 raw_dict[key] = str(value)
         
+        # nest expanded relations
+        for name in expansions:
+            if self._is_foreign_key(name):
+                related = getattr(model,name)
+                raw_dict[name] = self._serialize_model(related) if related is not None else None
+            else:
+                raw_dict[name] = [self._serialize_model(related) for related in getattr(model,name).all()]
+        
         return raw_dict
     
+    def _is_foreign_key(self,name):
+        """
+        Checks if the relation is a foreign key (or one to one field) of the model.
+        """
+        return any(field.name == name and field.rel for field in self.model._meta.fields)
+    
+    def _get_expansions(self,request):
+        """
+        Extracts the relations to expand from the request, checking them against the
+        expandable relations.
+        """
+        expand = request.GET.get('expand')
+        if not expand:
+            return []
+        expansions = [name.strip() for name in expand.split(',') if name.strip()]
+        for name in expansions:
+            if not name in self.expandable:
+                raise BadRequest('%s is not an expandable relation of %s.' % (name,self.name))
+        return expansions
+    
+    def _filter(self,request,queryset):
+        """
+        Applies the filters and ordering in the request to the queryset, checking them
+        against the filterable and orderable fields.
+        """
+        filters = {}
+        for param, value in request.GET.items():
+            if param in reserved_params:
+                continue
+            field_name, lookup = param.split('__',1) if '__' in param else (param,'exact')
+            if not lookup in self.filterable.get(field_name,()):
+                raise BadRequest('%s cannot be filtered with %s.' % (self.name,param))
+            field = self.model._meta.get_field(field_name)
+            values = value.split(',') if lookup in ('in','range') else [value]
+            if lookup == 'range' and len(values) != 2:
+                raise BadRequest('%s needs two values.' % param)
+            try:
+                values = [field.to_python(v) for v in values] if lookup != 'prefix' else values
+            except ValidationError as e:
+                raise BadRequest('Invalid value for %s: %s' % (param,'; '.join(e.messages)))
+            filters['%s__%s' % (field_name,filter_lookups[lookup])] = values if lookup in ('in','range') else values[0]
+        if filters:
+            queryset = queryset.filter(**filters)
+        
+        order_by = request.GET.get('order_by')
+        if order_by:
+            ordering = [name.strip() for name in order_by.split(',') if name.strip()]
+            for name in ordering:
+                if not name.lstrip('-') in self.orderable:
+                    raise BadRequest('%s cannot be ordered by %s.' % (self.name,name.lstrip('-')))
+            queryset = queryset.order_by(*ordering)
+        return queryset
+    
+    def _queryset(self,request,expansions=()):
+        """
+        The queryset for reading the model, fetching the expanded relations.
+        """
+        queryset = self.model.objects.all()
+        alias = read_alias(request,self.read_database)
+        if alias:
+            queryset = queryset.using(alias)
+        selected = [name for name in expansions if self._is_foreign_key(name)]
+        prefetched = [name for name in expansions if not name in selected]
+        if selected:
+            queryset = queryset.select_related(*selected)
+        if prefetched:
+            queryset = queryset.prefetch_related(*prefetched)
+        return queryset
+    
     def _get_id(self,op,request):
         """
         Extracts the model id from the request.
@@ -76,7 +404,28 @@ class ModelResource(Resource):
         Accessor for a single model instance.
         """
         model_id = self._get_id('get',request)
-        return self._serialize_model(self.model.objects.get(pk=model_id))
+        expansions = self._get_expansions(request)
+        return self._cached('get',request,'pk-%s' % model_id,
+                            lambda: self._serialize_model(self._queryset(request,expansions).get(pk=model_id),expansions))
+    
+    def get_models(self,request,data,param_data):
+        """
+        Accessor for several model instances.  Returns the models keyed by id, and the ids
+        of models that do not exist.
+        """
+        pk_field = self.model._meta.pk
+        try:
+            ids = [pk_field.to_python(model_id) for model_id in request.GET.get('ids','').split(',') if model_id.strip()]
+        except ValidationError as e:
+            raise BadRequest('Invalid ids: %s' % '; '.join(e.messages))
+        expansions = self._get_expansions(request)
+        
+        models = {}
+        for start in range(0,len(ids),self.multi_get_chunk_size):
+            chunk = ids[start:start + self.multi_get_chunk_size]
+            for model in self._queryset(request,expansions).filter(pk__in=chunk):
+                models[unicode(model.pk)] = self._serialize_model(model,expansions)
+        return {'models':models,'missing':[model_id for model_id in ids if not unicode(model_id) in models]}
     
     def create_model(self,request,data,param_data):
         """
@@ -85,14 +434,53 @@ class ModelResource(Resource):
         model_instance = self.model.objects.create(**data)
         return {'id':model_instance.pk}
     
+    def _get_update_values(self,data):
+        """
+        Checks the data against the updatable fields.  Returns the values to update, keyed
+        by field attname.
+        """
+        values = {}
+        for field_name, field_value in data.items():
+            field = self._updatable_fields.get(field_name)
+            if field is None:
+                raise BadRequest('%s has no field %s that can be updated.' % (self.model.__name__,field_name))
+            if not field.rel:
+                try:
+                    field_value = field.to_python(field_value)
+                except ValidationError as e:
+                    raise BadRequest('Invalid value for %s: %s' % (field_name,'; '.join(e.messages)))
+            values[field.attname] = field_value
+        return values
+    
     def update_model(self,request,data,param_data):
         """
         Updator for a model.
         """
-        model_instance = self.model.objects.get(pk=self._get_id('update',request))
-        for field_name, field_value in data.items():
-            setattr(model_instance,field_name,field_value)
-        model_instance.save()
+        model_id = self._get_id('update',request)
+        values = self._get_update_values(data)
+        if not values:
+            raise BadRequest('No fields to update.')
+        
+        if self.save_on_update:
+            try:
+                model_instance = self.model.objects.get(pk=model_id)
+            except self.model.DoesNotExist:
+                raise FailedToLocate('%s %s does not exist.' % (self.model.__name__,model_id))
+            for attname, field_value in values.items():
+                setattr(model_instance,attname,field_value)
+            # save() sets auto_now fields, but writes only the update_fields
+            update_fields = set(self._updatable_fields[attname].name for attname in values)
+            update_fields.update(field.name for field in self._auto_now_fields)
+            model_instance.save(update_fields=list(update_fields))
+        else:
+            now = timezone.now()
+            for field in self._auto_now_fields:
+                if not field.attname in values:
+                    values[field.attname] = now # update() does not set auto_now fields
+            if not self.model.objects.filter(pk=model_id).update(**values):
+                raise FailedToLocate('%s %s does not exist.' % (self.model.__name__,model_id))
+            if self.cache_reads:
+                self.invalidate(model_id) # update() sends no signals
         return 'OK'
     
     def delete_model(self,request,data,param_data):
@@ -103,11 +491,215 @@ class ModelResource(Resource):
         model_instance.delete()
         return 'OK'
     
+    def _serialize_value(self,value):
+        """
+        Converts an aggregated value for serialization.
+        """
+        if isinstance(value,(datetime,date)):
+            return str(value)
+        if isinstance(value,Decimal):
+            return float(value)
+        return value
+    
+    def count_models(self,request,data,param_data):
+        """
+        Counts the instances of the model.
+        """
+        return {'count':self._filter(request,self._queryset(request)).count()}
+    
+    def aggregate_models(self,request,data,param_data):
+        """
+        Aggregates fields of the model.
+        """
+        aggregates = {}
+        for aggregate in request.GET.get('aggregate','').split(','):
+            function_name, _, field_name = aggregate.strip().partition(':')
+            if not function_name in aggregate_functions or not field_name in self.aggregatable:
+                raise BadRequest('%s cannot be aggregated with %s.' % (self.name,aggregate))
+            aggregates['%s__%s' % (field_name,function_name)] = aggregate_functions[function_name](field_name)
+        result = self._filter(request,self._queryset(request)).aggregate(**aggregates)
+        return dict((key,self._serialize_value(value)) for key, value in result.items())
+    
+    def group_models(self,request,data,param_data):
+        """
+        Counts the instances of the model for each value of a field.
+        """
+        field_name = request.GET.get('group_by')
+        if not field_name in self.groupable:
+            raise BadRequest('%s cannot be grouped by %s.' % (self.name,field_name))
+        groups = self._filter(request,self._queryset(request)).values(field_name).annotate(count=Count('pk')).order_by(field_name)
+        return [{field_name:self._serialize_value(group[field_name]),'count':group['count']} for group in groups]
+    
+    def _encode_cursor(self,value,pk,tombstone_id,seen):
+        """
+        Encodes the position of a client in the change feed: the change field value and
+        pk of the last model it has, the id of the last tombstone, and the time up to
+        which it has seen every tombstone.
+        """
+        return base64.urlsafe_b64encode(json.dumps([self._serialize_value(value),unicode(pk) if pk is not None else None,tombstone_id,self._serialize_value(seen)]))
+    
+    def _decode_cursor(self,cursor):
+        from sharrock.models import Tombstone
+        field = self.model._meta.get_field(self.change_field)
+        try:
+            value, pk, tombstone_id, seen = json.loads(base64.urlsafe_b64decode(str(cursor)))
+            if value is not None:
+                value = field.to_python(value)
+                pk = self.model._meta.pk.to_python(pk)
+            seen = Tombstone._meta.get_field('deleted').to_python(seen)
+            if seen is None:
+                raise ValueError
+        except (TypeError,ValueError,ValidationError):
+            raise BadRequest('Invalid cursor %s.' % cursor)
+        
+        # tombstones the client has not seen may have been pruned since
+        retention = tombstone_retention()
+        if retention is not None and seen < timezone.now() - timedelta(seconds=retention):
+            raise BadRequest('Cursor %s has expired; start the copy again.' % cursor)
+        return value, pk, int(tombstone_id)
+    
+    def changes(self,request,data,param_data):
+        """
+        Gets the models changed, keyed by id, and the ids of the models deleted since the
+        cursor in the since param, and the cursor to continue from.  more is True if there
+        are further changes to get.
+        """
+        from sharrock.models import Tombstone
+        if not self.change_field:
+            raise BadRequest('%s has no change feed.' % self.name)
+        alias = read_alias(request,self.read_database)
+        tombstones = Tombstone.objects.using(alias) if alias else Tombstone.objects.all()
+        tombstones = tombstones.filter(model=model_label(self.model))
+        now = timezone.now()
+        if request.GET.get('since'):
+            value, pk, tombstone_id = self._decode_cursor(request.GET['since'])
+        else:
+            # a new copy starts empty, so no earlier deletion concerns it
+            value, pk, tombstone_id = None, None, tombstones.aggregate(last=Max('id'))['last'] or 0
+        try:
+            limit = min(int(request.GET.get('limit',self.changes_page_size)),self.changes_page_size)
+        except ValueError:
+            raise BadRequest('Invalid limit %s.' % request.GET['limit'])
+        expansions = self._get_expansions(request)
+        
+        # models are ordered by change field and pk, so that models saved at the same
+        # time are neither skipped nor repeated across pages
+        queryset = self._queryset(request,expansions)
+        if value is not None:
+            queryset = queryset.filter(Q(**{'%s__gt' % self.change_field:value}) | Q(**{self.change_field:value,'pk__gt':pk}))
+        models = list(queryset.order_by(self.change_field,'pk')[:limit + 1])
+        tombstones = list(tombstones.filter(id__gt=tombstone_id).order_by('id').values_list('id','object_id','deleted')[:limit + 1])
+        
+        # the client has seen every tombstone up to now, unless there is another page of them
+        seen = tombstones[limit - 1][2] if len(tombstones) > limit else now
+        more = len(models) > limit or len(tombstones) > limit
+        models, tombstones = models[:limit], tombstones[:limit]
+        if models:
+            value, pk = getattr(models[-1],self.change_field), models[-1].pk
+        if tombstones:
+            tombstone_id = tombstones[-1][0]
+        
+        # ids that exist again (databases may reuse them) are not deleted: the client has
+        # the new model, or gets it with the models changed since the cursor
+        deleted = [object_id for _, object_id, _ in tombstones]
+        if deleted:
+            existing = set(unicode(pk) for pk in self._queryset(request).filter(pk__in=deleted).values_list('pk',flat=True))
+            deleted = [object_id for object_id in deleted if not object_id in existing]
+        return {'changed':dict((unicode(model.pk),self._serialize_model(model,expansions)) for model in models),
+                'deleted':deleted,
+                'cursor':self._encode_cursor(value,pk,tombstone_id,seen),
+                'more':more}
+    
+    def _import_instance(self,row):
+        """
+        Builds a model instance from an imported row, validating its fields.
+        """
+        if not isinstance(row,dict):
+            raise ValidationError('Rows must be JSON objects.')
+        pk_field = self.model._meta.pk
+        values = {}
+        for field_name, field_value in row.items():
+            field = pk_field if field_name in (pk_field.name,pk_field.attname) else self._updatable_fields.get(field_name)
+            if field is None:
+                raise ValidationError('%s has no field %s.' % (self.model.__name__,field_name))
+            values[field.attname] = field_value
+        instance = self.model(**values)
+        instance.clean_fields()
+        return instance
+    
+    def _import_error(self,report,line_number,message):
+        """
+        Records the error of an imported row.  Only the first import_max_errors errors
+        are kept.
+        """
+        report['failed'] += 1
+        if len(report['errors']) < self.import_max_errors:
+            report['errors'].append({'line':line_number,'error':message})
+    
+    def _write_batch(self,batch,database,report):
+        """
+        Writes a batch of (line number, instance) pairs in a transaction.  If the batch
+        fails, its rows are written one at a time to find the ones that fail.
+        """
+        try:
+            with transaction.atomic(using=database):
+                self.model.objects.using(database).bulk_create([instance for _, instance in batch])
+            report['created'] += len(batch)
+            return
+        except DatabaseError:
+            pass
+        for line_number, instance in batch:
+            try:
+                with transaction.atomic(using=database):
+                    self.model.objects.using(database).bulk_create([instance])
+                report['created'] += 1
+            except DatabaseError as e:
+                self._import_error(report,line_number,unicode(e))
+    
+    def import_models(self,request,data,param_data):
+        """
+        Creates models in bulk from a streamed body of newline delimited JSON.
+        """
+        gzipped = request.META.get('HTTP_CONTENT_ENCODING','').lower() == 'gzip'
+        database = router.db_for_write(self.model)
+        report = {'created':0,'failed':0,'errors':[]}
+        batch = []
+        try:
+            for line_number, line in enumerate(iter_lines(request.read,gzipped=gzipped),1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((line_number,self._import_instance(json.loads(line))))
+                except ValueError as e: # malformed JSON
+                    self._import_error(report,line_number,unicode(e))
+                except ValidationError as e:
+                    if hasattr(e,'message_dict'):
+                        message = '; '.join('%s: %s' % (name,' '.join(messages)) for name, messages in sorted(e.message_dict.items()))
+                    else:
+                        message = '; '.join(e.messages)
+                    self._import_error(report,line_number,message)
+                if len(batch) >= self.import_batch_size:
+                    self._write_batch(batch,database,report)
+                    batch = []
+            if batch:
+                self._write_batch(batch,database,report)
+        except (IOError,zlib.error) as e:
+            raise BadRequest('Cannot read the import body: %s' % e)
+        finally:
+            if report['created'] and self.cache_reads:
+                self.invalidate() # bulk_create sends no signals
+        return report
+    
     def list_models(self,request,data,param_data):
         """
         Lists all instances for the model.
         """
-        serialized_models = [self._serialize_model(model) for model in self.model.objects.all()]
+        return self._cached('list',request,'generation',lambda: self._list_models(request))
+    
+    def _list_models(self,request):
+        expansions = self._get_expansions(request)
+        queryset = self._filter(request,self._queryset(request,expansions))
+        serialized_models = [self._serialize_model(model,expansions) for model in queryset]
         if not serialized_models:
             serialized_models = []
         return serialized_models
@@ -119,9 +711,19 @@ class ModelResource(Resource):
         """
         GET request handler.
         """
-        # This will either be a get or a list
+        # This will either be a get, a multi-get, a list, a change feed or an aggregate
         if self._is_list_request(request):
             return self.list_models(request,data,param_data)
+        elif self._is_request('count',request):
+            return self.count_models(request,data,param_data)
+        elif self._is_request('aggregate',request):
+            return self.aggregate_models(request,data,param_data)
+        elif self._is_request('group',request):
+            return self.group_models(request,data,param_data)
+        elif self._is_request('many',request):
+            return self.get_models(request,data,param_data)
+        elif self._is_request('changes',request):
+            return self.changes(request,data,param_data)
         else:
             return self.get_model(request,data,param_data)
     
@@ -129,7 +731,9 @@ class ModelResource(Resource):
         """
         POST handler.
         """
-        # This should be a create
+        # This should be a create or an import
+        if self._is_request('import',request):
+            return self.import_models(request,data,param_data)
         return self.create_model(request,data,param_data)
     
     def do_put(self,request,data,param_data):
@@ -150,3 +754,6 @@ class ModelResource(Resource):
         m = model_patterns['list'].search(request.path)
         return True if m else False
     
+    def _is_request(self,op,request):
+        return op in model_patterns and model_patterns[op].search(request.path) is not None
+    
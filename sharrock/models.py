@@ -1,5 +1,22 @@
 """
-No actual models in Sharrock, but this file is used as a Django hook to kick off descriptor registration.
+Sharrock's models, also used as a Django hook to kick off descriptor registration.
 """
+from django.db import models
 from sharrock import registry
+
+class Tombstone(models.Model):
+    """
+    Records the deletion of a model instance, for the change feeds of model resources.
+    model is the app label and name of the model, for example 'auth.User'.
+    """
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=255)
+    deleted = models.DateTimeField(auto_now_add=True,db_index=True)
+
+    class Meta:
+        index_together = (('model','id'),)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.model,self.object_id)
+
 registry.build_registry()
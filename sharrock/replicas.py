@@ -0,0 +1,124 @@
+"""
+Read-replica routing for Sharrock.
+
+When the SHARROCK_READ_DATABASE setting names a database alias, GET requests to
+model resources, and to descriptors marked read_replica = True, read from that
+database.  Everything else uses the default routing.
+
+A model resource may instead name its own read database with read_database.
+
+After a request that may have written (anything but GET or HEAD) to a descriptor
+or resource that reads from a replica, the response sets a cookie pinning the
+client to the primary database for SHARROCK_READ_YOUR_WRITES seconds (5 by
+default), so that clients read their own writes despite replication lag.  The shared client transport keeps no cookies, so
+each Sharrock client carries its own pin in a PinningTransport: only the client
+that wrote is pinned, not every client in the process.
+
+Model resources select the read database with QuerySet.using().  Descriptors have
+arbitrary queries, so for them the database is selected by ReadReplicaRouter,
+which must be added to DATABASE_ROUTERS:
+
+    DATABASE_ROUTERS = ['sharrock.replicas.ReadReplicaRouter']
+"""
+from django.conf import settings
+from contextlib import contextmanager
+import threading
+import time
+
+PIN_COOKIE = 'sharrock_primary_until'
+
+_local = threading.local()
+
+def read_database():
+    """
+    The alias of the database to read from, or None.
+    """
+    return getattr(settings,'SHARROCK_READ_DATABASE',None)
+
+def read_your_writes_window():
+    """
+    Seconds for which a client that wrote reads from the primary database.
+    """
+    return getattr(settings,'SHARROCK_READ_YOUR_WRITES',5)
+
+def is_pinned(request):
+    """
+    Checks if the request's client is pinned to the primary database.
+    """
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE,0)) > time.time()
+    except ValueError:
+        return False
+
+def read_alias(request,alias=None):
+    """
+    The database alias the request should read from: the given alias or the configured
+    read database, unless the request is not a GET or its client is pinned to the
+    primary.  None for the default routing.
+    """
+    alias = alias or read_database()
+    if not alias or request.method != 'GET' or is_pinned(request):
+        return None
+    return alias
+
+def pin_to_primary(request,response,alias=None):
+    """
+    Pins the client to the primary database, if the request may have written and reads
+    go to a replica: the given alias of the resource that served it, or the configured
+    read database.
+    """
+    if (alias or read_database()) and not request.method in ('GET','HEAD'):
+        window = read_your_writes_window()
+        response.set_cookie(PIN_COOKIE,'%.3f' % (time.time() + window),max_age=window)
+    return response
+
+@contextmanager
+def reading_from(alias):
+    """
+    Routes reads in the block to the database alias through ReadReplicaRouter.  An alias
+    of None leaves the routing alone.
+    """
+    previous = getattr(_local,'alias',None)
+    _local.alias = alias
+    try:
+        yield
+    finally:
+        _local.alias = previous
+
+class ReadReplicaRouter(object):
+    """
+    Database router sending reads made inside reading_from() to its database.
+    """
+    def db_for_read(self,model,**hints):
+        return getattr(_local,'alias',None)
+
+    def db_for_write(self,model,**hints):
+        return None
+
+    def allow_relation(self,obj1,obj2,**hints):
+        return None
+
+class PinningTransport(object):
+    """
+    Wraps a client's transport to carry the client's primary pin: the pin cookie set
+    by a response is sent with the client's requests until it expires.  The cookie's
+    value is the server's time, so it is passed back as it is, and the expiry is worked
+    out from its max-age with the client's own clock.
+    """
+    def __init__(self,transport):
+        self.transport = transport
+        self.pin = None
+        self.pin_expires = 0
+
+    def request(self,method,url,**kwargs):
+        if self.pin is not None and self.pin_expires > time.time():
+            headers = dict(kwargs.get('headers') or {})
+            headers['Cookie'] = '%s=%s' % (PIN_COOKIE,self.pin)
+            kwargs['headers'] = headers
+        response = self.transport.request(method,url,**kwargs)
+        for cookie in getattr(response,'cookies',None) or ():
+            if cookie.name == PIN_COOKIE and cookie.value:
+                # the cookie jar turns max-age into an expiry time by the local clock
+                self.pin = cookie.value
+                self.pin_expires = cookie.expires if cookie.expires is not None else time.time() + read_your_writes_window()
+        return response
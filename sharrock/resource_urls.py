@@ -14,6 +14,8 @@ urlpatterns = patterns('sharrock.views',
     url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)\.(?P<extension>\w+)$','execute_resource'),
     url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/list/$','execute_resource',{'extension':'json'}), # model resource url
     url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/list\.(?P<extension>\w+)$','execute_resource'),  # model resource url
+    url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/(?:count|aggregate|group|many|changes|import)/$','execute_resource',{'extension':'json'}), # model resource url
+    url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/(?:count|aggregate|group|many|changes|import)\.(?P<extension>\w+)$','execute_resource'), # model resource url
     url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/create/$','execute_resource',{'extension':'json'}), # model resource url
     url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/create\.(?P<extension>\w+)$','execute_resource'),  # model resource url
     url(r'^(?P<app>[\w\.-]+)/(?P<version>[\w\.-]+)/(?P<resource_name>[\w-]+)/(?P<model_id>\d+)/$','execute_resource',{'extension':'json'}), # model resource url
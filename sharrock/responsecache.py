@@ -0,0 +1,325 @@
+"""
+Client-side HTTP response cache for Sharrock.
+
+CachingTransport wraps a transport and caches the responses to GET requests in a
+ResponseCache, honoring Cache-Control and Expires.  Responses carrying an ETag or
+Last-Modified header are revalidated with a conditional request once they go
+stale.  Entries are keyed by url, params and the Authorization header, so callers
+with different credentials never share entries.
+
+    c = HttpClient('http://example.com/api','myapp','1.0',response_cache=ResponseCache())
+"""
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from collections import OrderedDict
+from email.utils import parsedate_tz, mktime_tz
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+
+log = logging.getLogger('sharrock')
+
+# response headers kept with cached entries
+stored_headers = ('Content-Type','Cache-Control','Expires','ETag','Last-Modified','Warning')
+
+def parse_cache_control(value):
+    """
+    Parses a Cache-Control header into a dictionary of directives.  Directives without
+    a value map to True.
+    """
+    directives = {}
+    for directive in value.split(','):
+        directive = directive.strip().lower()
+        if not directive:
+            continue
+        if '=' in directive:
+            name, directive_value = directive.split('=',1)
+            directives[name.strip()] = directive_value.strip().strip('"')
+        else:
+            directives[directive] = True
+    return directives
+
+def expiry(headers,now):
+    """
+    Calculates when a response stops being fresh.  Returns None if the response must
+    not be stored.
+    """
+    cache_control = parse_cache_control(headers.get('Cache-Control',''))
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return now
+    if 'max-age' in cache_control:
+        try:
+            age = int(headers.get('Age',0))
+            return now + int(cache_control['max-age']) - age
+        except ValueError:
+            return now
+    if 'Expires' in headers:
+        expires = parsedate_tz(headers['Expires'])
+        if expires:
+            return mktime_tz(expires)
+    return now
+
+class CacheEntry(object):
+    """
+    A cached response.
+    """
+    def __init__(self,url,status_code,content,headers,expires):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.expires = expires
+
+    @property
+    def size(self):
+        return len(self.content)
+
+    def is_fresh(self,now):
+        return self.expires > now
+
+    def has_validators(self):
+        return 'ETag' in self.headers or 'Last-Modified' in self.headers
+
+    def to_json(self):
+        """
+        The entry as a dictionary that can be stored as JSON.
+        """
+        return {'url':self.url,
+                'status_code':self.status_code,
+                'content':base64.b64encode(self.content),
+                'headers':self.headers,
+                'expires':self.expires}
+
+    @classmethod
+    def from_json(cls,stored):
+        """
+        Rebuilds an entry stored with to_json().
+        """
+        return cls(stored['url'],int(stored['status_code']),base64.b64decode(stored['content']),dict(stored['headers']),float(stored['expires']))
+
+    def response(self):
+        """
+        Rebuilds a requests response from the entry.
+        """
+        response = Response()
+        response.status_code = self.status_code
+        response.url = self.url
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response.encoding = 'utf-8'
+        return response
+
+class ResponseCache(object):
+    """
+    An in-memory LRU cache of responses holding at most max_size bytes of content.
+    If cache_dir is set, entries are also written to disk, as JSON, and entries
+    evicted from memory (or stored by other processes) are read back from there.
+    The files on disk are kept under max_disk_size bytes, by removing the least
+    recently used.  Expired entries that cannot be revalidated are dropped when they
+    are read.  Safe to share between threads.
+    """
+    def __init__(self,max_size=10 * 1024 * 1024,cache_dir=None,max_disk_size=100 * 1024 * 1024):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.max_disk_size = max_disk_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_size = 0
+        if self.cache_dir:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            self._disk_size = sum(size for path, size, used in self._disk_files())
+
+    def record(self,stat):
+        """
+        Counts a hit, miss or revalidation.
+        """
+        with self._lock:
+            setattr(self,stat,getattr(self,stat) + 1)
+
+    def _path(self,key):
+        return os.path.join(self.cache_dir,'%s.json' % key)
+
+    def get(self,key):
+        """
+        Gets the entry for the key, or None.
+        """
+        with self._lock:
+            entry = self._entries.pop(key,None)
+            if entry is not None:
+                self._entries[key] = entry # move to most recently used
+        if entry is None and self.cache_dir:
+            path = self._path(key)
+            try:
+                with open(path) as entry_file:
+                    entry = CacheEntry.from_json(json.load(entry_file))
+                os.utime(path,None) # recently used, for pruning
+            except (IOError,OSError,ValueError,KeyError,TypeError):
+                return None
+            self._put(key,entry)
+        if entry is not None and not entry.is_fresh(time.time()) and not entry.has_validators():
+            self.delete(key) # expired, and cannot be revalidated
+            return None
+        return entry
+
+    def set(self,key,entry):
+        """
+        Stores the entry.
+        """
+        self._put(key,entry)
+        if self.cache_dir:
+            try:
+                fd, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+                with os.fdopen(fd,'w') as entry_file:
+                    json.dump(entry.to_json(),entry_file)
+                    size = entry_file.tell()
+                os.rename(temp_path,self._path(key))
+            except (IOError,OSError):
+                log.exception('Failed to store response for %s in %s.' % (entry.url,self.cache_dir))
+                return
+            with self._lock:
+                self._disk_size += size
+                prune = self._disk_size > self.max_disk_size
+            if prune:
+                self._prune_disk(keep=self._path(key))
+
+    def _disk_files(self):
+        """
+        The (path, size, last used) of each entry on disk.
+        """
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir,name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue # removed by another process
+            files.append((path,stat.st_size,stat.st_mtime))
+        return files
+
+    def _prune_disk(self,keep=None):
+        """
+        Removes the least recently used files on disk, other than keep, until they fit in
+        nine tenths of max_disk_size.  The size is recounted, as other processes may share
+        the directory.
+        """
+        files = sorted(self._disk_files(),key=lambda f: f[2])
+        size = sum(f[1] for f in files)
+        for path, file_size, used in files:
+            if size <= self.max_disk_size * 0.9:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= file_size
+        with self._lock:
+            self._disk_size = size
+
+    def _put(self,key,entry):
+        """
+        Puts the entry in memory, evicting the least recently used entries to make room.
+        """
+        if entry.size > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key,None)
+            if previous is not None:
+                self.size -= previous.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_size:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def delete(self,key):
+        """
+        Removes the entry for the key.
+        """
+        with self._lock:
+            entry = self._entries.pop(key,None)
+            if entry is not None:
+                self.size -= entry.size
+        if self.cache_dir:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Removes all entries from memory.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+def cache_key(url,params,headers):
+    """
+    Builds the cache key for a request from its url, params, auth identity and accepted
+    content types.
+    """
+    identity = (headers or {}).get('Authorization','')
+    accept = (headers or {}).get('Accept','')
+    return hashlib.md5(('%s\n%r\n%s\n%s' % (url,sorted((params or {}).items()),identity,accept)).encode('utf-8')).hexdigest()
+
+class CachingTransport(object):
+    """
+    Wraps a transport, answering GET requests from the response cache where possible.
+    """
+    def __init__(self,transport,cache):
+        self.transport = transport
+        self.cache = cache
+
+    def request(self,method,url,**kwargs):
+        if method != 'GET' or kwargs.get('stream'):
+            return self.transport.request(method,url,**kwargs)
+
+        key = cache_key(url,kwargs.get('params'),kwargs.get('headers'))
+        now = time.time()
+        entry = self.cache.get(key)
+        if entry is not None and entry.is_fresh(now):
+            self.cache.record('hits')
+            return entry.response()
+
+        if entry is not None and entry.has_validators():
+            headers = dict(kwargs.get('headers') or {})
+            if 'ETag' in entry.headers:
+                headers['If-None-Match'] = entry.headers['ETag']
+            if 'Last-Modified' in entry.headers:
+                headers['If-Modified-Since'] = entry.headers['Last-Modified']
+            kwargs['headers'] = headers
+
+        self.cache.record('misses')
+        response = self.transport.request(method,url,**kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.record('revalidations')
+            entry.headers.update(dict((name,response.headers[name]) for name in stored_headers if name in response.headers))
+            entry.expires = expiry(entry.headers,now)
+            self.cache.set(key,entry)
+            return entry.response()
+
+        if response.status_code == 200:
+            headers = dict((name,response.headers[name]) for name in stored_headers if name in response.headers)
+            expires = expiry(headers,now)
+            if expires is None:
+                self.cache.delete(key)
+            elif expires > now or 'ETag' in headers or 'Last-Modified' in headers:
+                self.cache.set(key,CacheEntry(response.url,response.status_code,response.content,headers,expires))
+        return response
@@ -0,0 +1,211 @@
+"""
+Retries and hedged requests for Sharrock clients.
+
+A RetryPolicy retries requests that fail with a connection error, a timeout or
+a 502, 503 or 504 response, sleeping for an exponential backoff with full jitter
+between attempts.  A Hedger sends a second copy of a request if the first has
+not answered by a percentile of the recent latencies of that url, and returns
+whichever response arrives first.
+
+Both only apply to idempotent requests: GETs, and calls to descriptors marked
+idempotent = True.  They are configured per client:
+
+    c = HttpClient('http://example.com/api','myapp','1.0',retry=RetryPolicy(),hedge=Hedger(percentile=95))
+"""
+from requests.exceptions import ConnectionError, Timeout
+from collections import deque
+from Queue import Queue, Empty
+import random
+import threading
+import time
+import logging
+
+log = logging.getLogger('sharrock')
+
+class RetryPolicy(object):
+    """
+    Retries failed requests up to max_attempts times in all.  The delay before retry n
+    is a random time between 0 and backoff * 2**n seconds, capped at max_backoff.
+    """
+    def __init__(self,max_attempts=3,backoff=0.1,max_backoff=5.0,retry_statuses=(502,503,504),retry_exceptions=(ConnectionError,Timeout)):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.retry_exceptions = retry_exceptions
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def delay(self,attempt):
+        """
+        Seconds to wait before the attempt (counting from 1 for the first retry).
+        """
+        return random.uniform(0,min(self.max_backoff,self.backoff * (2 ** attempt)))
+
+    def run(self,send):
+        """
+        Calls send() until it returns a response that need not be retried, or the attempts
+        run out.  The last response is returned, or the last exception raised.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = send()
+                if not response.status_code in self.retry_statuses or attempt >= self.max_attempts:
+                    return response
+                log.info('Retrying %s after %d response.' % (response.url,response.status_code))
+                response.close()
+            except self.retry_exceptions as e:
+                if attempt >= self.max_attempts:
+                    raise
+                log.info('Retrying after %s.' % e)
+            with self._lock:
+                self.retries += 1
+            time.sleep(self.delay(attempt))
+
+class Hedger(object):
+    """
+    Sends a hedge request when a request has been outstanding for longer than the given
+    percentile of the last window latencies of its url.  Requests are not hedged until
+    min_samples latencies have been seen.  Counts the requests made, the hedges fired
+    and the hedges that answered first.
+    """
+    def __init__(self,percentile=95,window=200,min_samples=20,min_delay=0.0):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self,url,latency):
+        with self._lock:
+            latencies = self._latencies.get(url)
+            if latencies is None:
+                latencies = self._latencies[url] = deque(maxlen=self.window)
+            latencies.append(latency)
+
+    def delay(self,url):
+        """
+        Seconds to wait before hedging a request to the url, or None if there are not yet
+        enough samples.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(url,()))
+        if len(latencies) < self.min_samples:
+            return None
+        index = min(len(latencies) - 1,int(len(latencies) * self.percentile / 100.0))
+        return max(self.min_delay,latencies[index])
+
+    def stats(self):
+        """
+        The counts, and the fraction of requests that were hedged.
+        """
+        with self._lock:
+            return {'requests':self.requests,
+                    'hedges':self.hedges,
+                    'hedge_wins':self.hedge_wins,
+                    'hedge_rate':float(self.hedges) / self.requests if self.requests else 0.0}
+
+    def run(self,url,send):
+        """
+        Calls send(), hedging it with a second call if it is slow.  Returns the first
+        response, or raises if every call failed.
+        """
+        with self._lock:
+            self.requests += 1
+        delay = self.delay(url)
+        if delay is None:
+            start = time.time()
+            response = send()
+            self.record(url,time.time() - start)
+            return response
+
+        results = Queue()
+        done = threading.Event()
+        race = threading.Lock()
+        start = time.time()
+
+        def attempt(hedge):
+            try:
+                response = send()
+            except Exception as e:
+                results.put((hedge,None,e))
+                return
+            with race:
+                if not done.is_set():
+                    results.put((hedge,response,None))
+                    return
+            response.close() # lost the race
+
+        self._start(attempt,False)
+        pending = 1
+        try:
+            hedge, response, error = results.get(timeout=delay)
+            pending -= 1
+        except Empty:
+            with self._lock:
+                self.hedges += 1
+            self._start(attempt,True)
+            pending += 1
+            hedge, response, error = results.get()
+            pending -= 1
+
+        while error is not None and pending:
+            hedge, response, error = results.get()
+            pending -= 1
+        with race:
+            done.set()
+
+        # close the responses of attempts that finished after the first, so streamed
+        # responses give their connections back to the pool
+        while True:
+            try:
+                _, late_response, _ = results.get_nowait()
+            except Empty:
+                break
+            if late_response is not None:
+                late_response.close()
+        if error is not None:
+            raise error
+
+        self.record(url,time.time() - start)
+        if hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        return response
+
+    def _start(self,attempt,hedge):
+        thread = threading.Thread(target=attempt,args=(hedge,))
+        thread.daemon = True
+        thread.start()
+
+class RetryingTransport(object):
+    """
+    Wraps a transport, retrying GETs according to the retry policy.
+    """
+    def __init__(self,transport,retry):
+        self.transport = transport
+        self.retry = retry
+
+    def request(self,method,url,**kwargs):
+        return send(self.transport,method,url,retry=self.retry,**kwargs)
+
+def send(transport,method,url,retry=None,hedge=None,idempotent=False,**kwargs):
+    """
+    Sends a request through the transport, applying the retry policy and hedger if it
+    is a GET or idempotent.
+    """
+    request = lambda: transport.request(method,url,**kwargs)
+    if not (method == 'GET' or idempotent):
+        return request()
+    if hedge is not None:
+        hedged = request
+        request = lambda: hedge.run(url,hedged)
+    if retry is not None:
+        return retry.run(request)
+    return request()
@@ -0,0 +1,139 @@
+"""
+Single-flight coalescing of identical client calls.
+
+When a SingleFlight is given to a client, identical idempotent calls (GETs, and
+calls to descriptors marked idempotent) made while one is already in flight do not
+send their own requests: they wait for the call in flight and share its result,
+or its exception.  A SingleFlight may be shared by several clients; calls are
+keyed by url, params, data and credentials.
+
+    flight = SingleFlight()
+    c = HttpClient('http://example.com/api','myapp','1.0',single_flight=flight)
+
+Callers sharing a result from an async client share the same object, so results
+should be treated as read-only.  Callers of blocking clients get their own copy.
+
+On the server, descriptors marked single_flight coalesce identical executions in
+the same way, and cache_flight() extends this across processes with a lock in a
+shared cache.
+"""
+import copy
+import threading
+import time
+import uuid
+
+class Call(object):
+    """
+    A call in flight.
+    """
+    def __init__(self):
+        self.finished = threading.Event()
+        self.value = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent calls.  Counts the calls made and the calls that
+    shared the result of another.  Safe to share between threads.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def do(self,key,func):
+        """
+        Calls func(), unless a call with the same key is in flight, in which case its
+        result is waited for and returned instead.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.finished.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.value)
+
+        try:
+            call.value = func()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.finished.set()
+
+    def submit(self,key,start):
+        """
+        Returns the pending result of the call in flight with the same key, or starts a
+        new call with start(finished).  start must return a pending result, and the
+        call must run finished(), from another thread, once it is complete.
+        """
+        with self._lock:
+            self.calls += 1
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.shared += 1
+                return pending
+
+            def finished():
+                with self._lock:
+                    if self._pending.get(key) is pending:
+                        del self._pending[key]
+            pending = self._pending[key] = start(finished)
+            return pending
+
+    def stats(self):
+        """
+        The counts, and the fraction of calls that shared a result.
+        """
+        with self._lock:
+            return {'calls':self.calls,
+                    'shared':self.shared,
+                    'shared_rate':float(self.shared) / self.calls if self.calls else 0.0}
+
+def cache_flight(cache,key,func,timeout=30,poll_interval=0.05):
+    """
+    Coalesces calls across processes sharing the cache (a Django cache).  The first
+    caller takes a lock in the cache, calls func() and stores the result, which must be
+    picklable, for the callers that waited on the lock.  Callers give up waiting after
+    timeout seconds and call func() themselves, as they do if the lock is released
+    without a result.  A caller only releases the lock if it still holds it.
+    """
+    lock_key = 'sharrock-flight-lock-%s' % key
+    token = uuid.uuid4().hex
+    if cache.add(lock_key,token,timeout):
+        try:
+            value = func()
+            cache.set('sharrock-flight-result-%s-%s' % (key,token),value,timeout)
+            return value
+        finally:
+            # if func() outlived the lock, it may now be another caller's
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    # wait for the result of the call holding the lock
+    token = cache.get(lock_key)
+    deadline = time.time() + timeout
+    while token and time.time() < deadline:
+        value = cache.get('sharrock-flight-result-%s-%s' % (key,token))
+        if value is not None:
+            return value
+        if cache.get(lock_key) != token:
+            value = cache.get('sharrock-flight-result-%s-%s' % (key,token))
+            if value is not None:
+                return value
+            break
+        time.sleep(poll_interval)
+    return func()
@@ -0,0 +1,250 @@
+"""
+Incremental JSON decoding for streamed responses.
+
+iter_json_array() parses a top-level JSON array element by element as chunks of
+text arrive, and iter_ndjson() parses newline delimited JSON, so that large
+results can be processed without holding the whole body or the whole object
+graph in memory.  iter_lines() splits a (possibly gzipped) stream into lines as
+it is read, for streamed request bodies.
+
+On the server, StreamedResult encodes the values of a generator returned by a
+descriptor as a JSON array or NDJSON, in chunks.  An error raised by the
+generator after the response has started is sent as a last, trailer value:
+
+    {"sharrock_error": {"status": 500, "message": "..."}}
+
+which iter_response() turns back into a StreamError.
+"""
+import codecs
+import json
+import time
+import zlib
+import logging
+
+log = logging.getLogger('sharrock')
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# drop consumed text from the buffer once this many characters have been parsed
+COMPACT_THRESHOLD = 64 * 1024
+
+# key of the error trailer of a streamed result
+ERROR_TRAILER = 'sharrock_error'
+
+whitespace = ' \t\n\r'
+delimiters = whitespace + ',]'
+
+class StreamDecodeError(ValueError):
+    """
+    Indicates the stream is not a well formed JSON array.
+    """
+    pass
+
+class StreamError(Exception):
+    """
+    Indicates the server failed part way through a streamed result.
+    """
+    def __init__(self,status_code,content):
+        super(StreamError,self).__init__(status_code,content)
+        self.status_code = status_code
+        self.content = content
+
+def is_stream(value):
+    """
+    Checks if a result is an iterator, such as a generator, to be streamed.
+    """
+    return hasattr(value,'next') and hasattr(value,'__iter__') and not isinstance(value,(basestring,dict,list,tuple))
+
+class StreamedResult(object):
+    """
+    Encodes the values of an iterator as a JSON array, or as NDJSON if ndjson is True.
+    Iterating it yields chunks of at least chunk_size bytes, or whatever has been
+    encoded once flush_interval seconds have passed since the last chunk, so that slow
+    generators still deliver values as they go.  encode serializes a value.  If context
+    is given, each value is produced inside the context manager it returns.
+    """
+    def __init__(self,values,encode=json.dumps,ndjson=False,context=None,chunk_size=64 * 1024,flush_interval=1.0):
+        self.values = iter(values)
+        self.encode = encode
+        self.ndjson = ndjson
+        self.context = context
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+
+    @property
+    def content_type(self):
+        return NDJSON_CONTENT_TYPE if self.ndjson else 'application/json'
+
+    def _next(self):
+        """
+        The next value, encoded.
+        """
+        if self.context is None:
+            return self.encode(next(self.values))
+        with self.context():
+            return self.encode(next(self.values))
+
+    def _delimit(self,encoded,count):
+        if self.ndjson:
+            return encoded + '\n'
+        return encoded if count == 0 else ',' + encoded
+
+    def __iter__(self):
+        parts = [] if self.ndjson else ['[']
+        size = 0
+        count = 0
+        flushed = time.time()
+        while True:
+            try:
+                encoded = self._delimit(self._next(),count)
+            except StopIteration:
+                break
+            except Exception as e:
+                # the status has been sent, so the error goes in a trailer
+                log.exception('Exception while streaming a result.')
+                parts.append(self._delimit(json.dumps({ERROR_TRAILER:{'status':500,'message':unicode(e)}}),count))
+                break
+            count += 1
+            parts.append(encoded)
+            size += len(encoded)
+            if size >= self.chunk_size or time.time() - flushed >= self.flush_interval:
+                yield ''.join(parts)
+                parts = []
+                size = 0
+                flushed = time.time()
+        if not self.ndjson:
+            parts.append(']')
+        if parts:
+            yield ''.join(parts)
+
+def is_error_trailer(value):
+    """
+    Checks if a streamed value is the error trailer of a failed result.
+    """
+    return isinstance(value,dict) and len(value) == 1 and ERROR_TRAILER in value
+
+def iter_json_array(chunks,decoder=None):
+    """
+    Incrementally parses a JSON array from an iterable of text chunks, yielding
+    each element of the array as soon as it is complete.
+    """
+    decoder = decoder or json.JSONDecoder(strict=False)
+    chunks = iter(chunks)
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = u''
+    pos = 0
+    exhausted = False
+    started = False
+
+    while True:
+        # skip whitespace, and the separators between elements
+        while pos < len(buffer) and (buffer[pos] in whitespace or (started and buffer[pos] == ',')):
+            pos += 1
+
+        if pos < len(buffer):
+            if not started:
+                if buffer[pos] != '[':
+                    raise StreamDecodeError('Expected a JSON array, found %r.' % buffer[pos:pos + 20])
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer,pos)
+            except ValueError:
+                if exhausted:
+                    raise StreamDecodeError('Malformed JSON array element at %r.' % buffer[pos:pos + 20])
+                end = None
+            # an element must be followed by a delimiter, otherwise it may continue in the next chunk (numbers)
+            if end is not None and end < len(buffer) and not buffer[end] in delimiters:
+                if exhausted:
+                    raise StreamDecodeError('Malformed JSON array element at %r.' % buffer[pos:pos + 20])
+                end = None
+            if end is not None and (end < len(buffer) or exhausted):
+                yield element
+                pos = end
+                if pos > COMPACT_THRESHOLD:
+                    buffer = buffer[pos:]
+                    pos = 0
+                continue
+        elif exhausted:
+            if not started:
+                return # an empty body is an empty result
+            raise StreamDecodeError('Unexpected end of JSON array.')
+
+        # need more text
+        try:
+            chunk = next(chunks)
+            if isinstance(chunk,str):
+                chunk = utf8.decode(chunk) # bytes chunks may split characters
+            buffer += chunk
+        except StopIteration:
+            exhausted = True
+
+def iter_ndjson(lines):
+    """
+    Parses newline delimited JSON from an iterable of lines, yielding one value per
+    non-blank line.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line,strict=False)
+
+def iter_chunks(read,chunk_size=64 * 1024,gzipped=False):
+    """
+    Yields the chunks of a stream as it is read with read(size), decompressed if it is
+    gzipped.  Decompressed chunks are bounded by chunk_size too, so that a small
+    compressed chunk cannot inflate into a huge one.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is None:
+            yield chunk
+            continue
+        data = decompressor.decompress(chunk,chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail,chunk_size) if decompressor.unconsumed_tail else ''
+    if decompressor is not None:
+        data = decompressor.flush()
+        if data:
+            yield data
+
+def iter_lines(read,chunk_size=64 * 1024,gzipped=False):
+    """
+    Yields the lines of a stream, without their line endings, as it is read with
+    read(size).  Only a chunk and the line being read are held in memory.
+    """
+    pending = ''
+    for chunk in iter_chunks(read,chunk_size,gzipped):
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    if pending:
+        yield pending.rstrip('\r')
+
+def iter_response(response,chunk_size=64 * 1024):
+    """
+    Iterates the values in a streamed requests response: the lines of an NDJSON
+    response, or the elements of a JSON array.  Raises StreamError if the server
+    sent an error trailer.  The response is closed once it has
+    been consumed, or when the iteration is abandoned.
+    """
+    try:
+        if response.headers.get('Content-Type','').startswith(NDJSON_CONTENT_TYPE):
+            values = iter_ndjson(response.iter_lines(chunk_size=chunk_size))
+        else:
+            if not response.encoding:
+                response.encoding = 'utf-8'
+            values = iter_json_array(response.iter_content(chunk_size=chunk_size,decode_unicode=True))
+        for value in values:
+            if is_error_trailer(value):
+                raise StreamError(value[ERROR_TRAILER].get('status',500),value[ERROR_TRAILER].get('message'))
+            yield value
+    finally:
+        response.close()
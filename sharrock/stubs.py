@@ -0,0 +1,271 @@
+"""
+Static client stubs for Sharrock.
+
+generate_stubs() turns the descriptors for an app and version into the source of
+an importable Python module, with one function per function descriptor and one
+per resource method.  Param checks are generated inline and urls are baked in,
+so the generated clients make no describe requests and do no per-call setup.
+The descriptors can come from a server's directory (descriptors_from_server) or
+from the local registry (descriptors_from_registry).
+
+The generated modules call into StubRuntime, below, for their http requests.
+"""
+from sharrock.client import MissingParam, BadParamType, ServiceException, has_uploads
+from sharrock.files import MultipartBody
+from sharrock.transport import default_transport, auth_headers
+from sharrock.descriptorcache import directory_url
+import json
+import keyword
+import re
+import logging
+
+log = logging.getLogger('sharrock')
+
+###############
+### Runtime ###
+###############
+
+class StubRuntime(object):
+    """
+    Sends the requests for a generated stub module.
+    """
+    def __init__(self,service_url,resource_url=None):
+        self.service_url = service_url
+        self.resource_url = resource_url
+        self.headers = auth_headers('','')
+        self.transport = None
+
+    def configure(self,service_url=None,resource_url=None,auth_user='',auth_password='',transport=None):
+        """
+        Sets the urls, credentials and transport used by the stubs.
+        """
+        if service_url:
+            self.service_url = service_url
+        if resource_url:
+            self.resource_url = resource_url
+        self.headers = auth_headers(auth_user,auth_password)
+        self.transport = transport
+
+    def process_response(self,response):
+        """
+        Processes response from the server.
+        """
+        if response.status_code >= 400:
+            raise ServiceException(response.status_code,response.text)
+        try:
+            return response.json(strict=False)
+        except ValueError:
+            log.warning('Cannot JSON decode response: %s' % response.text)
+            return []
+
+    def upload(self,method,url,values):
+        """
+        Sends values holding file objects as a multipart body, which streams the files.
+        """
+        body = MultipartBody.from_values(values)
+        headers = dict(self.headers)
+        headers['Content-Type'] = body.content_type
+        return self.process_response((self.transport or default_transport()).request(method,url,data=body,headers=headers))
+
+    def call_function(self,url,data=None,params=None):
+        """
+        Calls a function service, posting data as a JSON body if there is any.  Params or
+        data holding file objects are uploaded.
+        """
+        if has_uploads(data or params):
+            return self.upload('POST',url,data or params)
+        transport = self.transport or default_transport()
+        if data:
+            response = transport.request('POST',url,data=json.dumps(data),headers=self.headers)
+        else:
+            response = transport.request('GET',url,params=params,headers=self.headers)
+        return self.process_response(response)
+
+    def call_resource(self,method,url,data=None,params=None):
+        """
+        Calls a resource method.  Data is sent as a JSON body, params in the query string.
+        Params or data holding file objects are uploaded with a POST or PUT.
+        """
+        if method in ('POST','PUT') and has_uploads(data or params):
+            return self.upload(method,url,data or params)
+        transport = self.transport or default_transport()
+        if method in ('GET','DELETE') or not data:
+            response = transport.request(method,url,params=params,headers=self.headers)
+        else:
+            response = transport.request(method,url,data=json.dumps(data),headers=self.headers)
+        return self.process_response(response)
+
+#######################
+### Descriptor data ###
+#######################
+
+def descriptors_from_server(service_url,app,version,transport=None):
+    """
+    Fetches the descriptors for the app and version from the server's directory.
+    Returns a dictionary with 'functions' and 'resources' lists.
+    """
+    response = (transport or default_transport()).request('GET',directory_url(service_url,app,version))
+    if response.status_code >= 400:
+        raise ServiceException(response.status_code,response.text)
+    for apps in response.json(strict=False):
+        if app in apps and version in apps[app]:
+            return apps[app][version]
+    return {'functions':[],'resources':[]}
+
+def describe_descriptor(descriptor):
+    """
+    Converts a descriptor to the dictionary form served by the describe views.
+    """
+    return {'name':descriptor.service_name,
+            'slug':descriptor.slug,
+            'params':[{'name':param.name,
+                       'type':param.type,
+                       'required':unicode(param.required),
+                       'default':unicode(param.default),
+                       'description':unicode(param.description)} for param in descriptor.params],
+            'idempotent':unicode(descriptor.idempotent),
+            'docs':descriptor.docs_plain}
+
+def descriptors_from_registry(app,version):
+    """
+    Gets the descriptors for the app and version from the local registry.  Returns a
+    dictionary with 'functions' and 'resources' lists.
+    """
+    from sharrock import registry
+    services = registry.directory(app_label=app,specified_version=version).get(app,{}).get(version,{'functions':[],'resources':[]})
+    resources = []
+    for resource in services['resources']:
+        described = {'name':resource.name,'slug':resource.slug}
+        for method_name in ('get','post','put','delete'):
+            if getattr(resource,method_name,None):
+                described[method_name] = describe_descriptor(getattr(resource,method_name))
+        resources.append(described)
+    return {'functions':[describe_descriptor(descriptor) for descriptor in services['functions']],
+            'resources':resources}
+
+##################
+### Generation ###
+##################
+
+# inline checks matching client.ParamValidator, by param type (omitted optional params always pass)
+type_checks = {
+    'Unicode':'unicode(%(value)s)',
+    'Integer':'if %(value)s is not None: int(%(value)s)',
+    'Float':'if %(value)s is not None: float(%(value)s)',
+    'List':"if %(value)s is not None and not hasattr(%(value)s,'__iter__'): raise ValueError",
+    'Dictionary':"if %(value)s is not None and not hasattr(%(value)s,'keys'): raise ValueError",
+    'File':"if %(value)s is not None and not hasattr(%(value)s,'read'): raise ValueError",
+    'Stream':"if %(value)s is not None and not hasattr(%(value)s,'read'): raise ValueError",
+}
+
+def function_name(slug):
+    """
+    Converts a slug to a python identifier.
+    """
+    name = re.sub(r'\W','_',slug)
+    if name[0].isdigit() or keyword.iskeyword(name):
+        name = '_%s' % name
+    return name
+
+# names the generated functions use themselves, which params cannot be arguments named after
+generated_names = ('data','local_param_check','params','checked')
+
+def is_identifier(name):
+    """
+    Checks if a param can be a keyword argument of a generated function.  Names with a
+    leading underscore are left out, as they could shadow the module's _runtime and
+    _check functions.
+    """
+    return bool(re.match(r'^[A-Za-z]\w*$',name)) and not keyword.iskeyword(name) and not name in generated_names
+
+def generate_checks(params,indent='    '):
+    """
+    Generates the statements that check the params dictionary.
+    """
+    lines = []
+    for param in params:
+        name = param['name']
+        if param['required'] == 'True':
+            lines.append('if not params.get(%r): raise MissingParam(%r)' % (name,name))
+        check = type_checks.get(param['type'])
+        if check:
+            lines.append('try:')
+            lines.append('    value = params.get(%r)' % name)
+            for check_line in (check % {'value':'value'}).split('\n'):
+                lines.append('    %s' % check_line)
+            lines.append('except ValueError:')
+            lines.append('    raise BadParamType(%r,params.get(%r),%r)' % (name,name,param['type']))
+    return [indent + line for line in lines]
+
+def generate_function(name,descriptor,url_expression,method):
+    """
+    Generates a stub function for the descriptor.  Params become keyword arguments
+    when they are all valid identifiers that the function does not use itself,
+    otherwise they are taken as **params.  Params named data or local_param_check
+    can then only be sent in data.
+    """
+    params = descriptor['params']
+    explicit = all(is_identifier(param['name']) for param in params)
+
+    lines = []
+    if explicit:
+        arguments = ['%s=None' % param['name'] for param in params] + ['data=None','local_param_check=True']
+        lines.append('def %s(%s):' % (name,','.join(arguments)))
+    else:
+        lines.append('def %s(data=None,local_param_check=True,**params):' % name)
+    lines.append('    """')
+    lines.append('    %s' % (descriptor['name'] or name).replace('"""',"'''"))
+    lines.append('    """')
+    if explicit:
+        lines.append('    params = {}')
+        for param in params:
+            lines.append('    if %s is not None: params[%r] = %s' % (param['name'],param['name'],param['name']))
+    if params:
+        lines.append('    if local_param_check:')
+        lines.append('        checked = data if data else params')
+        lines.append('        _check_%s(checked)' % name)
+
+    if method:
+        lines.append('    return _runtime.call_resource(%r,%s,data=data,params=params)' % (method,url_expression))
+    else:
+        lines.append('    return _runtime.call_function(%s,data=data,params=params)' % url_expression)
+
+    check_lines = []
+    if params:
+        check_lines.append('def _check_%s(params):' % name)
+        check_lines.extend(generate_checks(params))
+        check_lines.append('')
+    return '\n'.join(check_lines + lines) + '\n'
+
+def generate_stubs(descriptors,service_url,app,version,resource_url=None):
+    """
+    Generates the source of a stub module for the descriptors of an app and version,
+    as returned by descriptors_from_server() or descriptors_from_registry().
+    Resource stubs are only generated if resource_url is given.
+    """
+    out = []
+    out.append('"""')
+    out.append('Sharrock client stubs for %s %s.  Generated by sharrock.stubs, do not edit.' % (app,version))
+    out.append('')
+    out.append('Call configure() to change the urls or to set credentials or a transport.')
+    out.append('"""')
+    out.append('from sharrock.stubs import StubRuntime, MissingParam, BadParamType')
+    out.append('')
+    out.append('_runtime = StubRuntime(%r,%r)' % (service_url,resource_url))
+    out.append('configure = _runtime.configure')
+    out.append('')
+
+    for descriptor in sorted(descriptors.get('functions',[]),key=lambda descriptor: descriptor['slug']):
+        name = function_name(descriptor['slug'])
+        url = "_runtime.service_url + %r" % ('/%s/%s/%s.json' % (app,version,descriptor['slug']))
+        out.append(generate_function(name,descriptor,url,None))
+
+    if resource_url:
+        for resource in sorted(descriptors.get('resources',[]),key=lambda resource: resource['slug']):
+            url = "_runtime.resource_url + %r" % ('/%s/%s/%s.json' % (app,version,resource['slug']))
+            for method_name in ('get','post','put','delete'):
+                if method_name in resource:
+                    name = function_name('%s_%s' % (resource['slug'],method_name))
+                    out.append(generate_function(name,resource[method_name],url,method_name.upper()))
+
+    return '\n'.join(out)
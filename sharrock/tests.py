@@ -2,8 +2,63 @@
 Unit tests for Sharrock
 """
 import unittest
-from sharrock.client import HttpClient, ResourceClient, ModelResourceClient
-from django.contrib.auth.models import User
+import threading
+from sharrock.client import HttpClient, ResourceClient, ModelResourceClient, MissingParam, BadParamType, ServiceException
+from sharrock.descriptorcache import DescriptorCache
+from sharrock.responsecache import ResponseCache, CacheEntry
+from sharrock.asyncclient import AsyncHttpClient, AsyncResourceClient, AsyncModelResourceClient, CallPool, gather, gather_calls
+from sharrock.retry import RetryPolicy, Hedger
+from sharrock.balancer import EndpointPool
+from sharrock.singleflight import SingleFlight, cache_flight
+from sharrock.transport import default_transport, HttpTransport
+from sharrock.descriptors import Descriptor
+from sharrock.modelresource import ModelResource
+from sharrock.files import FileResult
+from sharrock.replicas import PIN_COOKIE, PinningTransport
+from sharrock import columnar
+from sharrock import stubs, registry, traffic
+from requests.exceptions import ConnectionError
+import imp
+from sharrock.views import execute_resource, execute_service, make_response
+from sharrock_modelresource_example.descriptors import UserResource
+from sharrock_modelresource_example.models import Article
+from sharrock.models import Tombstone
+from django.contrib.auth.models import User, Group, Permission
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.db import connection, transaction
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from StringIO import StringIO
+import base64
+import itertools
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+class FlakyTransport(object):
+    """
+    Transport that fails the next requests with connection errors, and records the
+    urls it is sent.
+    """
+    def __init__(self,transport,failures=0):
+        self.transport = transport
+        self.failures = failures
+        self.urls = []
+    
+    def request(self,method,url,**kwargs):
+        self.urls.append(url)
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Simulated failure.')
+        return self.transport.request(method,url,**kwargs)
 
 class ClientTests(unittest.TestCase):
     """
@@ -31,12 +86,342 @@ class ClientTests(unittest.TestCase):
         new_result = self.c.helloworld(name='Loren')
         self.assertEquals(new_result,'Hello Loren!')
     
+    def test_generator(self):
+        """
+        Tests calling a descriptor that streams the values of a generator.
+        """
+        self.assertEquals(list(self.c.call('count',params={'to':3},stream=True)),[{'number':1},{'number':2},{'number':3}])
+        self.assertEquals(self.c.count(to=3),[{'number':1},{'number':2},{'number':3}]) # as a JSON array
+    
+    def test_generator_error(self):
+        """
+        Tests that an error part way through a streamed result is raised when it is reached.
+        """
+        results = self.c.call('count',params={'to':5,'fail_at':3},stream=True)
+        self.assertEquals(next(results),{'number':1})
+        self.assertEquals(next(results),{'number':2})
+        with self.assertRaises(ServiceException) as raised:
+            next(results)
+        self.assertEquals(raised.exception.status_code,500)
+        self.assertTrue('Failed at 3' in raised.exception.content)
+    
     def test_post_data(self):
         """
         Tests the post data service.
         """
         result = self.c.postdata(data={'foo':'bar'})
         self.assertEquals(result['grommit'],'bar')
+    
+    def test_prefetch(self):
+        """
+        Tests prefetching all of the descriptors for the app in one request.
+        """
+        cache = DescriptorCache()
+        self.assertTrue(cache.prefetch('http://localhost:8000/api','sharrock_example','1.0') >= 4)
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0',descriptor_cache=cache)
+        self.assertEquals(c.helloworld(name='Loren'),'Hello Loren!')
+    
+    def test_stubs(self):
+        """
+        Tests generated client stubs.
+        """
+        descriptors = stubs.descriptors_from_server('http://localhost:8000/api','sharrock_example','1.0')
+        module = imp.new_module('sharrock_example_stubs')
+        exec stubs.generate_stubs(descriptors,'http://localhost:8000/api','sharrock_example','1.0') in module.__dict__
+        self.assertEquals(module.helloworld(name='Loren'),'Hello Loren!')
+        self.assertRaises(MissingParam,module.parameterizedservice,bar=1)
+    
+    def test_stub_reserved_names(self):
+        """
+        Tests stubs for params named like the generated functions' own names.
+        """
+        names = ['local_param_check','params','checked','data','_runtime','foo']
+        descriptors = {'functions':[{'name':'Clash','slug':'clash','idempotent':'False',
+                                     'params':[{'name':name,'type':'Unicode','required':'False'} for name in names]}]}
+        module = imp.new_module('clash_stubs')
+        exec stubs.generate_stubs(descriptors,'http://localhost:8000/api','test','1.0') in module.__dict__
+        sent = []
+        class Response(object):
+            status_code = 200
+            def json(self,strict=False):
+                return 'ok'
+        class Transport(object):
+            def request(self,method,url,**kwargs):
+                sent.append(kwargs['params'])
+                return Response()
+        module.configure(transport=Transport())
+        passed = dict((name,name.upper()) for name in names if not name in ('data','local_param_check')) # those are sent as data
+        self.assertEquals(module.clash(**passed),'ok')
+        self.assertEquals(sent,[passed])
+        
+        explicit = stubs.generate_stubs({'functions':[{'name':'Simple','slug':'simple','idempotent':'False',
+                                                       'params':[{'name':'foo','type':'Unicode','required':'True'}]}]},
+                                        'http://localhost:8000/api','test','1.0')
+        self.assertTrue('def simple(foo=None,data=None,local_param_check=True):' in explicit)
+    
+    def test_stub_upload(self):
+        """
+        Tests uploading files through stubs.
+        """
+        descriptors = stubs.descriptors_from_server('http://localhost:8000/api','sharrock_example','1.0')
+        module = imp.new_module('sharrock_example_upload_stubs')
+        exec stubs.generate_stubs(descriptors,'http://localhost:8000/api','sharrock_example','1.0') in module.__dict__
+        self.assertEquals(module.linecount(upload=StringIO('a\nb\n')),{'lines':2})
+        self.assertRaises(BadParamType,module.linecount,upload='a\nb\n')
+    
+    def test_response_cache(self):
+        """
+        Tests that cacheable responses are answered from the response cache.
+        """
+        cache = ResponseCache()
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0',response_cache=cache)
+        self.assertEquals(c.cachedhello(name='Loren'),'Hello Loren!')
+        self.assertEquals(c.cachedhello(name='Loren'),'Hello Loren!')
+        self.assertEquals(c.cachedhello(name='Fred'),'Hello Fred!')
+        self.assertEquals(cache.hits,1)
+        self.assertEquals(cache.misses,2)
+    
+    def test_retry(self):
+        """
+        Tests retrying idempotent calls after connection errors.
+        """
+        transport = FlakyTransport(default_transport(),failures=1)
+        policy = RetryPolicy(backoff=0.01)
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0',transport=transport,retry=policy,descriptor_cache=DescriptorCache())
+        c._cache_descriptor('postdata') # the descriptor fetch fails first
+        c._cache_descriptor('helloworld')
+        self.assertEquals(policy.retries,1)
+        transport.failures = 1
+        self.assertEquals(c.postdata(data={'foo':'bar'}),{'grommit':'bar'})
+        transport.failures = 1
+        self.assertEquals(c.helloworld(name='Loren'),'Hello Loren!')
+        self.assertEquals(policy.retries,3)
+    
+    def test_custom_transport(self):
+        """
+        Tests that descriptors are fetched through the transport the client was given.
+        """
+        transport = FlakyTransport(default_transport())
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0',transport=transport,descriptor_cache=DescriptorCache())
+        self.assertEquals(c.helloworld(name='Loren'),'Hello Loren!')
+        self.assertEquals([url.split('/')[4] for url in transport.urls],['describe','sharrock_example'])
+    
+    def test_hedge(self):
+        """
+        Tests hedging calls slower than the recorded latencies.
+        """
+        hedger = Hedger(percentile=50,min_samples=5)
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0',hedge=hedger)
+        for i in range(10):
+            self.assertEquals(c.helloworld(name='Loren'),'Hello Loren!')
+        stats = hedger.stats()
+        self.assertEquals(stats['requests'],10)
+        self.assertEquals(stats['hedge_rate'],float(stats['hedges']) / 10)
+    
+    def test_hedge_closes_losers(self):
+        """
+        Tests that the response of an attempt losing a hedged race is closed, even if it
+        finishes while the winner is being chosen.
+        """
+        from sharrock import retry
+        class Response(object):
+            closed = False
+            def close(self):
+                self.closed = True
+        
+        hedge_sent = threading.Event()
+        both_sent = threading.Event()
+        responses = []
+        def send():
+            response = Response()
+            responses.append(response)
+            if len(responses) == 1:
+                hedge_sent.wait(1)
+                time.sleep(0.01) # lose to the hedge
+                both_sent.set()
+            else:
+                hedge_sent.set()
+            return response
+        
+        class LateEvent(threading._Event):
+            def set(self):
+                both_sent.wait(1) # the loser finishes after the winner is taken
+                time.sleep(0.01)
+                super(LateEvent,self).set()
+        
+        class Threading(object):
+            Event = LateEvent
+            Lock = staticmethod(threading.Lock)
+            Thread = threading.Thread
+        
+        hedger = Hedger(percentile=50,min_samples=5,min_delay=0.01)
+        for i in range(5):
+            hedger.record('http://localhost:8000/x',0.01)
+        retry.threading = Threading
+        try:
+            winner = hedger.run('http://localhost:8000/x',send)
+        finally:
+            retry.threading = threading
+        time.sleep(0.05)
+        self.assertTrue(winner is responses[1])
+        self.assertEquals([response.closed for response in responses],[True,False])
+    
+    def test_balancing(self):
+        """
+        Tests balancing calls across endpoints, ejecting an endpoint that is down.
+        """
+        pool = EndpointPool(['http://localhost:8001/api','http://localhost:8000/api'],failure_threshold=1)
+        c = HttpClient(pool,'sharrock_example','1.0',retry=RetryPolicy(backoff=0.01))
+        for i in range(5):
+            self.assertEquals(c.helloworld(name='Loren'),'Hello Loren!')
+        down, up = pool.stats()
+        self.assertEquals(down['state'],'open')
+        self.assertEquals(up['state'],'closed')
+        self.assertTrue(up['requests'] >= 5)
+    
+    def test_single_flight(self):
+        """
+        Tests coalescing identical concurrent calls.
+        """
+        flight = SingleFlight()
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0',single_flight=flight)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(c.helloworld(name='Loren'))) for i in range(10)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEquals(results,['Hello Loren!'] * 10)
+        self.assertEquals(flight.stats()['calls'],10)
+    
+    def test_server_single_flight(self):
+        """
+        Tests concurrent identical requests sharing one execution on the server.
+        """
+        c = HttpClient('http://localhost:8000/api','sharrock_example','1.0')
+        results = gather_calls([lambda: c.slowreport(name='Loren') for i in range(5)])
+        self.assertEquals(len(set(result['execution'] for result in results)),1)
+    
+    def test_download(self):
+        """
+        Tests downloading a file result to disk, and resuming a partial download.
+        """
+        expected = ''.join('%d,%d\n' % (number,number * number) for number in range(1,1001))
+        path = tempfile.mktemp(suffix='.csv')
+        try:
+            self.assertEquals(self.c.download('export',path,params={'rows':1000}),len(expected))
+            self.assertEquals(open(path,'rb').read(),expected)
+            
+            with open(path,'wb') as f:
+                f.write(expected[:100])
+            self.assertEquals(self.c.download('export',path,params={'rows':1000},resume=True),len(expected) - 100)
+            self.assertEquals(open(path,'rb').read(),expected)
+            self.assertEquals(self.c.download('export',path,params={'rows':1000},resume=True),0) # complete
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def test_upload(self):
+        """
+        Tests uploading files as streamed multipart bodies, with other params.
+        """
+        f = tempfile.TemporaryFile()
+        content = ''.join('line %d\n' % i for i in range(100000))
+        f.write(content)
+        f.seek(0)
+        result = self.c.checksum(upload=f,label='Loren')
+        self.assertEquals((result['size'],result['md5'],result['label']),(len(content),hashlib.md5(content).hexdigest(),'Loren'))
+        f.seek(0)
+        self.assertEquals(self.c.linecount(upload=f),{'lines':100000})
+        self.assertEquals(self.c.linecount(upload=StringIO('a\nb\n')),{'lines':2})
+        self.assertRaises(BadParamType,self.c.linecount,upload='a\nb\n')
+    
+    def test_threaded_calls(self):
+        """
+        Tests calls from several threads sharing the client and its pooled transport.
+        """
+        results = []
+        def call(name):
+            results.append(self.c.helloworld(name=name))
+        threads = [threading.Thread(target=call,args=('Thread %d' % i,)) for i in range(20)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        self.assertEquals(sorted(results),sorted(['Hello Thread %d!' % i for i in range(20)]))
+
+class AsyncClientTests(unittest.TestCase):
+    """
+    Tests for the concurrent clients.
+    """
+    def test_fan_out(self):
+        """
+        Tests firing many calls at once.
+        """
+        c = AsyncHttpClient('http://localhost:8000/api','sharrock_example','1.0')
+        results = gather(*[c.helloworld(name='Caller %d' % i) for i in range(30)])
+        self.assertEquals(results,['Hello Caller %d!' % i for i in range(30)])
+    
+    def test_single_flight(self):
+        """
+        Tests identical calls sharing the call in flight.
+        """
+        flight = SingleFlight()
+        c = AsyncHttpClient('http://localhost:8000/api','sharrock_example','1.0',single_flight=flight)
+        self.assertEquals(gather(*[c.helloworld(name='Loren') for i in range(10)]),['Hello Loren!'] * 10)
+        self.assertTrue(flight.stats()['shared'] > 0)
+    
+    def test_resource(self):
+        """
+        Tests the resource operations.
+        """
+        c = AsyncResourceClient('http://localhost:8000/resources','sharrock_resource_example','1.0','meresource')
+        get_result, post_result = gather(c.get(),c.post(params={'name':'posttest'}))
+        self.assertEquals('Get Method executed!',get_result)
+        self.assertEquals('Posted posttest',post_result)
+    
+    def test_model_resource_aggregates(self):
+        """
+        Tests counting and aggregating a model resource concurrently.
+        """
+        c = AsyncModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','userresource')
+        users = [User.objects.create(username=username) for username in ('Tom','Dick','Harry')]
+        try:
+            count, aggregates, groups, tom = gather(c.count(username__in=['Tom','Dick','Harry']),
+                                                    c.aggregate(['min:id','max:id'],username__in=['Tom','Dick','Harry']),
+                                                    c.group_count('is_staff',username__in=['Tom','Dick','Harry']),
+                                                    c.get(users[0].pk))
+            self.assertEquals(count,3)
+            self.assertEquals(aggregates,{'id__min':users[0].pk,'id__max':users[2].pk})
+            self.assertEquals(groups,[{'is_staff':False,'count':3}])
+            self.assertEquals(tom['username'],'Tom')
+        finally:
+            for user in users:
+                user.delete()
+    
+    def test_model_resource_get_many(self):
+        """
+        Tests getting many models of a model resource concurrently.
+        """
+        c = AsyncModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','userresource')
+        users = [User.objects.create(username=username) for username in ('Tom','Dick','Harry')]
+        missing_pk = User.objects.order_by('-pk')[0].pk + 1000
+        try:
+            models, missing = c.get_many([users[0].pk,users[2].pk,missing_pk],batch_size=2).get(10)
+            self.assertEquals(models[unicode(users[0].pk)]['username'],'Tom')
+            self.assertEquals(models[unicode(users[2].pk)]['username'],'Harry')
+            self.assertEquals(missing,[missing_pk])
+        finally:
+            for user in users:
+                user.delete()
+    
+    def test_bounded_nested_calls(self):
+        """
+        Tests that bounded calls submitting to the same pool do not deadlock it.
+        """
+        pool = CallPool(concurrency=2)
+        c = AsyncHttpClient('http://localhost:8000/api','sharrock_example','1.0',pool=pool)
+        try:
+            results = gather_calls([lambda i=i: c.helloworld(name='Caller %d' % i).get(5) for i in range(6)],concurrency=1,pool=pool,timeout=10)
+            self.assertEquals(results,['Hello Caller %d!' % i for i in range(6)])
+        finally:
+            pool.close()
 
 class ResourceClientTests(unittest.TestCase):
     """
@@ -114,6 +499,28 @@ class ModelResourceClientTests(unittest.TestCase):
         self.assertTrue('Dick' in usernames)
         self.assertTrue('Harry' in usernames)
     
+    def test_list_stream(self):
+        """
+        Tests streaming the listing of a resource.
+        """
+        results = self.c.list(stream=True)
+        self.assertFalse(isinstance(results,list))
+        usernames = [result['username'] for result in results]
+        self.assertTrue('Tom' in usernames)
+        self.assertTrue('Dick' in usernames)
+        self.assertTrue('Harry' in usernames)
+    
+    def test_list_columnar(self):
+        """
+        Tests listing a resource in columnar form.
+        """
+        c = ModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','userresource',columnar=True)
+        results = c.list(username__in=['Tom','Dick','Harry'],order_by=['id'])
+        self.assertTrue(isinstance(results,columnar.ColumnarRows))
+        self.assertEquals(results.column('username'),['Tom','Dick','Harry'])
+        self.assertEquals([result.as_dict() for result in results],self.c.list(username__in=['Tom','Dick','Harry'],order_by=['id']))
+        self.assertEquals(c.get(self.tom.pk)['username'],'Tom') # not a list
+    
     def test_get(self):
         """
         Tests the get function.
@@ -121,6 +528,16 @@ class ModelResourceClientTests(unittest.TestCase):
         tom_dict = self.c.get(self.tom.pk)
         self.assertEquals(tom_dict['username'],self.tom.username)
     
+    def test_get_many(self):
+        """
+        Tests getting several models at once.
+        """
+        missing_pk = User.objects.order_by('-pk')[0].pk + 1000
+        models, missing = self.c.get_many([self.tom.pk,self.harry.pk,missing_pk])
+        self.assertEquals(models[unicode(self.tom.pk)]['username'],'Tom')
+        self.assertEquals(models[unicode(self.harry.pk)]['username'],'Harry')
+        self.assertEquals(missing,[missing_pk])
+    
     def test_create(self):
         """
         Tests create function.
@@ -128,6 +545,7 @@ class ModelResourceClientTests(unittest.TestCase):
         zelda_dict = self.c.create(username='Zelda')
         zelda_model = User.objects.get(pk=zelda_dict['id'])
         self.assertEquals('Zelda',zelda_model.username)
+        zelda_model.delete()
     
     def test_update(self):
         """
@@ -138,6 +556,52 @@ class ModelResourceClientTests(unittest.TestCase):
         self.assertEquals(tom.first_name,'Thomas')
         self.assertEquals(tom.last_name,'Wayne')
     
+    def test_filter(self):
+        """
+        Tests filtering and ordering a list.
+        """
+        results = self.c.list(username__in=['Tom','Harry'],order_by=['-username'])
+        self.assertEquals([result['username'] for result in results],['Tom','Harry'])
+        results = self.c.list(username__prefix='Di')
+        self.assertTrue('Dick' in [result['username'] for result in results])
+        self.assertRaises(ServiceException,self.c.list,email='tom@example.com')
+        self.assertRaises(ServiceException,self.c.list,order_by=['password'])
+    
+    def test_aggregates(self):
+        """
+        Tests counting and aggregating.
+        """
+        self.assertEquals(self.c.count(username__in=['Tom','Dick','Harry']),3)
+        result = self.c.aggregate(['min:id','max:id'],username__in=['Tom','Dick','Harry'])
+        self.assertEquals(result,{'id__min':self.tom.pk,'id__max':self.harry.pk})
+        groups = self.c.group_count('is_staff',username__in=['Tom','Dick','Harry'])
+        self.assertEquals(groups,[{'is_staff':False,'count':3}])
+        self.assertRaises(ServiceException,self.c.aggregate,['sum:password'])
+    
+    def test_expand(self):
+        """
+        Tests nesting expanded relations.
+        """
+        group = Group.objects.create(name='Heroes')
+        try:
+            self.tom.groups.add(group)
+            tom_dict = self.c.get(self.tom.pk,expand=['groups'])
+            self.assertEquals([g['name'] for g in tom_dict['groups']],['Heroes'])
+            self.assertRaises(ServiceException,self.c.get,self.tom.pk,expand=['password'])
+        finally:
+            group.delete()
+    
+    def test_update_missing(self):
+        """
+        Tests updating a model that does not exist.
+        """
+        try:
+            self.c.update(User.objects.order_by('-pk')[0].pk + 1000,first_name='Nobody')
+            self.fail('Expected a 404.')
+        except ServiceException as e:
+            self.assertEquals(e.status_code,404)
+        self.assertRaises(ServiceException,self.c.update,self.tom.pk,no_such_field='x')
+    
     def test_delete(self):
         """
         Tests the delete function.
@@ -149,3 +613,809 @@ class ModelResourceClientTests(unittest.TestCase):
 
 
 
+
+class ModelResourceSyncTests(unittest.TestCase):
+    """
+    Tests syncing a local copy of a model resource through its change feed.
+    """
+    def setUp(self):
+        self.c = ModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','articleresource')
+        self.resource = registry.get_descriptor('sharrock_modelresource_example','1.0','articleresource')
+        Article.objects.all().delete()
+        self.articles = [Article.objects.create(title='Article %d' % i) for i in range(5)]
+    
+    def tearDown(self):
+        Article.objects.all().delete()
+        Tombstone.objects.all().delete()
+    
+    def test_sync(self):
+        """
+        Tests that a sync gets the whole table, in pages, and later syncs only the changes.
+        """
+        models, cursor = self.c.sync(limit=2)
+        self.assertEquals(sorted(models.keys()),sorted(unicode(article.pk) for article in self.articles))
+        page = self.c.changes(since=cursor)
+        self.assertEquals((page['changed'],page['deleted'],page['more']),({},[],False))
+        self.assertEquals(self.resource._decode_cursor(page['cursor']),self.resource._decode_cursor(cursor))
+        
+        self.c.update(self.articles[0].pk,title='Updated')
+        self.c.delete(self.articles[1].pk)
+        new = Article.objects.create(title='New')
+        page = self.c.changes(since=cursor)
+        self.assertEquals(sorted(page['changed'].keys()),sorted([unicode(self.articles[0].pk),unicode(new.pk)]))
+        self.assertEquals(page['deleted'],[unicode(self.articles[1].pk)])
+        
+        models, cursor = self.c.sync(models,cursor)
+        self.assertEquals(dict((pk,model['title']) for pk, model in models.items()),
+                          dict((unicode(article.pk),article.title) for article in Article.objects.all()))
+        self.assertEquals(models[unicode(self.articles[0].pk)]['title'],'Updated')
+    
+    def test_async_sync(self):
+        """
+        Tests syncing through the concurrent client.
+        """
+        c = AsyncModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','articleresource')
+        models, cursor = c.sync(limit=2).get(10)
+        self.assertEquals(sorted(models.keys()),sorted(unicode(article.pk) for article in self.articles))
+        page = c.changes(since=cursor).get(10)
+        self.assertEquals((page['changed'],page['deleted'],page['more']),({},[],False))
+        
+        deleted_pk = unicode(self.articles[0].pk)
+        self.articles[0].delete()
+        models, cursor = c.sync(models,cursor).get(10)
+        self.assertFalse(deleted_pk in models)
+        self.assertEquals(len(models),4)
+    
+    def test_tombstone_retention(self):
+        """
+        Tests pruning old tombstones, and refusing the cursors that may not have seen them.
+        """
+        old_pk, new_pk = unicode(self.articles[0].pk), unicode(self.articles[1].pk)
+        self.articles[0].delete()
+        self.articles[1].delete()
+        Tombstone.objects.filter(object_id=old_pk).update(deleted=datetime.now() - timedelta(hours=2))
+        old_cursor = self.resource._encode_cursor(None,None,0,datetime.now() - timedelta(hours=2))
+        models, cursor = self.c.sync()
+        
+        def changes(since):
+            request = RequestFactory().get('/resources/sharrock_modelresource_example/1.0/articleresource/changes.json',{'since':since})
+            return execute_resource(request,'sharrock_modelresource_example','1.0','articleresource')
+        
+        self.assertRaises(CommandError,call_command,'sharrock_prune_tombstones')
+        self.assertEquals(changes(old_cursor).status_code,200) # cursors do not expire without a retention
+        with override_settings(SHARROCK_TOMBSTONE_RETENTION=3600):
+            self.assertRaises(CommandError,call_command,'sharrock_prune_tombstones',retention=60)
+            output = StringIO()
+            call_command('sharrock_prune_tombstones',stdout=output)
+            self.assertEquals(output.getvalue(),'Pruned 1 tombstones.\n')
+            self.assertEquals(list(Tombstone.objects.values_list('object_id',flat=True)),[new_pk])
+            self.assertEquals(changes(old_cursor).status_code,400)
+            self.assertEquals(changes(cursor).status_code,200)
+
+class ModelResourceImportTests(unittest.TestCase):
+    """
+    Tests bulk imports into a model resource.
+    """
+    def setUp(self):
+        self.c = ModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','articleresource')
+        Article.objects.all().delete()
+    
+    def tearDown(self):
+        with transaction.atomic(): # one commit for the tombstones of the deleted articles
+            Article.objects.all().delete()
+            Tombstone.objects.all().delete()
+    
+    def test_import_rows(self):
+        """
+        Tests importing a generator of rows over several requests, with errors reported by row.
+        """
+        def rows():
+            for i in range(2500):
+                if i == 1500:
+                    yield {'title':'x' * 300} # too long
+                elif i == 2100:
+                    yield {'headline':'Unknown field'}
+                else:
+                    yield {'title':'Imported %d' % i,'body':'Body'}
+        report = self.c.import_rows(rows(),rows_per_request=1000)
+        self.assertEquals((report['created'],report['failed']),(2498,2))
+        self.assertEquals([error['row'] for error in report['errors']],[1500,2100])
+        self.assertEquals(Article.objects.count(),2498)
+        self.assertEquals(Article.objects.filter(title='Imported 2499').count(),1)
+    
+    def test_failed_batch(self):
+        """
+        Tests that a batch failing in the database is written row by row, so only the
+        failing rows are lost, and that the body is read as a stream.
+        """
+        existing = Article.objects.create(title='Existing')
+        body = '\n'.join(json.dumps(row) for row in [{'title':'One'},{'id':existing.pk,'title':'Duplicate'},{'title':'Two'},'not json',{'title':'Three'}])
+        request = RequestFactory().post('/resources/sharrock_modelresource_example/1.0/articleresource/import.json',body,content_type='application/x-ndjson')
+        resource = registry.get_descriptor('sharrock_modelresource_example','1.0','articleresource')
+        batch_size = resource.import_batch_size
+        resource.import_batch_size = 3
+        try:
+            response = execute_resource(request,'sharrock_modelresource_example','1.0','articleresource')
+        finally:
+            resource.import_batch_size = batch_size
+        self.assertEquals(response.status_code,201)
+        report = json.loads(response.content)
+        self.assertEquals((report['created'],report['failed']),(3,2))
+        self.assertEquals([error['line'] for error in report['errors']],[2,4])
+        self.assertEquals(sorted(Article.objects.values_list('title',flat=True)),['Existing','One','Three','Two'])
+        self.assertFalse(hasattr(request,'_body')) # never buffered
+
+class ModelResourceQueryTests(unittest.TestCase):
+    """
+    Tests the queries run by model resources, in-process.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.users = [User.objects.create(username='querytest%d' % i) for i in range(5)]
+        self.group = Group.objects.create(name='Query Testers')
+        for user in self.users:
+            user.groups.add(self.group)
+    
+    def tearDown(self):
+        self.group.delete()
+        for user in self.users:
+            user.delete()
+    
+    def _get(self,resource,context,**params):
+        """
+        Gets the context of the resource, returning the decoded result and the number of queries run.
+        """
+        request = self.factory.get('/resources/sharrock_modelresource_example/1.0/%s/%s.json' % (resource,context),params)
+        with CaptureQueriesContext(connection) as queries:
+            response = execute_resource(request,'sharrock_modelresource_example','1.0',resource)
+        self.assertEquals(response.status_code,200)
+        return json.loads(response.content), len(queries)
+    
+    def test_expand_many_to_many(self):
+        """
+        Tests that expanding a many to many relation takes one extra query, however many users there are.
+        """
+        users, query_count = self._get('userresource','list',expand='groups')
+        self.assertEquals(query_count,2)
+        expanded = [user for user in users if user['username'].startswith('querytest')]
+        self.assertEquals(len(expanded),5)
+        self.assertTrue(all(user['groups'][0]['name'] == 'Query Testers' for user in expanded))
+    
+    def test_filter(self):
+        """
+        Tests that filters are applied in the query.
+        """
+        users, query_count = self._get('userresource','list',username__prefix='querytest',id__range='%d,%d' % (self.users[1].pk,self.users[3].pk),order_by='-id')
+        self.assertEquals(query_count,1)
+        self.assertEquals([user['username'] for user in users],['querytest3','querytest2','querytest1'])
+    
+    def test_aggregate(self):
+        """
+        Tests that aggregates are computed in one query.
+        """
+        result, query_count = self._get('userresource','aggregate',aggregate='min:id,max:id',username__prefix='querytest')
+        self.assertEquals(query_count,1)
+        self.assertEquals(result,{'id__min':self.users[0].pk,'id__max':self.users[-1].pk})
+    
+    def test_update(self):
+        """
+        Tests that an update is a single UPDATE statement.
+        """
+        request = self.factory.put('/resources/sharrock_modelresource_example/1.0/userresource/%d.json' % self.users[0].pk,
+                                   json.dumps({'first_name':'Updated'}),content_type='application/json')
+        with CaptureQueriesContext(connection) as queries:
+            response = execute_resource(request,'sharrock_modelresource_example','1.0','userresource')
+        self.assertEquals(response.status_code,200)
+        statements = [query['sql'] for query in queries.captured_queries if 'auth_user' in query['sql']]
+        self.assertEquals(len(statements),1) # no read before the update
+        self.assertTrue('UPDATE' in statements[0])
+        self.assertEquals(User.objects.get(pk=self.users[0].pk).first_name,'Updated')
+    
+    def test_get_many(self):
+        """
+        Tests that a multi-get runs one query per chunk of ids.
+        """
+        resource = registry.get_descriptor('sharrock_modelresource_example','1.0','userresource')
+        chunk_size = resource.multi_get_chunk_size
+        resource.multi_get_chunk_size = 2
+        try:
+            result, query_count = self._get('userresource','many',ids=','.join(unicode(user.pk) for user in self.users))
+        finally:
+            resource.multi_get_chunk_size = chunk_size
+        self.assertEquals(query_count,3)
+        self.assertEquals(sorted(result['models'].keys()),sorted(unicode(user.pk) for user in self.users))
+        self.assertEquals(result['missing'],[])
+    
+    def test_expand_foreign_key(self):
+        """
+        Tests that expanding a foreign key is done in the same query.
+        """
+        permissions, query_count = self._get('permissionresource','list',expand='content_type')
+        self.assertEquals(query_count,1)
+        self.assertTrue(all('app_label' in permission['content_type'] for permission in permissions))
+
+class UnversionedArticleResource(ModelResource):
+    """
+    ModelResource for an Article without a change feed, so its auto_now field is not
+    the change field.
+    """
+    model = Article
+
+class SavedArticleResource(UnversionedArticleResource):
+    """
+    UnversionedArticleResource saving models on updates.
+    """
+    save_on_update = True
+
+class ModelResourceUpdateTests(unittest.TestCase):
+    """
+    Tests model resource updates, in-process.
+    """
+    def setUp(self):
+        self.article = Article.objects.create(title='Update')
+    
+    def tearDown(self):
+        Article.objects.all().delete()
+        Tombstone.objects.all().delete()
+    
+    def _update(self,resource):
+        request = RequestFactory().put('/resources/sharrock_modelresource_example/1.0/article/%s.json' % self.article.pk,json.dumps({'title':'Updated'}),content_type='application/json')
+        status_code, headers, content = resource.http_service(request)
+        self.assertEquals(status_code,200)
+        return Article.objects.get(pk=self.article.pk)
+    
+    def test_auto_now(self):
+        """
+        Tests that updates set auto_now fields other than the change field, with and
+        without save_on_update.
+        """
+        for resource in (UnversionedArticleResource(),SavedArticleResource()):
+            Article.objects.filter(pk=self.article.pk).update(updated=datetime.now() - timedelta(days=1))
+            article = self._update(resource)
+            self.assertEquals(article.title,'Updated')
+            self.assertTrue(article.updated > datetime.now() - timedelta(minutes=1))
+
+class CachedUserResource(UserResource):
+    """
+    UserResource with cached reads.
+    """
+    cache_reads = True
+
+class ModelResourceCacheTests(unittest.TestCase):
+    """
+    Tests the model resource read cache, in-process.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.resource = CachedUserResource()
+        self.user = User.objects.create(username='cachetest')
+    
+    def tearDown(self):
+        User.objects.filter(username__startswith='cachetest').delete()
+    
+    def _get(self,context,**params):
+        """
+        Gets the context of the resource, returning the decoded result and the number of queries run.
+        """
+        request = self.factory.get('/resources/sharrock_modelresource_example/1.0/cacheduserresource/%s.json' % context,params)
+        with CaptureQueriesContext(connection) as queries:
+            status_code, headers, content = self.resource.http_service(request)
+        return json.loads(content), len(queries)
+    
+    def test_get(self):
+        """
+        Tests caching gets, and invalidating them when the model is saved.
+        """
+        self.assertEquals(self._get(self.user.pk)[1],1)
+        user, query_count = self._get(self.user.pk)
+        self.assertEquals((user['username'],query_count),('cachetest',0))
+        self.user.first_name = 'Cached'
+        self.user.save()
+        user, query_count = self._get(self.user.pk)
+        self.assertEquals((user['first_name'],query_count),('Cached',1))
+    
+    def test_list(self):
+        """
+        Tests caching lists, and invalidating them when a model is created.
+        """
+        self.assertEquals(self._get('list',username__prefix='cachetest')[1],1)
+        users, query_count = self._get('list',username__prefix='cachetest')
+        self.assertEquals((len(users),query_count),(1,0))
+        User.objects.create(username='cachetest2')
+        users, query_count = self._get('list',username__prefix='cachetest')
+        self.assertEquals((len(users),query_count),(2,1))
+
+class CountUsers(Descriptor):
+    """
+    Counts the users with a username, reading from the read database.
+    """
+    read_replica = True
+
+    def execute(self,request,data,params):
+        return {'count':User.objects.filter(username=request.GET['username']).count()}
+
+@unittest.skipUnless('replica' in settings.DATABASES,'No replica database configured.')
+class ReadReplicaTests(unittest.TestCase):
+    """
+    Tests routing reads to a read database, in-process.  Needs a second database aliased
+    'replica', and ReadReplicaRouter in DATABASE_ROUTERS.  The replica is not replicated
+    to, so models created in the default database are missing from it.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.path = '/resources/sharrock_modelresource_example/1.0/userresource/%s.json'
+    
+    def tearDown(self):
+        User.objects.filter(username__startswith='replicatest').delete()
+    
+    def _list(self,**cookies):
+        request = self.factory.get(self.path % 'list',{'username__prefix':'replicatest'})
+        request.COOKIES.update(cookies)
+        response = execute_resource(request,'sharrock_modelresource_example','1.0','userresource')
+        self.assertEquals(response.status_code,200)
+        return [user['username'] for user in json.loads(response.content or '[]')] # empty lists serialize to nothing
+    
+    def test_model_resource(self):
+        """
+        Tests that model resource reads go to the replica, and writes and the reads of
+        clients that just wrote to the primary.
+        """
+        with override_settings(SHARROCK_READ_DATABASE='replica'):
+            request = self.factory.post(self.path % 'create',json.dumps({'username':'replicatest'}),content_type='application/json')
+            response = execute_resource(request,'sharrock_modelresource_example','1.0','userresource')
+            self.assertEquals(response.status_code,201)
+            self.assertTrue(User.objects.filter(username='replicatest').exists())
+            self.assertFalse(User.objects.using('replica').filter(username='replicatest').exists())
+            
+            pin = response.cookies[PIN_COOKIE].value
+            self.assertEquals(self._list(**{PIN_COOKIE:pin}),['replicatest'])
+            self.assertEquals(self._list(),[])
+            self.assertEquals(self._list(**{PIN_COOKIE:'0'}),[]) # window passed
+        self.assertEquals(self._list(),['replicatest'])
+    
+    def test_resource_read_database(self):
+        """
+        Tests that writes to a resource naming its own read database pin the client to
+        the primary.
+        """
+        resource = registry.get_descriptor('sharrock_modelresource_example','1.0','userresource')
+        resource.read_database = 'replica'
+        try:
+            request = self.factory.post(self.path % 'create',json.dumps({'username':'replicatest'}),content_type='application/json')
+            response = execute_resource(request,'sharrock_modelresource_example','1.0','userresource')
+            self.assertEquals(response.status_code,201)
+            self.assertTrue(PIN_COOKIE in response.cookies)
+            self.assertEquals(self._list(**{PIN_COOKIE:response.cookies[PIN_COOKIE].value}),['replicatest'])
+            self.assertEquals(self._list(),[])
+        finally:
+            resource.read_database = None
+    
+    def test_descriptor(self):
+        """
+        Tests that a descriptor marked read_replica reads from the replica.
+        """
+        User.objects.create(username='replicatest')
+        request = self.factory.get('/api/test/1.0/count-users.json',{'username':'replicatest'})
+        self.assertEquals(json.loads(CountUsers().http_service(request)),{'count':1})
+        with override_settings(SHARROCK_READ_DATABASE='replica'):
+            self.assertEquals(json.loads(CountUsers().http_service(request)),{'count':0})
+            self.assertEquals(User.objects.filter(username='replicatest').count(),1) # outside the descriptor
+
+class ListUsers(Descriptor):
+    """
+    Lists the users with a username prefix.
+    """
+    def execute(self,request,data,params):
+        return [{'username':user.username,'staff':'yes' if user.is_staff else 'no'}
+                for user in User.objects.filter(username__startswith=request.GET['prefix']).order_by('id')]
+
+class ColumnarTests(unittest.TestCase):
+    """
+    Tests the columnar encoding of list results, in-process.
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.users = [User.objects.create(username='columnartest%d' % i,is_staff=i % 3 == 0) for i in range(10)]
+    
+    def tearDown(self):
+        User.objects.filter(username__startswith='columnartest').delete()
+    
+    def _get(self,**headers):
+        request = self.factory.get('/api/test/1.0/list-users.json',{'prefix':'columnartest'},**headers)
+        return ListUsers().http_service(request)
+    
+    def test_negotiation(self):
+        """
+        Tests that lists are only encoded for clients that accept it.
+        """
+        plain = self._get()
+        self.assertFalse(isinstance(plain,columnar.ColumnarJSON))
+        encoded = self._get(HTTP_ACCEPT='%s, application/json' % columnar.COLUMNAR_CONTENT_TYPE)
+        self.assertTrue(isinstance(encoded,columnar.ColumnarJSON))
+        self.assertTrue(len(encoded) < len(plain))
+        self.assertEquals([row.as_dict() for row in columnar.decode(json.loads(encoded))],json.loads(plain))
+    
+    def test_dictionary_encoding(self):
+        """
+        Tests that low cardinality string columns are dictionary encoded.
+        """
+        encoded = columnar.encode(json.loads(self._get()))
+        self.assertEquals(encoded['dictionaries'],{'staff':['yes','no']})
+        self.assertEquals(encoded['values'][encoded['columns'].index('staff')],[0,1,1,0,1,1,0,1,1,0])
+        rows = columnar.decode(encoded)
+        self.assertEquals((len(rows),rows[3]['staff'],rows[-1]['username']),(10,'yes','columnartest9'))
+    
+    def test_not_uniform(self):
+        """
+        Tests that results that are not uniform lists of dictionaries are not encoded.
+        """
+        self.assertEquals(columnar.encode([{'a':1},{'b':2}]),None)
+        self.assertEquals(columnar.encode([{'a':1},{'a':1,'b':2}]),None)
+        self.assertEquals(columnar.encode({'a':[1]}),None)
+        self.assertEquals(columnar.encode([]),None)
+
+class StreamingTests(unittest.TestCase):
+    """
+    Tests streaming the results of generator descriptors, in-process.
+    """
+    def _get(self,**headers):
+        request = RequestFactory().get('/api/sharrock_example/1.0/count.json',{'to':1000},**headers)
+        return execute_service(request,'sharrock_example','1.0','count')
+    
+    def test_json_array(self):
+        """
+        Tests streaming a JSON array in chunks.
+        """
+        with override_settings(SHARROCK_STREAM_CHUNK_SIZE=1024):
+            response = self._get()
+            self.assertTrue(response.streaming)
+            self.assertEquals(response['Content-Type'],'application/json')
+            chunks = list(response.streaming_content)
+        self.assertTrue(len(chunks) > 10)
+        self.assertEquals(json.loads(''.join(chunks)),[{'number':number} for number in range(1,1001)])
+    
+    def test_ndjson(self):
+        """
+        Tests streaming NDJSON to clients that accept it.
+        """
+        response = self._get(HTTP_ACCEPT='application/x-ndjson, application/json')
+        self.assertEquals(response['Content-Type'],'application/x-ndjson')
+        lines = ''.join(response.streaming_content).splitlines()
+        self.assertEquals([json.loads(line)['number'] for line in lines],range(1,1001))
+
+class ExportFile(Descriptor):
+    """
+    Returns the file at the path given, or its content as a buffer.
+    """
+    def execute(self,request,data,params):
+        if request.GET.get('buffer'):
+            return memoryview(bytearray(open(request.GET['path'],'rb').read()))
+        return FileResult(request.GET['path'],filename='export.csv')
+
+class FileResponseTests(unittest.TestCase):
+    """
+    Tests serving file results, in-process.
+    """
+    expected = ''.join('%d,%d\n' % (number,number * number) for number in range(1,1001))
+    
+    def _get(self,**headers):
+        request = RequestFactory().get('/api/sharrock_example/1.0/export.json',{'rows':1000},**headers)
+        response = execute_service(request,'sharrock_example','1.0','export')
+        return response, ''.join(response.streaming_content) if response.streaming else response.content
+    
+    def test_full(self):
+        """
+        Tests serving a whole file, unserialized.
+        """
+        response, content = self._get()
+        self.assertEquals(response.status_code,200)
+        self.assertEquals(response['Content-Type'],'text/csv')
+        self.assertEquals(response['Content-Length'],str(len(self.expected)))
+        self.assertEquals(response['Accept-Ranges'],'bytes')
+        self.assertEquals(response['Content-Disposition'],'attachment; filename="numbers.csv"')
+        self.assertEquals(content,self.expected)
+    
+    def test_ranges(self):
+        """
+        Tests serving byte ranges of a file.
+        """
+        size = len(self.expected)
+        response, content = self._get(HTTP_RANGE='bytes=100-199')
+        self.assertEquals((response.status_code,response['Content-Range'],content),(206,'bytes 100-199/%d' % size,self.expected[100:200]))
+        response, content = self._get(HTTP_RANGE='bytes=%d-' % (size - 10))
+        self.assertEquals((response.status_code,content),(206,self.expected[-10:]))
+        response, content = self._get(HTTP_RANGE='bytes=-5')
+        self.assertEquals((response.status_code,content),(206,self.expected[-5:]))
+        response, content = self._get(HTTP_RANGE='bytes=%d-' % size)
+        self.assertEquals((response.status_code,response['Content-Range']),(416,'bytes */%d' % size))
+        response, content = self._get(HTTP_RANGE='bytes=0-1,5-6') # multiple ranges are served whole
+        self.assertEquals((response.status_code,content),(200,self.expected))
+    
+    def test_buffer_and_sendfile(self):
+        """
+        Tests serving a buffer, and handing a file on disk to the front end server.
+        """
+        f = tempfile.NamedTemporaryFile(suffix='.csv')
+        f.write(self.expected)
+        f.flush()
+        try:
+            request = RequestFactory().get('/api/test/1.0/export-file.json',{'path':f.name,'buffer':'1'},HTTP_RANGE='bytes=0-9')
+            response = make_response(request,ExportFile().http_service(request),'application/json')
+            self.assertEquals((response.status_code,''.join(response.streaming_content)),(206,self.expected[:10]))
+            
+            request = RequestFactory().get('/api/test/1.0/export-file.json',{'path':f.name})
+            directory = os.path.dirname(f.name) + '/'
+            with override_settings(SHARROCK_SENDFILE_HEADER='X-Accel-Redirect',SHARROCK_SENDFILE_MAP={directory:'/protected/'}):
+                response = make_response(request,ExportFile().http_service(request),'application/json')
+            self.assertEquals(response['X-Accel-Redirect'],'/protected/' + os.path.basename(f.name))
+            self.assertEquals(response['Content-Type'],'text/csv')
+            self.assertEquals(response.content,'')
+        finally:
+            f.close()
+
+class UploadTests(unittest.TestCase):
+    """
+    Tests file and stream params with raw request bodies, in-process.
+    """
+    content = ''.join('line %d\n' % i for i in range(10000))
+    
+    def _post(self,service_name,body,**extra):
+        request = RequestFactory().post('/api/sharrock_example/1.0/%s.json?label=raw' % service_name,body,content_type='text/plain',**extra)
+        response = execute_service(request,'sharrock_example','1.0',service_name)
+        return response.status_code, json.loads(response.content) if response.status_code == 200 else response.content
+    
+    def test_raw_body(self):
+        """
+        Tests reading an upload from a raw body, named by its Content-Disposition.
+        """
+        status, result = self._post('checksum',self.content,HTTP_CONTENT_DISPOSITION='attachment; filename="lines.txt"')
+        self.assertEquals(status,200)
+        self.assertEquals(result,{'name':'lines.txt','size':len(self.content),'md5':hashlib.md5(self.content).hexdigest(),'label':'raw'})
+        self.assertEquals(self._post('linecount',self.content),(200,{'lines':10000}))
+    
+    def test_gzipped_body(self):
+        """
+        Tests streaming a gzipped raw body.
+        """
+        buf = StringIO()
+        with gzip.GzipFile(fileobj=buf,mode='wb') as f:
+            f.write(self.content)
+        self.assertEquals(self._post('linecount',buf.getvalue(),HTTP_CONTENT_ENCODING='gzip'),(200,{'lines':10000}))
+    
+    def test_missing(self):
+        """
+        Tests that a required upload must be sent.
+        """
+        self.assertEquals(self._post('checksum','')[0],400)
+
+class TrafficTests(unittest.TestCase):
+    """
+    Tests recording traffic and replaying it in-process.
+    """
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.log')
+        self.recorder = traffic.recorder
+        traffic.recorder = traffic.TrafficRecorder(self.path)
+        self.view = traffic.record_traffic(traffic.FUNCTION)(getattr(execute_service,'undecorated',execute_service))
+    
+    def tearDown(self):
+        traffic.recorder = self.recorder
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def test_record_and_replay(self):
+        """
+        Tests that recorded calls replay with the same responses.
+        """
+        request = RequestFactory().get('/api/sharrock_example/1.0/helloworld.json',{'name':'Loren'})
+        response = self.view(request,'sharrock_example','1.0','helloworld')
+        self.assertEquals(response.status_code,200)
+        request = RequestFactory().get('/api/sharrock_example/1.0/parameterizedservice.json',{'bar':1})
+        self.assertEquals(self.view(request,'sharrock_example','1.0','parameterizedservice').status_code,400) # missing foo
+        
+        records = list(traffic.read_traffic(self.path))
+        self.assertEquals([(record['n'],record['q'],record['s']) for record in records],
+                          [('helloworld','name=Loren',200),('parameterizedservice','bar=1',400)])
+        self.assertEquals(records[0]['h'],traffic.content_hash(response.content))
+        
+        report = traffic.replay(records,traffic.InProcessTarget(),speed=0)
+        self.assertEquals(report.differences,[])
+        self.assertEquals(sorted(report.replayed),['sharrock_example/1.0/helloworld','sharrock_example/1.0/parameterizedservice'])
+    
+    def test_record_failure(self):
+        """
+        Tests that calls whose view raised are recorded, with their status, and replay.
+        """
+        request = RequestFactory().get('/api/sharrock_example/1.0/no-such-service.json')
+        self.assertRaises(KeyError,self.view,request,'sharrock_example','1.0','no-such-service')
+        record, = traffic.read_traffic(self.path)
+        self.assertEquals((record['s'],record['r'].split(':')[0]),(500,'KeyError'))
+        self.assertFalse('h' in record)
+        
+        report = traffic.replay([record],traffic.InProcessTarget(),speed=0)
+        self.assertEquals(report.differences,[])
+        
+        record['s'] = 200 # a changed status is reported
+        self.assertEquals(len(traffic.replay([record],traffic.InProcessTarget(),speed=0).differences),1)
+
+class PinResponse(object):
+    """
+    A response setting cookies, for PinningTransport tests.
+    """
+    def __init__(self,cookies):
+        self.cookies = cookies
+
+class RecordingTransport(object):
+    """
+    Transport that records the headers it is sent and answers with the next Set-Cookie
+    header, parsed into a cookie jar as requests does.
+    """
+    def __init__(self):
+        self.headers = []
+        self.set_cookie = None
+    
+    def request(self,method,url,**kwargs):
+        import httplib
+        import requests
+        from requests.cookies import RequestsCookieJar, MockRequest, MockResponse
+        self.headers.append(kwargs.get('headers') or {})
+        set_cookie, self.set_cookie = self.set_cookie, None
+        jar = RequestsCookieJar()
+        if set_cookie:
+            message = httplib.HTTPMessage(StringIO('Set-Cookie: %s\r\n\r\n' % set_cookie))
+            jar.extract_cookies(MockResponse(message),MockRequest(requests.Request(method,url).prepare()))
+        return PinResponse(jar)
+
+class ClientCookieTests(unittest.TestCase):
+    """
+    Tests that clients sharing a transport do not share cookies.
+    """
+    def test_transport_keeps_no_cookies(self):
+        """
+        Tests that the shared session rejects cookies.
+        """
+        import requests
+        from requests.cookies import create_cookie, MockRequest
+        jar = HttpTransport().session.cookies
+        jar.set_cookie_if_ok(create_cookie('sessionid','x',domain='localhost.local'),MockRequest(requests.Request('GET','http://localhost:8000/api').prepare()))
+        self.assertEquals(len(jar),0)
+    
+    def test_pin_per_client(self):
+        """
+        Tests that only the client that wrote is pinned to the primary, until the pin expires.
+        """
+        shared = RecordingTransport()
+        writer, reader = PinningTransport(shared), PinningTransport(shared)
+        shared.set_cookie = '%s=%.3f; Max-Age=60; Path=/' % (PIN_COOKIE,time.time() - 3600) # the server's clock is an hour behind
+        writer.request('POST','http://localhost:8000/resources/x',headers={'Accept':'application/json'})
+        writer.request('GET','http://localhost:8000/resources/x',headers={'Accept':'application/json'})
+        reader.request('GET','http://localhost:8000/resources/x')
+        self.assertEquals(shared.headers[1],{'Accept':'application/json','Cookie':'%s=%s' % (PIN_COOKIE,writer.pin)})
+        self.assertFalse('Cookie' in shared.headers[2])
+        
+        self.assertTrue(time.time() + 55 < writer.pin_expires <= time.time() + 60)
+        writer.pin_expires = time.time() - 1
+        writer.request('GET','http://localhost:8000/resources/x')
+        self.assertFalse('Cookie' in shared.headers[3])
+        
+        clients = [ModelResourceClient('http://localhost:8000/resources','sharrock_modelresource_example','1.0','userresource') for i in range(2)]
+        self.assertTrue(all(isinstance(client._transport,PinningTransport) for client in clients))
+        self.assertFalse(clients[0]._transport is clients[1]._transport)
+
+class ResponseCacheTests(unittest.TestCase):
+    """
+    Tests the response cache's disk store.
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+    
+    def _entry(self,content,expires,headers=None):
+        return CacheEntry('http://localhost:8000/api/x',200,content,headers or {'Content-Type':'application/json'},expires)
+    
+    def test_disk_round_trip(self):
+        """
+        Tests that entries are stored as JSON and read back by other caches.
+        """
+        ResponseCache(cache_dir=self.cache_dir).set('a',self._entry('\x00\xffbinary',time.time() + 60,{'ETag':'"1"'}))
+        name, = os.listdir(self.cache_dir)
+        self.assertEquals(json.load(open(os.path.join(self.cache_dir,name)))['headers'],{'ETag':'"1"'})
+        entry = ResponseCache(cache_dir=self.cache_dir).get('a')
+        self.assertEquals((entry.content,entry.headers,entry.status_code),('\x00\xffbinary',{'ETag':'"1"'},200))
+        
+        with open(os.path.join(self.cache_dir,'b.json'),'w') as f:
+            f.write('not an entry')
+        self.assertEquals(ResponseCache(cache_dir=self.cache_dir).get('b'),None)
+    
+    def test_disk_bound(self):
+        """
+        Tests that the least recently used files are removed to keep the disk store bounded.
+        """
+        cache = ResponseCache(max_size=1000,cache_dir=self.cache_dir,max_disk_size=5000)
+        for i in range(20):
+            cache.set('key%d' % i,self._entry('x' * 500,time.time() + 60))
+        files = os.listdir(self.cache_dir)
+        self.assertTrue(sum(os.path.getsize(os.path.join(self.cache_dir,name)) for name in files) <= 5000)
+        self.assertTrue('key19.json' in files)
+        self.assertFalse('key0.json' in files)
+    
+    def test_expired_dropped(self):
+        """
+        Tests that expired entries without validators are dropped, and others kept for
+        revalidation.
+        """
+        cache = ResponseCache(cache_dir=self.cache_dir)
+        cache.set('stale',self._entry('a',time.time() - 1))
+        cache.set('revalidate',self._entry('b',time.time() - 1,{'ETag':'"1"'}))
+        self.assertEquals(cache.get('stale'),None)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir,'stale.json')))
+        self.assertEquals(cache.get('revalidate').content,'b')
+
+class EchoData(Descriptor):
+    """
+    Echoes the posted data slowly, sharing executions.
+    """
+    single_flight = True
+    executions = itertools.count(1)
+
+    def execute(self,request,data,params):
+        time.sleep(0.2)
+        return {'data':data,'user':getattr(getattr(request,'user',None),'pk',None),'execution':next(self.executions)}
+
+class ServerSingleFlightTests(unittest.TestCase):
+    """
+    Tests which concurrent executions of a single flight descriptor are shared, in-process.
+    """
+    def _run(self,*requests):
+        results = gather_calls([lambda request=request: json.loads(EchoData().http_service(request)) for request in requests])
+        return [result['execution'] for result in results], results
+    
+    def _post(self,data,user=None):
+        request = RequestFactory().post('/api/test/1.0/echodata.json',json.dumps(data),content_type='application/json')
+        if user is not None:
+            request.user = user
+        return request
+    
+    def test_same_body_shared(self):
+        """
+        Tests that identical requests share an execution.
+        """
+        executions, results = self._run(self._post({'a':1}),self._post({'a':1}))
+        self.assertEquals(len(set(executions)),1)
+    
+    def test_different_bodies(self):
+        """
+        Tests that requests with different bodies, and the same params, do not share.
+        """
+        executions, results = self._run(self._post({'a':1}),self._post({'a':2}))
+        self.assertEquals(len(set(executions)),2)
+        self.assertEquals(sorted(result['data']['a'] for result in results),[1,2])
+    
+    def test_different_users(self):
+        """
+        Tests that requests from different users, or with different credentials, do not share.
+        """
+        executions, results = self._run(self._post({'a':1},User(pk=1)),self._post({'a':1},User(pk=2)))
+        self.assertEquals(len(set(executions)),2)
+        requests = [self._post({'a':1}) for i in range(2)]
+        requests[1].META['HTTP_AUTHORIZATION'] = 'Basic %s' % base64.b64encode('loren:secret')
+        executions, results = self._run(*requests)
+        self.assertEquals(len(set(executions)),2)
+    
+    def test_expired_cache_lock(self):
+        """
+        Tests that a caller whose cache lock expired while it ran does not release the
+        lock another caller has since taken.
+        """
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        lock_key = 'sharrock-flight-lock-expiry'
+        def slow():
+            cache.set(lock_key,'other',30) # the lock expired and another caller took it
+            return 'done'
+        self.assertEquals(cache_flight(cache,'expiry',slow),'done')
+        self.assertEquals(cache.get(lock_key),'other')
+        cache.delete(lock_key)
+        self.assertEquals(cache_flight(cache,'expiry',lambda: 'again'),'again')
+        self.assertEquals(cache.get(lock_key),None)
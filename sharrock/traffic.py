@@ -0,0 +1,298 @@
+"""
+Traffic recording and replay for Sharrock.
+
+When the SHARROCK_TRAFFIC_LOG setting is defined, calls to the function and
+resource views are sampled (see SHARROCK_TRAFFIC_SAMPLE_RATE) and appended, one
+JSON record per line, to the log.  The log can later be replayed against a new
+build, either in-process or against a running server, to compare latency
+distributions and to flag responses that differ from the recorded ones.  Calls
+whose view raised are recorded too, with the status the server answers them with
+and the exception.
+"""
+from django.conf import settings
+from django.http import Http404
+from sharrock.benchmark import BenchmarkResult
+import base64
+import hashlib
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger('sharrock')
+
+# record kinds
+FUNCTION = 'f'
+RESOURCE = 'r'
+
+def content_hash(content):
+    """
+    Hashes response content for comparison between recording and replay.
+    """
+    return hashlib.md5(content).hexdigest()
+
+def error_status(error):
+    """
+    The status the server responds with when a view raises error.
+    """
+    return 404 if isinstance(error,Http404) else 500
+
+def encode_body(body):
+    """
+    Encodes a request body for the log.  Returns a (body, encoding) tuple.
+    """
+    try:
+        return body.decode('utf-8'), None
+    except UnicodeDecodeError:
+        return base64.b64encode(body), 'b64'
+
+def decode_body(record):
+    """
+    Decodes the request body from a log record.
+    """
+    body = record.get('b') or ''
+    if record.get('e') == 'b64':
+        return base64.b64decode(body)
+    return body.encode('utf-8')
+
+class TrafficRecorder(object):
+    """
+    Appends sampled request records to a traffic log.  Each record is written with
+    a single append so that several processes can share a log.
+    """
+    def __init__(self,path,sample_rate=1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._fd = None
+
+    def sampled(self):
+        """
+        Decides whether the current request should be recorded.
+        """
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def _write(self,line):
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path,os.O_WRONLY | os.O_APPEND | os.O_CREAT,0644)
+            os.write(self._fd,line)
+
+    def record(self,kind,request,app,version,name,extension,model_id,response,latency,error=None):
+        """
+        Records a single request and its response.  If the view raised error instead of
+        responding, response is None and the call is recorded with the error's status.
+        """
+        try:
+            body, encoding = encode_body(request.body)
+        except Exception:
+            body, encoding = None, None # the body was streamed by the descriptor and is gone
+        record = {'t':round(time.time(),6),
+                  'k':kind,
+                  'a':app,
+                  'v':version,
+                  'n':name,
+                  'x':extension,
+                  'm':request.method,
+                  'p':request.path,
+                  'q':request.META.get('QUERY_STRING',''),
+                  's':response.status_code if response is not None else error_status(error),
+                  'l':round(latency * 1000.0,3)}
+        if model_id:
+            record['i'] = model_id
+        if body:
+            record['b'] = body
+            if encoding:
+                record['e'] = encoding
+        content_type = request.META.get('CONTENT_TYPE')
+        if content_type:
+            record['c'] = content_type
+        if error is not None:
+            record['r'] = '%s: %s' % (error.__class__.__name__,error)
+        elif not getattr(response,'streaming',False):
+            record['z'] = len(response.content)
+            record['h'] = content_hash(response.content)
+        try:
+            self._write(json.dumps(record,separators=(',',':')) + '\n')
+        except (IOError,OSError):
+            log.exception('Failed to write traffic record to %s.' % self.path)
+
+recorder = None
+if getattr(settings,'SHARROCK_TRAFFIC_LOG',None):
+    recorder = TrafficRecorder(settings.SHARROCK_TRAFFIC_LOG,sample_rate=getattr(settings,'SHARROCK_TRAFFIC_SAMPLE_RATE',1.0))
+
+def record_traffic(kind):
+    """
+    Decorator for the function and resource views that records sampled traffic to
+    the traffic log.  When no log is configured the view is returned undecorated.
+    """
+    def decorator(view):
+        if recorder is None:
+            return view
+
+        def wrapper(request,*args,**kwargs):
+            if not recorder.sampled():
+                return view(request,*args,**kwargs)
+            def record(response,error=None):
+                call_args = inspect.getcallargs(view,request,*args,**kwargs)
+                recorder.record(kind,
+                                request,
+                                call_args['app'],
+                                call_args['version'],
+                                call_args.get('service_name') or call_args.get('resource_name'),
+                                call_args['extension'],
+                                call_args.get('model_id'),
+                                response,
+                                time.time() - start,
+                                error=error)
+            start = time.time()
+            try:
+                response = view(request,*args,**kwargs)
+            except Exception as e:
+                record(None,error=e) # failures are the calls most worth replaying
+                raise
+            record(response)
+            return response
+
+        wrapper.__name__ = view.__name__
+        wrapper.__doc__ = view.__doc__
+        wrapper.undecorated = view
+        return wrapper
+    return decorator
+
+##############
+### Replay ###
+##############
+
+def read_traffic(path,limit=None):
+    """
+    Reads records from a traffic log.
+    """
+    with open(path) as traffic_log:
+        for count, line in enumerate(traffic_log):
+            if limit is not None and count >= limit:
+                break
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+class InProcessTarget(object):
+    """
+    Replays records by calling the Sharrock views directly.
+    """
+    def __init__(self):
+        from django.test.client import RequestFactory
+        self.factory = RequestFactory()
+
+    def __call__(self,record):
+        """
+        Replays the record.  Returns a (status code, content) tuple, with content of
+        None for streamed responses.  An exception raised by the view is returned with the
+        status the server would respond with.
+        """
+        from sharrock import views
+        path = record['p']
+        if record.get('q'):
+            path = '%s?%s' % (path,record['q'])
+        request = self.factory.generic(record['m'],path,decode_body(record),content_type=record.get('c','application/octet-stream'))
+
+        # call the undecorated views, so the replay is not itself recorded
+        try:
+            if record['k'] == RESOURCE:
+                response = getattr(views.execute_resource,'undecorated',views.execute_resource)(request,record['a'],record['v'],record['n'],extension=record['x'],model_id=record.get('i'))
+            else:
+                response = getattr(views.execute_service,'undecorated',views.execute_service)(request,record['a'],record['v'],record['n'],extension=record['x'])
+        except Exception as e:
+            return error_status(e), None
+
+        if getattr(response,'streaming',False):
+            return response.status_code, None
+        return response.status_code, response.content
+
+class HttpTarget(object):
+    """
+    Replays records against a running server.  The recorded request path is
+    appended to the server url.
+    """
+    def __init__(self,server_url,auth_user='',auth_password=''):
+        import requests
+        self.server_url = server_url.rstrip('/')
+        self.session = requests.Session()
+        if auth_user or auth_password:
+            self.session.auth = (auth_user,auth_password)
+
+    def __call__(self,record):
+        url = '%s%s' % (self.server_url,record['p'])
+        if record.get('q'):
+            url = '%s?%s' % (url,record['q'])
+        headers = {}
+        if record.get('c'):
+            headers['Content-Type'] = record['c']
+        response = self.session.request(record['m'],url,data=decode_body(record) or None,headers=headers)
+        return response.status_code, response.content
+
+class ReplayReport(object):
+    """
+    The outcome of a replay: recorded and replayed latencies per descriptor and the
+    list of responses that differ from their recording.
+    """
+    def __init__(self):
+        self.recorded = {}
+        self.replayed = {}
+        self.differences = []
+
+    def add(self,record,status_code,content,latency):
+        """
+        Adds the outcome of a replayed record.
+        """
+        key = '%s/%s/%s' % (record['a'],record['v'],record['n'])
+        self.recorded.setdefault(key,[]).append(record['l'] / 1000.0)
+        self.replayed.setdefault(key,[]).append(latency)
+
+        if status_code != record['s']:
+            self.differences.append((key,record,'status %s, recorded %s' % (status_code,record['s'])))
+        elif content is not None and 'h' in record and content_hash(content) != record['h']:
+            self.differences.append((key,record,'%d bytes, recorded %d bytes' % (len(content),record['z'])))
+
+    def write(self,stream=sys.stdout):
+        """
+        Writes the latency comparison and response differences to the stream.
+        """
+        stream.write('%-50s %7s %18s %18s %18s\n' % ('descriptor','calls','p50 ms (rec/new)','p90 ms (rec/new)','p99 ms (rec/new)'))
+        for key in sorted(self.recorded):
+            recorded = BenchmarkResult(key,self.recorded[key])
+            replayed = BenchmarkResult(key,self.replayed[key])
+            stream.write('%-50s %7d %18s %18s %18s\n' % (key,
+                                                          recorded.count,
+                                                          '%.2f/%.2f' % (recorded.percentile(50),replayed.percentile(50)),
+                                                          '%.2f/%.2f' % (recorded.percentile(90),replayed.percentile(90)),
+                                                          '%.2f/%.2f' % (recorded.percentile(99),replayed.percentile(99))))
+        stream.write('\n%d responses differ from the recording.\n' % len(self.differences))
+        for key, record, difference in self.differences:
+            stream.write('  %s %s %s?%s: %s\n' % (key,record['m'],record['p'],record.get('q',''),difference))
+
+def replay(records,target,speed=1.0):
+    """
+    Replays the records against the target.  The original spacing between requests
+    is kept, divided by speed; a speed of 0 or None replays as fast as possible.
+    Returns a ReplayReport.
+    """
+    report = ReplayReport()
+    first_recorded = None
+    started = None
+    for record in records:
+        if speed:
+            if first_recorded is None:
+                first_recorded, started = record['t'], time.time()
+            delay = (record['t'] - first_recorded) / speed - (time.time() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+        start = time.time()
+        status_code, content = target(record)
+        report.add(record,status_code,content,time.time() - start)
+    return report
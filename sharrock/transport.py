@@ -0,0 +1,72 @@
+"""
+HTTP transport for the Sharrock clients.  Requests are sent over a pooled
+requests.Session, so that connections (and TLS sessions) are kept alive and
+reused between calls.  Transports are safe to share between threads.
+
+As a transport is shared by clients with different credentials, and servers, its
+session keeps no cookies: a cookie set for one client would be sent with every
+other client's requests.  Clients keep the state they need themselves (see
+sharrock.replicas.PinningTransport).
+"""
+from cookielib import DefaultCookiePolicy
+import base64
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+class HttpTransport(object):
+    """
+    Sends requests over a pooled session.  pool_connections is the number of hosts
+    to keep pools for, pool_maxsize the number of connections kept alive per host.
+    When pool_block is True, callers wait for a free connection rather than opening
+    connections beyond pool_maxsize.
+    """
+    def __init__(self,pool_connections=10,pool_maxsize=10,pool_block=False,timeout=None):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[])) # no cookies are kept or sent
+        adapter = HTTPAdapter(pool_connections=pool_connections,pool_maxsize=pool_maxsize,pool_block=pool_block)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+
+    def request(self,method,url,**kwargs):
+        """
+        Sends the request, returning the requests response.
+        """
+        if self.timeout is not None:
+            kwargs.setdefault('timeout',self.timeout)
+        return self.session.request(method,url,**kwargs)
+
+    def close(self):
+        """
+        Closes the pooled connections.
+        """
+        self.session.close()
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+def default_transport():
+    """
+    Gets the transport shared by clients that have not been given their own.
+    """
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = HttpTransport()
+    return _default_transport
+
+def set_default_transport(transport):
+    """
+    Replaces the shared transport, for example to change its pool size.
+    """
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
+
+def auth_headers(auth_user,auth_password):
+    """
+    Builds the basic auth header once, so it is not re-encoded for every request.
+    """
+    return {'Authorization':'Basic %s' % base64.b64encode(('%s:%s' % (auth_user,auth_password)).encode('latin1'))}
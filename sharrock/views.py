@@ -2,10 +2,17 @@
 View functions for Sharrock.
 """
 from sharrock import registry
-from sharrock.descriptors import ParamRequired, MethodNotAllowed, AccessDenied, Conflict, FailedToLocate
+from sharrock.traffic import record_traffic, FUNCTION, RESOURCE
+from sharrock.replicas import pin_to_primary
+from sharrock.columnar import ColumnarJSON, COLUMNAR_CONTENT_TYPE
+from sharrock.streaming import StreamedResult
+from sharrock.files import FileResult, file_response
+from sharrock.descriptors import ParamRequired, MethodNotAllowed, AccessDenied, Conflict, FailedToLocate, BadRequest
 from django.shortcuts import render_to_response
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from django.conf import settings
+import hashlib
 import logging
 
 log = logging.getLogger('sharrock')
@@ -30,6 +37,44 @@ def get_response_mimetype(extension):
     """
     return mtype_map[extension]
 
+def with_columnar(serialized_result,response):
+    """
+    Marks the response as columnar if the result was serialized that way.
+    """
+    if isinstance(serialized_result,ColumnarJSON):
+        response['Content-Type'] = COLUMNAR_CONTENT_TYPE
+        patch_vary_headers(response,('Accept',))
+    return response
+
+def make_response(request,serialized_result,content_type,status=200):
+    """
+    Builds the response for a serialized result, streaming it if it is a StreamedResult
+    and serving it as a file if it is a FileResult.
+    """
+    if isinstance(serialized_result,FileResult):
+        return file_response(request,serialized_result,status=status)
+    if isinstance(serialized_result,StreamedResult):
+        return StreamingHttpResponse(serialized_result,content_type=serialized_result.content_type,status=status)
+    return with_columnar(serialized_result,HttpResponse(serialized_result,content_type=content_type,status=status))
+
+def with_etag(request,response):
+    """
+    Sets an ETag on the response.  If the request's If-None-Match header carries the
+    same ETag, returns a 304 Not Modified response instead.  Streamed responses have
+    no ETag, as their content is not known up front, nor do file responses, whose
+    content may be a range or served by the front end server.
+    """
+    if getattr(response,'streaming',False) or response.has_header('Accept-Ranges'):
+        return response
+    etag = '"%s"' % hashlib.md5(response.content).hexdigest()
+    if etag in request.META.get('HTTP_IF_NONE_MATCH',''):
+        not_modified = HttpResponseNotModified()
+        if response.has_header('Cache-Control'):
+            not_modified['Cache-Control'] = response['Cache-Control']
+        response = not_modified
+    response['ETag'] = etag
+    return response
+
 def directory(request,app=None,version=None,extension='html'):
     """
     Gets a complete directory of the function descriptors.
@@ -37,7 +82,7 @@ def directory(request,app=None,version=None,extension='html'):
     check_extension(extension)
 
     descriptors = registry.directory(app_label=app,specified_version=version)
-    return render_to_response('sharrock/directory.%s' % extension,{'descriptors':descriptors,'api_root':api_root,'resource_root':resource_root})
+    return with_etag(request,render_to_response('sharrock/directory.%s' % extension,{'descriptors':descriptors,'api_root':api_root,'resource_root':resource_root}))
 
 
 def describe_service(request,app,version,service_name,extension='html',service_type='function'):
@@ -48,14 +93,15 @@ def describe_service(request,app,version,service_name,extension='html',service_t
 
     try:
         if service_type == 'resource':
-            return render_to_response('sharrock/resource.%s' % extension,
-                                      {'resource':registry.get_descriptor(app,version,service_name),'api_root':api_root,'resource_root':resource_root})
+            return with_etag(request,render_to_response('sharrock/resource.%s' % extension,
+                                                        {'resource':registry.get_descriptor(app,version,service_name),'api_root':api_root,'resource_root':resource_root}))
         else:
-            return render_to_response('sharrock/descriptor.%s' % extension,
-                                      {'descriptor':registry.get_descriptor(app,version,service_name),'api_root':api_root,'resource_root':resource_root})
+            return with_etag(request,render_to_response('sharrock/descriptor.%s' % extension,
+                                                        {'descriptor':registry.get_descriptor(app,version,service_name),'api_root':api_root,'resource_root':resource_root}))
     except KeyError:
         raise Http404
 
+@record_traffic(FUNCTION)
 def execute_service(request,app,version,service_name,extension='json'):
     """
     Executes the named service.
@@ -65,15 +111,21 @@ def execute_service(request,app,version,service_name,extension='json'):
     try:
         service = registry.get_descriptor(app,version,service_name)
         serialized_result = service.http_service(request,format=extension)
-        response = HttpResponse(serialized_result,get_response_mimetype(extension))
+        response = make_response(request,serialized_result,get_response_mimetype(extension))
         if service.is_deprecated:
             # set warning header
             response['Warning'] = 'METHOD DEPRECATED: %s' % service.is_deprecated
-        return response
+        if service.cache_control and request.method == 'GET':
+            # cacheable response, clients may revalidate with the etag
+            response['Cache-Control'] = service.cache_control
+            response = with_etag(request,response)
+        return pin_to_primary(request,response)
     except AccessDenied as ad:
         return HttpResponse(unicode(ad),status=403)
     except ParamRequired as pr:
         return HttpResponse(unicode(pr),status=400) # missing parameter
+    except BadRequest as br:
+        return HttpResponse(unicode(br),status=400) # malformed request
     except Conflict as con:
         return HttpResponse(unicode(con),status=409) # something user-resolvable is wrong with the function
     except FailedToLocate as ftl:
@@ -82,6 +134,7 @@ def execute_service(request,app,version,service_name,extension='json'):
         log.exception('Exception while accessing function %s.' % service_name)
         raise e
 
+@record_traffic(RESOURCE)
 def execute_resource(request,app,version,resource_name,extension='json',model_id=None):
     """
     Executes the specified resource.
@@ -94,14 +147,20 @@ def execute_resource(request,app,version,resource_name,extension='json',model_id
         except KeyError:
             raise Http404
         status_code, response_headers, serialized_result = resource.http_service(request,format=extension)
-        response = HttpResponse(content=serialized_result,content_type=response_headers['Content-type'],status=status_code)
+        response = make_response(request,serialized_result,response_headers['Content-type'],status=status_code)
         for header_name, header_value  in response_headers.items():
-            response[header_name] = header_value
-        return response
+            if header_name.lower() != 'content-type':
+                response[header_name] = header_value
+        if 'Cache-Control' in response_headers:
+            # cacheable response, clients may revalidate with the etag
+            response = with_etag(request,response)
+        return pin_to_primary(request,response,getattr(resource,'read_database',None))
     except AccessDenied as ad:
         return HttpResponse(unicode(ad),status=403) # access denied within the descriptor
     except ParamRequired as pr:
         return HttpResponse(unicode(pr),status=400) # there is a missing required parameter
+    except BadRequest as br:
+        return HttpResponse(unicode(br),status=400) # the request is malformed
     except MethodNotAllowed as mna:
         return HttpResponse(unicode(mna),status=405) # the employed http method is not supported
     except Conflict as con:
@@ -0,0 +1,52 @@
+"""
+Runs the Sharrock benchmarks in-process.
+
+    python -m sharrock_benchmark [--baseline=FILE] [--save] [--threshold=0.1] [benchmark names]
+
+With --save the results are written to the baseline file.  Otherwise, if the
+baseline file exists, the results are compared against it and the process exits
+with status 1 if any benchmark has regressed by more than the threshold.
+"""
+import os
+import sys
+from optparse import OptionParser
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE','sharrock_benchmark.settings')
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] [benchmark names]')
+    parser.add_option('--baseline',dest='baseline',default='sharrock_benchmark_baseline.json',help='Path to the JSON baseline file.')
+    parser.add_option('--save',dest='save',action='store_true',default=False,help='Store the results as the new baseline.')
+    parser.add_option('--threshold',dest='threshold',type='float',default=0.1,help='Allowed slowdown against the baseline, as a fraction.  Default 0.1.')
+    parser.add_option('--users',dest='users',type='int',default=200,help='Number of users to create for the model resource benchmarks.')
+    options, names = parser.parse_args(argv)
+
+    from django.core.management import call_command
+    from sharrock import registry, benchmark
+    from sharrock_benchmark import cases
+
+    call_command('syncdb',interactive=False,verbosity=0)
+    registry.ensure_registry()
+    cases.setup_data(user_count=options.users)
+
+    results = benchmark.run_benchmarks(cases.build_cases(),names=names)
+
+    if options.save:
+        benchmark.report(results)
+        benchmark.save_baseline(options.baseline,results)
+        return 0
+
+    baseline = None
+    if os.path.exists(options.baseline):
+        baseline = benchmark.load_baseline(options.baseline)
+    benchmark.report(results,baseline=baseline)
+
+    if baseline:
+        regressions = benchmark.compare(results,baseline,threshold=options.threshold)
+        if regressions:
+            sys.stderr.write('Regressions beyond %.0f%%: %s\n' % (options.threshold * 100,benchmark.BenchmarkRegression(regressions)))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Benchmark cases for the Sharrock request path.  Each case drives one of the
+views in-process through Django's RequestFactory.
+"""
+import json
+import urllib
+from django.test.client import RequestFactory
+from django.contrib.auth.models import User
+from sharrock import views
+from sharrock.benchmark import Benchmark
+
+factory = RequestFactory()
+
+def setup_data(user_count=200):
+    """
+    Populates the database used by the model resource cases.
+    """
+    User.objects.bulk_create([User(username='user%d' % i,email='user%d@example.com' % i) for i in xrange(user_count)])
+
+def service_case(name,app,service_name,method='get',data=None,content_type=None,iterations=1000):
+    """
+    Creates a benchmark for views.execute_service.
+    """
+    path = '/api/%s/1.0/%s.json' % (app,service_name)
+    def run():
+        if method == 'post':
+            request = factory.post(path,data=data,content_type=content_type)
+        else:
+            request = factory.get(path,data or {})
+        views.execute_service(request,app,'1.0',service_name,extension='json')
+    return Benchmark(name,run,iterations=iterations)
+
+def resource_case(name,app,resource_name,method='get',context=None,data=None,iterations=1000):
+    """
+    Creates a benchmark for views.execute_resource.
+    """
+    if context:
+        path = '/resources/%s/1.0/%s/%s.json' % (app,resource_name,context)
+    else:
+        path = '/resources/%s/1.0/%s.json' % (app,resource_name)
+    if method != 'get' and data:
+        path = '%s?%s' % (path,urllib.urlencode(data)) # the resource client sends params in the query string
+    def run():
+        if method == 'get':
+            request = factory.get(path,data or {})
+        else:
+            request = factory.generic(method.upper(),path) # empty body, as sent by the resource client
+        views.execute_resource(request,app,'1.0',resource_name,extension='json')
+    return Benchmark(name,run,iterations=iterations)
+
+def describe_case(name,app,service_name,service_type='function',extension='json',iterations=1000):
+    """
+    Creates a benchmark for views.describe_service.
+    """
+    def run():
+        views.describe_service(factory.get('/'),app,'1.0',service_name,extension=extension,service_type=service_type)
+    return Benchmark(name,run,iterations=iterations)
+
+def directory_case(name,app=None,extension='json',iterations=200):
+    """
+    Creates a benchmark for views.directory.
+    """
+    def run():
+        views.directory(factory.get('/'),app=app,version='1.0' if app else None,extension=extension)
+    return Benchmark(name,run,iterations=iterations)
+
+def build_cases():
+    """
+    Builds the full list of benchmark cases.
+    """
+    first_user_pk = User.objects.order_by('pk')[0].pk
+    large_params = dict([('unicode_%d' % i,'text') for i in range(10)] +
+                        [('integer_%d' % i,i) for i in range(10)] +
+                        [('float_%d' % i,i * 1.5) for i in range(10)] +
+                        [('boolean_%d' % i,'1') for i in range(10)])
+    large_params['ids'] = range(100)
+    large_payload = json.dumps({'rows':[{'id':i,'name':'row %d' % i,'tags':['a','b','c']} for i in xrange(2000)]})
+
+    return [
+        # sharrock_example
+        service_case('service.helloworld','sharrock_example','helloworld',data={'name':'Loren'}),
+        service_case('service.postdata','sharrock_example','postdata',method='post',data=json.dumps({'foo':'bar'}),content_type='application/json'),
+        describe_case('describe.helloworld.json','sharrock_example','helloworld'),
+        describe_case('describe.helloworld.html','sharrock_example','helloworld',extension='html',iterations=200),
+        directory_case('directory.sharrock_example','sharrock_example'),
+        directory_case('directory.all',iterations=100),
+
+        # sharrock_resource_example
+        resource_case('resource.meresource.get','sharrock_resource_example','meresource'),
+        resource_case('resource.meresource.post','sharrock_resource_example','meresource',method='post',data={'name':'Loren'}),
+        describe_case('describe.meresource.json','sharrock_resource_example','meresource',service_type='resource'),
+
+        # sharrock_modelresource_example
+        resource_case('modelresource.userresource.get','sharrock_modelresource_example','userresource',context=first_user_pk),
+        resource_case('modelresource.userresource.list','sharrock_modelresource_example','userresource',context='list',iterations=100),
+
+        # synthetic
+        service_case('synthetic.largeparams','sharrock_benchmark','largeparams',data=large_params),
+        service_case('synthetic.largepayload','sharrock_benchmark','largepayload',method='post',data=large_payload,content_type='application/json',iterations=100),
+        service_case('synthetic.largeresult','sharrock_benchmark','largeresult',data={'count':2000},iterations=100),
+    ]
@@ -0,0 +1,41 @@
+"""
+Synthetic descriptors used by the benchmarks to exercise large param lists and
+large payloads.
+"""
+from sharrock.descriptors import Descriptor, UnicodeParam, IntegerParam, FloatParam, BooleanParam, ListParam, DictParam
+
+version = '1.0'
+
+class LargeParams(Descriptor):
+    """
+    Accepts a large number of keyword params of mixed types.
+    """
+    for i in range(10):
+        locals()['unicode_%d' % i] = UnicodeParam('unicode_%d' % i,default='value')
+        locals()['integer_%d' % i] = IntegerParam('integer_%d' % i,default=0)
+        locals()['float_%d' % i] = FloatParam('float_%d' % i,default=0.0)
+        locals()['boolean_%d' % i] = BooleanParam('boolean_%d' % i,default=False)
+    del i
+    ids = ListParam('ids',IntegerParam('id'))
+
+    def execute(self,request,data,params):
+        return len(params)
+
+class LargePayload(Descriptor):
+    """
+    Accepts a large posted data object and echoes back a summary.
+    """
+    data_parsing = True
+    rows = ListParam('rows',DictParam('row'),required=True)
+
+    def execute(self,request,data,params):
+        return {'count':len(params['rows'])}
+
+class LargeResult(Descriptor):
+    """
+    Returns a large list of rows.
+    """
+    count = IntegerParam('count',default=1000)
+
+    def execute(self,request,data,params):
+        return [{'id':i,'name':'row %d' % i,'score':i * 0.5,'active':i % 2 == 0} for i in xrange(params['count'])]
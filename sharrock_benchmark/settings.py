@@ -0,0 +1,25 @@
+"""
+Django settings for running the Sharrock benchmarks in-process on sqlite.
+"""
+DEBUG = False
+
+DATABASES = {
+    'default':{
+        'ENGINE':'django.db.backends.sqlite3',
+        'NAME':':memory:',
+    }
+}
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'sharrock',
+    'sharrock_example',
+    'sharrock_resource_example',
+    'sharrock_modelresource_example',
+    'sharrock_benchmark',
+)
+
+SECRET_KEY = 'sharrock-benchmark'
+
+ROOT_URLCONF = 'sharrock_benchmark.urls'
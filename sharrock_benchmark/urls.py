@@ -0,0 +1,13 @@
+"""
+URLs for the benchmark project.
+"""
+try:
+    from django.conf.urls import include, url, patterns
+except ImportError:
+    # old import pattern
+    from django.conf.urls.defaults import *
+
+urlpatterns = patterns('',
+    (r'^api/',include('sharrock.urls')),
+    (r'^resources/',include('sharrock.resource_urls')),
+)
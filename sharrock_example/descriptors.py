@@ -1,7 +1,12 @@
 """
 Sharrock descriptors for example.
 """
-from sharrock.descriptors import Descriptor, UnicodeParam, IntegerParam, FloatParam, ListParam, DictParam, SecurityCheck
+from sharrock.descriptors import Descriptor, UnicodeParam, IntegerParam, FloatParam, ListParam, DictParam, FileParam, StreamParam, SecurityCheck
+from sharrock.files import FileResult
+import hashlib
+import itertools
+import tempfile
+import time
 
 version = '1.0'
 
@@ -48,11 +53,105 @@ class HelloWorld(Descriptor):
 
 class PostData(Descriptor):
     """
-    A service to which a json data object is posted.
+    A service to which a json data object is posted.  Posting the same data
+    twice has no further effect, so clients may retry it.
     """
+    idempotent = True
+
     def execute(self,request,data,params):
         """
         Executes the service.
         """
         bar = data['foo']
         return {'grommit':bar}
+
+class CachedHello(Descriptor):
+    """
+    Says hello, with a response clients may cache for a minute.
+    """
+    cache_control = 'max-age=60'
+    name = UnicodeParam('name',required=False,default='world',description='The name to address.')
+
+    def execute(self,request,data,params):
+        """
+        Executes service.
+        """
+        return 'Hello %s!' % params['name']
+
+class SlowReport(Descriptor):
+    """
+    An expensive report.  Concurrent identical requests share a single execution,
+    so the execution number is the same for all of them.
+    """
+    single_flight = True
+    name = UnicodeParam('name',required=False,default='world',description='The name to report on.')
+    executions = itertools.count(1)
+
+    def execute(self,request,data,params):
+        """
+        Executes service.
+        """
+        time.sleep(0.2)
+        return {'name':params['name'],'execution':next(self.executions)}
+
+class Count(Descriptor):
+    """
+    Counts to a number, streaming the numbers as they are generated.  Fails part way
+    if fail_at is given.
+    """
+    to = IntegerParam('to',required=False,default=10,description='The number to count to.')
+    fail_at = IntegerParam('fail_at',required=False,description='The number to fail at.')
+
+    def execute(self,request,data,params):
+        """
+        Executes service.
+        """
+        for number in xrange(1,params['to'] + 1):
+            if number == params['fail_at']:
+                raise ValueError('Failed at %d.' % number)
+            yield {'number':number}
+
+class Export(Descriptor):
+    """
+    Exports the numbers to a number and their squares as a CSV file, which is served
+    as it is rather than serialized.
+    """
+    rows = IntegerParam('rows',required=False,default=1000,description='The number of rows to export.')
+
+    def execute(self,request,data,params):
+        """
+        Executes service.
+        """
+        f = tempfile.TemporaryFile()
+        for number in xrange(1,params['rows'] + 1):
+            f.write('%d,%d\n' % (number,number * number))
+        f.seek(0)
+        return FileResult(f,content_type='text/csv',filename='numbers.csv')
+
+class Checksum(Descriptor):
+    """
+    Checksums an uploaded file, which is spooled to disk rather than held in memory.
+    """
+    upload = FileParam('upload',required=True,description='The file to checksum.')
+    label = UnicodeParam('label',required=False,description='A label to return with the checksum.')
+
+    def execute(self,request,data,params):
+        """
+        Executes service.
+        """
+        md5 = hashlib.md5()
+        for chunk in params['upload'].chunks():
+            md5.update(chunk)
+        return {'name':params['upload'].name,'size':params['upload'].size,'md5':md5.hexdigest(),'label':params['label']}
+
+class LineCount(Descriptor):
+    """
+    Counts the lines of an upload as it is read.
+    """
+    upload = StreamParam('upload',required=True,description='The text to count the lines of.')
+
+    def execute(self,request,data,params):
+        """
+        Executes service.
+        """
+        return {'lines':sum(chunk.count('\n') for chunk in params['upload'])}
@@ -1,5 +1,6 @@
 from sharrock.modelresource import ModelResource
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Permission
+from sharrock_modelresource_example.models import Article
 
 version = '1.0'
 
@@ -8,3 +9,22 @@ class UserResource(ModelResource):
     ModelResource for a User.
     """
     model = User
+    expandable = ('groups','user_permissions')
+    filterable = {'username':('exact','in','prefix'),'date_joined':('range',),'id':('exact','in','range')}
+    orderable = ('username','id','date_joined')
+    aggregatable = ('id','date_joined')
+    groupable = ('is_staff','is_active')
+
+class PermissionResource(ModelResource):
+    """
+    ModelResource for a Permission.
+    """
+    model = Permission
+    expandable = ('content_type',)
+
+class ArticleResource(ModelResource):
+    """
+    ModelResource for an Article, with a change feed.
+    """
+    model = Article
+    change_field = 'updated'
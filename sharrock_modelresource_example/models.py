@@ -0,0 +1,12 @@
+from django.db import models
+
+class Article(models.Model):
+    """
+    An article, with a last modified time for change feeds.
+    """
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    updated = models.DateTimeField(auto_now=True,db_index=True)
+
+    def __unicode__(self):
+        return self.title